@@ -5,12 +5,19 @@ Prints product labels with QR codes from CSV file
 """
 
 import csv
-import qrcode
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from brother_ql.conversion import convert
-from brother_ql.backends.helpers import send
 from brother_ql.raster import BrotherQLRaster
 import io
+import sys
+from pathlib import Path
+
+# Shared rendering utilities live alongside the web app
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'webapp'))
+
+import qr_utils
+import text_layout
+from printer_session import DEFAULT_BACKEND, send
 
 def create_label_image(product_name, label_width=696, label_height=271):
     """
@@ -28,16 +35,8 @@ def create_label_image(product_name, label_width=696, label_height=271):
     img = Image.new('RGB', (label_width, label_height), 'white')
     draw = ImageDraw.Draw(img)
 
-    # Generate QR code - sized for 62mm label
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=3,
-        border=2,
-    )
-    qr.add_data(product_name)
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white")
+    # Generate QR code - sized for 62mm label (1-bit, cached per payload)
+    qr_img = qr_utils.qr_image(product_name, box_size=3, border=2)
 
     # Calculate QR code size and position
     qr_width, qr_height = qr_img.size
@@ -48,60 +47,15 @@ def create_label_image(product_name, label_width=696, label_height=271):
     img.paste(qr_img, (qr_x, qr_y))
 
     # Add product name on the left side - BOLD and as large as possible
-    # Try to find bold font
-    font_path = "/System/Library/Fonts/Helvetica.ttc"
-    font_index = 1  # Index 1 is Helvetica Bold
-
     # Try different font sizes from largest to smallest
     font_sizes = [48, 44, 40, 36, 32, 28, 24, 20]
     max_width = qr_x - 20
     max_height = label_height - 20
-    best_font = None
-    best_lines = []
-
-    for size in font_sizes:
-        try:
-            font = ImageFont.truetype(font_path, size, index=font_index)
-        except:
-            try:
-                font = ImageFont.truetype(font_path, size)
-            except:
-                font = ImageFont.load_default()
-
-        # Wrap text with this font size
-        words = product_name.split()
-        lines = []
-        current_line = []
-
-        for word in words:
-            test_line = ' '.join(current_line + [word])
-            bbox = draw.textbbox((0, 0), test_line, font=font)
-            if bbox[2] - bbox[0] <= max_width:
-                current_line.append(word)
-            else:
-                if current_line:
-                    lines.append(' '.join(current_line))
-                current_line = [word]
-
-        if current_line:
-            lines.append(' '.join(current_line))
-
-        # Check if text fits vertically
-        line_height = size + 8
-        total_height = len(lines) * line_height
-
-        if total_height <= max_height:
-            best_font = font
-            best_lines = lines
-            break
-
-    # If no font worked, use the smallest
-    if best_font is None:
-        try:
-            best_font = ImageFont.truetype(font_path, font_sizes[-1], index=font_index)
-        except:
-            best_font = ImageFont.load_default()
-        best_lines = lines
+    # Largest size whose wrapped lines fit vertically (memoized per text and box)
+    layout = text_layout.fit_text(product_name, max_width, font_sizes,
+                                  max_height=max_height, leading=8)
+    best_font = layout.font
+    best_lines = layout.lines
 
     # Draw text
     line_height = best_font.size + 8 if hasattr(best_font, 'size') else 28
@@ -112,7 +66,7 @@ def create_label_image(product_name, label_width=696, label_height=271):
 
     return img
 
-def print_label(printer_identifier, product_name, label_type='62', cut=True):
+def print_label(printer_identifier, product_name, label_type='62', cut=True, backend_identifier=DEFAULT_BACKEND):
     """
     Print a single label
 
@@ -121,6 +75,7 @@ def print_label(printer_identifier, product_name, label_type='62', cut=True):
         product_name: Product name to print
         label_type: Label size (default: '62' for 62mm continuous)
         cut: Whether to cut after printing (default: True)
+        backend_identifier: Printer backend, e.g. 'emulator' for a dry run (default: printer_session.DEFAULT_BACKEND)
     """
     # Create label image
     img = create_label_image(product_name)
@@ -141,10 +96,12 @@ def print_label(printer_identifier, product_name, label_type='62', cut=True):
         cut=cut
     )
 
-    # Send to printer
-    send(instructions=instructions, printer_identifier=printer_identifier, backend_identifier='pyusb', blocking=True)
+    # Send to printer (device stays open between labels)
+    send(instructions=instructions, printer_identifier=printer_identifier, backend_identifier=backend_identifier,
+         blocking=True)
 
-def print_all_products(csv_file, printer_identifier='usb://0x04f9:0x2042', label_type='62', no_cut=False):
+def print_all_products(csv_file, printer_identifier='usb://0x04f9:0x2042', label_type='62', no_cut=False,
+                       backend_identifier=DEFAULT_BACKEND):
     """
     Print labels for all products in CSV file
 
@@ -153,6 +110,7 @@ def print_all_products(csv_file, printer_identifier='usb://0x04f9:0x2042', label
         printer_identifier: Printer identifier
         label_type: Label size
         no_cut: If True, print continuously without cutting (default: False)
+        backend_identifier: Printer backend, e.g. 'emulator' for a dry run (default: printer_session.DEFAULT_BACKEND)
     """
     with open(csv_file, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
@@ -168,7 +126,8 @@ def print_all_products(csv_file, printer_identifier='usb://0x04f9:0x2042', label
         print(f"Printing {i}/{len(products)}: {product_name}")
 
         try:
-            print_label(printer_identifier, product_name, label_type, cut=not no_cut)
+            print_label(printer_identifier, product_name, label_type, cut=not no_cut,
+                        backend_identifier=backend_identifier)
             print(f"  ✓ Printed successfully")
         except Exception as e:
             print(f"  ✗ Error: {e}")
@@ -194,6 +153,9 @@ if __name__ == "__main__":
                         help='Print only the first product as a test')
     parser.add_argument('--no-cut', action='store_true',
                         help='Print continuously without cutting (cut manually later)')
+    parser.add_argument('--backend', default=DEFAULT_BACKEND,
+                        help=f"Printer backend: pyusb, network, linux_kernel, or emulator for a dry run "
+                             f"(default: {DEFAULT_BACKEND}, set with LABEL_PRINTER_BACKEND)")
 
     args = parser.parse_args()
 
@@ -202,7 +164,7 @@ if __name__ == "__main__":
             reader = csv.DictReader(f)
             first_product = next(reader)['Product Name']
         print(f"Test printing: {first_product}")
-        print_label(args.printer, first_product, args.label, cut=not args.no_cut)
+        print_label(args.printer, first_product, args.label, cut=not args.no_cut, backend_identifier=args.backend)
         print("Test complete!")
     else:
-        print_all_products(args.csv_file, args.printer, args.label, no_cut=args.no_cut)
+        print_all_products(args.csv_file, args.printer, args.label, no_cut=args.no_cut, backend_identifier=args.backend)
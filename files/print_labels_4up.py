@@ -5,13 +5,102 @@ Arranges products in a grid (columns × rows) to save space
 """
 
 import csv
-import qrcode
-from PIL import Image, ImageDraw, ImageFont
-from brother_ql.conversion import convert
-from brother_ql.backends.helpers import send
+import functools
+import os
+from PIL import Image
+from brother_ql.devicedependent import label_type_specs, ENDLESS_LABEL
 from brother_ql.raster import BrotherQLRaster
+import sys
+from pathlib import Path
+
+# Shared rendering utilities live alongside the web app
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'webapp'))
+
+import csv_index
+import csv_ingest
+import fleet
+import journal
+import label_templates
+import metrics
+import pipeline
+import raster_cache
+import raster_utils
+import render_dedup
+from printer_session import DEFAULT_BACKEND, send
+from raster_utils import convert
+
+# Grid geometry: one row of cells is a landscape label's height
+CELL_HEIGHT = 250
+# Pixels between neighbouring cells (a separator line runs down the middle)
+CELL_GAP = 2
+
+def grid_geometry(label_width=696, columns=4, rows=1, scale=1.0, label_height=None):
+    """
+    Cell size, label height and gap for a columns × rows grid
+
+    Args:
+        label_width: Landscape label width in pixels
+        columns: Number of columns
+        rows: Number of rows
+        scale: Size of the layout relative to the 250px-per-row landscape label
+        label_height: Fixed label height to divide between the rows (default: rows at scale)
+
+    Returns:
+        (cell_width, cell_height, label_height, gap)
+    """
+    gap = max(1, round(CELL_GAP * scale))
+    cell_width = (label_width - (columns - 1) * gap) // columns  # ~174px per column
+    if label_height is None:
+        cell_height = round(CELL_HEIGHT * scale)
+        label_height = rows * cell_height + (rows - 1) * gap
+    else:
+        cell_height = (label_height - (rows - 1) * gap) // rows
+    return cell_width, cell_height, label_height, gap
+
+def cell_template(cell_width=174, cell_height=CELL_HEIGHT, scale=1.0):
+    """
+    Template elements for one product cell: VERTICAL TEXT on LEFT, QR code on RIGHT
+
+    Args:
+        cell_width: Width in pixels (~174px for 4 columns)
+        cell_height: Height in pixels (250px for landscape label)
+        scale: Size of QR, fonts and margins relative to the 250px-high cell
+
+    Returns:
+        List of label_templates elements in cell coordinates
+    """
+    margin = round(5 * scale)
 
-def create_single_product_cell(product_name, cell_width=174, cell_height=250):
+    # QR code on RIGHT side - smaller for 4-up layout
+    qr_size = round(100 * scale)  # Smaller QR for 4 products
+    qr_x = cell_width - qr_size - margin
+
+    return [
+        {'type': 'qr', 'box': [qr_x, (cell_height - qr_size) // 2, qr_size, qr_size], 'border': 1},
+        # Vertical text (reads bottom to top) on the LEFT: lines run along the
+        # cell height, up to 3 of them stack across the space left of the QR
+        {'type': 'text', 'rotate': 90, 'box': [margin, 0, cell_width - margin, cell_height], 'padding': margin,
+         'max_width': cell_height - round(20 * scale), 'max_height': qr_x - round(15 * scale),
+         'sizes': [round(size * scale) for size in (18, 16, 14, 12, 10)], 'max_lines': 3,
+         'leading': round(4 * scale), 'metric': 'ink'},
+    ]
+
+def grid_template(label_width=696, columns=4, rows=1, scale=1.0, label_height=None):
+    """Template for a columns × rows grid label (see grid_geometry for the arguments)"""
+    cell_width, cell_height, label_height, gap = grid_geometry(label_width, columns, rows, scale, label_height)
+    return {
+        'size': [label_width, label_height],
+        'grid': {'columns': columns, 'rows': rows, 'gap': gap,
+                 'separator': {'color': 'lightgray', 'width': max(1, round(scale))}},
+        'elements': cell_template(cell_width, cell_height, scale),
+    }
+
+@functools.lru_cache(maxsize=32)
+def grid_plan(label_width=696, columns=4, rows=1, mode='RGB', scale=1.0, label_height=None):
+    """Compiled grid template - separators drawn once, only the cells are drawn per label"""
+    return label_templates.compile_template(grid_template(label_width, columns, rows, scale, label_height), mode)
+
+def create_single_product_cell(product_name, cell_width=174, cell_height=CELL_HEIGHT, mode='RGB'):
     """
     Create a single product cell with VERTICAL TEXT on LEFT and QR code on RIGHT
 
@@ -19,170 +108,71 @@ def create_single_product_cell(product_name, cell_width=174, cell_height=250):
         product_name: Name of the product
         cell_width: Width in pixels (~174px for 4 columns)
         cell_height: Height in pixels (250px for landscape label)
+        mode: Canvas mode - 'RGB', or 'L' / '1' to draw natively in grey / 1-bit
 
     Returns:
         PIL Image object
     """
-    # Create white background for this cell
-    img = Image.new('RGB', (cell_width, cell_height), 'white')
-    draw = ImageDraw.Draw(img)
-
-    # Bold font
-    font_path = "/System/Library/Fonts/Helvetica.ttc"
-    font_index = 1  # Helvetica Bold
+    return grid_plan(cell_width, 1, 1, mode, label_height=cell_height).render(product_name)
 
-    # QR code on RIGHT side - smaller for 4-up layout
-    qr_size = 100  # Smaller QR for 4 products
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=3,
-        border=1,
-    )
-    qr.add_data(product_name)
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    qr_img = qr_img.resize((qr_size, qr_size))
-
-    # Position QR on RIGHT side
-    qr_x = cell_width - qr_size - 5
-    qr_y = (cell_height - qr_size) // 2
-    img.paste(qr_img, (qr_x, qr_y))
-
-    # Create VERTICAL TEXT on LEFT side with wrapping
-    # Try font sizes for vertical text
-    font_sizes = [18, 16, 14, 12, 10]
-    text_area_height = cell_height - 20  # Available height for text
-    text_area_width = qr_x - 15  # Width available for text (when rotated, this is the height)
-
-    best_font = None
-    best_lines = []
-    max_lines = 3  # Maximum number of wrapped lines
-
-    for size in font_sizes:
-        try:
-            font = ImageFont.truetype(font_path, size, index=font_index)
-        except:
-            font = ImageFont.load_default()
-
-        # Wrap text into multiple lines
-        words = product_name.split()
-        lines = []
-        current_line = []
-
-        for word in words:
-            test_line = ' '.join(current_line + [word])
-            bbox = draw.textbbox((0, 0), test_line, font=font)
-            line_width = bbox[2] - bbox[0]
-
-            # Check if line fits in available height (when rotated)
-            if line_width <= text_area_height:
-                current_line.append(word)
-            else:
-                if current_line:
-                    lines.append(' '.join(current_line))
-                    current_line = [word]
-                else:
-                    lines.append(word)  # Word too long, add anyway
-
-        if current_line:
-            lines.append(' '.join(current_line))
-
-        # Check if all lines fit in available width (when rotated, this is horizontal space)
-        if len(lines) <= max_lines:
-            # Calculate total width needed for all lines
-            bbox = draw.textbbox((0, 0), "Ay", font=font)
-            line_height = (bbox[3] - bbox[1]) + 4
-            total_width = len(lines) * line_height
-
-            if total_width <= text_area_width:
-                best_font = font
-                best_lines = lines[:max_lines]
-                break
-
-    # Use smallest font if nothing fits
-    if best_font is None:
-        try:
-            best_font = ImageFont.truetype(font_path, font_sizes[-1], index=font_index)
-        except:
-            best_font = ImageFont.load_default()
-        best_lines = lines[:max_lines] if lines else [product_name]
-
-    # Create text image with wrapped lines
-    bbox = draw.textbbox((0, 0), "Ay", font=best_font)
-    line_height = (bbox[3] - bbox[1]) + 4
-
-    # Calculate dimensions for multi-line text
-    max_line_width = 0
-    for line in best_lines:
-        bbox = draw.textbbox((0, 0), line, font=best_font)
-        line_width = bbox[2] - bbox[0]
-        max_line_width = max(max_line_width, line_width)
-
-    # Create horizontal text image first
-    text_img_width = max_line_width + 10
-    text_img_height = (len(best_lines) * line_height) + 10
-    text_img = Image.new('RGB', (text_img_width, text_img_height), 'white')
-    text_draw = ImageDraw.Draw(text_img)
-
-    # Draw each line
-    y_pos = 5
-    for line in best_lines:
-        text_draw.text((5, y_pos), line, fill='black', font=best_font)
-        y_pos += line_height
-
-    # Rotate text 90 degrees counter-clockwise (reads bottom to top)
-    text_img = text_img.rotate(90, expand=True)
-
-    # Position rotated text on LEFT side
-    text_x = 5
-    text_y = (cell_height - text_img.height) // 2
-    img.paste(text_img, (text_x, text_y))
-
-    return img
-
-def create_grid_label(products, label_width=696, columns=4, rows=1):
+@metrics.timed('render')
+def create_grid_label(products, label_width=696, columns=4, rows=1, mode='RGB', scale=1.0, label_height=None):
     """
-    Create a label with products arranged HORIZONTALLY
-    Landscape orientation: 4 products side by side (vertical text + QR)
+    Create a label with products arranged in a grid
+    Landscape orientation: columns side by side, rows stacked (vertical text + QR per cell)
 
     Args:
-        products: List of product names
+        products: List of product names, filled row by row
         label_width: Total width (696px for 62mm)
         columns: Number of columns (default: 4)
         rows: Number of rows (default: 1)
+        mode: Canvas mode - 'RGB', or 'L' / '1' to draw natively in grey / 1-bit
+        scale: Size of the cell contents (default: 1.0, 250px per row)
+        label_height: Fixed label height shared by the rows (default: rows at scale)
 
     Returns:
         PIL Image object
     """
-    gap = 2  # Small gap between cells
-    cell_width = (label_width - (columns - 1) * gap) // columns  # ~174px per column
-    cell_height = 250  # Landscape label height
-    label_height = cell_height
+    # Extra products don't fit on this label
+    return grid_plan(label_width, columns, rows, mode, scale, label_height).render(list(products[:columns * rows]))
 
-    # Create main label canvas
-    label = Image.new('RGB', (label_width, label_height), 'white')
-
-    # Place products horizontally
-    for idx, product_name in enumerate(products):
-        if idx >= columns:
-            break  # Don't exceed 4 products per label
-
-        x_position = idx * (cell_width + gap)
-        y_position = 0
+def create_native_grid_label(products, label_type='62', columns=4, rows=1, mode='RGB'):
+    """
+    Create a grid label already in the printer's raster orientation
 
-        cell = create_single_product_cell(product_name, cell_width, cell_height)
-        label.paste(cell, (x_position, y_position))
+    The landscape grid is laid out at the tape's full printable width (the
+    size the raster stage used to scale it up to) and turned with one
+    lossless transpose, so it prints with rotate='0' - no rotation or
+    resampling of the full label in the raster stage.
 
-        # Draw vertical separator lines between products
-        if idx < columns - 1:
-            draw = ImageDraw.Draw(label)
-            line_x = x_position + cell_width + gap // 2
-            draw.line([(line_x, 0), (line_x, cell_height)], fill='lightgray', width=1)
+    Args:
+        products: List of product names, filled row by row
+        label_type: Label size (default: '62' for 62mm continuous)
+        columns: Number of columns (default: 4)
+        rows: Number of rows (default: 1)
+        mode: Canvas mode - 'RGB', or 'L' / '1' to draw natively in grey / 1-bit
 
-    return label
+    Returns:
+        PIL Image object, printable width wide
+    """
+    specs = label_type_specs[label_type]
+    tape_width = specs['dots_printable'][0]
+    if mode == 'RGB':
+        # Everything on the label is grey, and grey RGB converts to exactly
+        # these 'L' values - same dots, a third of the pixels to push around
+        mode = 'L'
+    _, _, landscape_height, _ = grid_geometry(columns=columns, rows=rows)
+    scale = tape_width / landscape_height
+    if specs['kind'] == ENDLESS_LABEL:
+        length = round(696 * scale)
+    else:
+        length = specs['dots_printable'][1]
+    label = create_grid_label(products, label_width=length, columns=columns, rows=rows, mode=mode, scale=scale,
+                              label_height=tape_width)
+    return label.transpose(Image.Transpose.ROTATE_90)
 
-def print_grid_label(printer_identifier, products, label_type='62', cut=True, columns=4, rows=1):
+def print_grid_label(printer_identifier, products, label_type='62', cut=True, columns=4, rows=1, mode='RGB',
+                     backend_identifier=DEFAULT_BACKEND):
     """
     Print a horizontal 4-up label with vertical text and QR codes
 
@@ -193,9 +183,11 @@ def print_grid_label(printer_identifier, products, label_type='62', cut=True, co
         cut: Whether to cut after printing
         columns: Number of columns (default: 4)
         rows: Number of rows (default: 1)
+        mode: Canvas mode ('1' / 'L' skip the RGB conversion in the raster stage)
+        backend_identifier: Printer backend, e.g. 'emulator' for a dry run (default: printer_session.DEFAULT_BACKEND)
     """
     # Create grid label image
-    img = create_grid_label(products, columns=columns, rows=rows)
+    img = create_native_grid_label(products, label_type, columns=columns, rows=rows, mode=mode)
 
     # Convert to Brother QL format
     qlr = BrotherQLRaster('QL-700')
@@ -203,7 +195,7 @@ def print_grid_label(printer_identifier, products, label_type='62', cut=True, co
         qlr=qlr,
         images=[img],
         label=label_type,
-        rotate='90',  # Landscape orientation (rotate 90 degrees)
+        rotate='0',  # Rendered in the printer's orientation
         threshold=70.0,
         dither=False,
         compress=False,
@@ -213,10 +205,74 @@ def print_grid_label(printer_identifier, products, label_type='62', cut=True, co
         cut=cut
     )
 
-    # Send to printer
-    send(instructions=instructions, printer_identifier=printer_identifier, backend_identifier='pyusb', blocking=True)
+    # Send to printer (device stays open between labels)
+    send(instructions=instructions, printer_identifier=printer_identifier, backend_identifier=backend_identifier,
+         blocking=True)
 
-def print_all_products_grid(csv_file, printer_identifier='usb://0x04f9:0x2042', label_type='62', no_cut=False, columns=4, rows=1):
+def build_grid_instructions(label_batches, cuts=None, label_type='62', columns=4, rows=1, mode='RGB', dedup=None):
+    """
+    Render grid labels and convert them into one multi-page instruction stream
+
+    Args:
+        label_batches: List of product name lists, one per label
+        cuts: Cut flag per label (default: cut after every label)
+        label_type: Label size (default: '62' for 62mm continuous)
+        columns: Number of columns (default: 4)
+        rows: Number of rows (default: 1)
+        mode: Canvas mode for rendering ('RGB', 'L' or '1')
+        dedup: render_dedup job token - labels with the same products are then rendered once per job
+
+    Returns:
+        Raster instruction bytes
+    """
+    if cuts is None:
+        cuts = [True] * len(label_batches)
+    options = dict(
+        rotate='0',  # Rendered in the printer's orientation
+        threshold=70.0,
+        dither=False,
+        compress=False,
+        red=False,
+        dpi_600=False,
+        hq=True,
+        cut=list(cuts)
+    )
+
+    # Convert all pages in one stream, cut flag set per page
+    qlr = BrotherQLRaster('QL-700')
+    if dedup is not None:
+        render = functools.partial(create_native_grid_label, label_type=label_type, columns=columns, rows=rows,
+                                   mode=mode)
+        layout = {'grid': [columns, rows], 'mode': mode}
+        return render_dedup.for_job(dedup).convert(qlr, [list(products) for products in label_batches], render,
+                                                   label_type, layout, mode, **options)
+    images = [create_native_grid_label(products, label_type, columns=columns, rows=rows, mode=mode)
+              for products in label_batches]
+    return convert(qlr=qlr, images=images, label=label_type, **options)
+
+def print_grid_labels(printer_identifier, label_batches, label_type='62', cuts=None, columns=4, rows=1, mode='RGB',
+                      backend_identifier=DEFAULT_BACKEND):
+    """
+    Print several grid labels as one multi-page job (one raster header, one USB transfer)
+
+    Args:
+        printer_identifier: Printer identifier
+        label_batches: List of product name lists, one per label
+        label_type: Label size (default: '62' for 62mm continuous)
+        cuts: Cut flag per label (default: cut after every label)
+        columns: Number of columns (default: 4)
+        rows: Number of rows (default: 1)
+        mode: Canvas mode for rendering ('RGB', 'L' or '1')
+        backend_identifier: Printer backend, e.g. 'emulator' for a dry run (default: printer_session.DEFAULT_BACKEND)
+    """
+    instructions = build_grid_instructions(label_batches, cuts, label_type, columns, rows, mode)
+
+    # Send the whole batch at once over the shared printer session
+    send(instructions=instructions, printer_identifier=printer_identifier, backend_identifier=backend_identifier,
+         blocking=True, pages=len(label_batches))
+
+def print_all_products_grid(csv_file, printer_identifier='usb://0x04f9:0x2042', label_type='62', no_cut=False, columns=4, rows=1,
+                            mode='RGB', workers=0, cache_dir=None, backend_identifier=DEFAULT_BACKEND):
     """
     Print all products in horizontal 4-up format (4 products per label)
 
@@ -227,13 +283,16 @@ def print_all_products_grid(csv_file, printer_identifier='usb://0x04f9:0x2042',
         no_cut: If True, print continuously without cutting
         columns: Number of columns per label (default: 4)
         rows: Number of rows per label (default: 1)
+        mode: Canvas mode for rendering ('RGB', 'L' or '1')
+        workers: Worker processes rendering labels ahead of the printer (default: 0, render inline)
+        cache_dir: Raster cache directory - labels printed before are sent from it without rendering
+        backend_identifier: Printer backend, e.g. 'emulator' for a dry run (default: printer_session.DEFAULT_BACKEND)
     """
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        products = [row['Product Name'] for row in reader]
+    # Labels are read from the row index one at a time instead of loading the whole file
+    index = csv_index.get_index(csv_file)
 
     products_per_label = columns * rows
-    total_products = len(products)
+    total_products = len(index)
     total_labels = (total_products + products_per_label - 1) // products_per_label  # Round up
 
     print(f"Found {total_products} products")
@@ -242,34 +301,165 @@ def print_all_products_grid(csv_file, printer_identifier='usb://0x04f9:0x2042',
     if no_cut:
         print("⚠️  Continuous printing mode - labels will NOT be cut automatically")
 
+    # Workers render upcoming labels while the current one prints; repeated labels are rendered once
+    token = render_dedup.new_job()
+    render = functools.partial(build_grid_instructions, label_type=label_type, columns=columns, rows=rows, mode=mode,
+                               dedup=token)
+    if cache_dir:
+        render = raster_cache.CachedRender(render, cache_dir)
+    jobs = (([index.column('Product Name', i, i + products_per_label)], [not no_cut])
+            for i in range(0, total_products, products_per_label))
+
     label_num = 0
-    for i in range(0, total_products, products_per_label):
-        batch = products[i:i+products_per_label]
-        label_num += 1
-
-        print(f"\nLabel {label_num}/{total_labels}: {len(batch)} products")
-        for j, product in enumerate(batch, 1):
-            print(f"  [{j}] {product}")
-
-        try:
-            print_grid_label(printer_identifier, batch, label_type, cut=not no_cut, columns=columns, rows=rows)
-            print(f"  ✓ Printed successfully")
-        except Exception as e:
-            print(f"  ✗ Error: {e}")
-            response = input("  Continue? (y/n): ")
-            if response.lower() != 'y':
-                break
+    with pipeline.RenderPipeline(render, workers=workers) as engine:
+        for ([batch], _), instructions, render_error in engine.results(jobs):
+            label_num += 1
+
+            print(f"\nLabel {label_num}/{total_labels}: {len(batch)} products")
+            for j, product in enumerate(batch, 1):
+                print(f"  [{j}] {product}")
+
+            try:
+                if render_error is not None:
+                    raise render_error
+                send(instructions=instructions, printer_identifier=printer_identifier,
+                     backend_identifier=backend_identifier, blocking=True)
+                print(f"  ✓ Printed successfully")
+            except Exception as e:
+                print(f"  ✗ Error: {e}")
+                response = input("  Continue? (y/n): ")
+                if response.lower() != 'y':
+                    break
 
     print(f"\nPrinting complete!")
-    print(f"Total: {label_num} labels printed ({sum([len(products[i:i+products_per_label]) for i in range(0, total_products, products_per_label)])} products)")
+    print(f"Total: {label_num} labels printed ({total_products} products)")
+    dedup = render_dedup.release(token)
+    if dedup is not None and dedup.lookups:
+        print(f"Duplicate labels: {dedup.summary()}")
+    if cache_dir and raster_cache.get_cache(cache_dir).lookups:
+        print(f"Cached: {raster_cache.get_cache(cache_dir).summary()}")
     if no_cut:
         print("Remember to cut your continuous label roll!")
 
+def print_batches_on_fleet(printers, render, jobs, batches, on_batch_done, on_batch_sent=None,
+                           backend_identifier=DEFAULT_BACKEND, weights=None):
+    """
+    Share batches out between several printers
+
+    Each printer gets one contiguous run of batches sized by its speed, so
+    its output is one ordered stack. Speeds are the labels per second each
+    printer measured on its last fleet run (saved after every run) unless
+    weights are given. Batches of a failed printer go to the others and may
+    start a second stack there; the summary lists them.
+
+    Args:
+        printers: Printer identifiers
+        render: Callable turning a job into instruction bytes
+        jobs: (label_batches, cuts) per batch
+        batches: Journal label numbers per batch, for the summary
+        on_batch_done: Called with the batch number after each batch prints
+        on_batch_sent: Called with the batch number before each batch is sent
+        backend_identifier: Printer backend, e.g. 'emulator' for a dry run (default: printer_session.DEFAULT_BACKEND)
+        weights: {printer: relative speed} (default: the rates measured on earlier runs)
+
+    Returns:
+        The fleet report (see fleet.FleetScheduler.run)
+    """
+    import threading
+
+    print(f"\n🖨️  Sharing {len(batches)} batches between {len(printers)} printers:")
+    for printer in printers:
+        print(f"    {printer}")
+
+    lock = threading.Lock()
+
+    def on_unit_done(unit_index, printer):
+        with lock:
+            print(f"  ✓ Batch {unit_index + 1}/{len(batches)} printed on {printer}")
+            on_batch_done(unit_index)
+
+    def on_unit_sent(unit_index, printer):
+        if on_batch_sent:
+            on_batch_sent(unit_index)
+
+    if weights is None:
+        weights = fleet.load_rates()
+    scheduler = fleet.FleetScheduler(printers, render, pages=lambda job: len(job[0]), send=send,
+                                     backend_identifier=backend_identifier, weights=weights,
+                                     on_unit_sent=on_unit_sent, on_unit_done=on_unit_done,
+                                     log=lambda message: print(f"  ↪ {message}"))
+    report = scheduler.run(jobs)
+    fleet.save_rates(report)
+
+    print("\n" + "="*60)
+    print("📊 FLEET SUMMARY")
+    print("="*60)
+    for result in report['printers']:
+        stacks = ', '.join(f"{batches[first][0] + 1}-{batches[last][-1] + 1}" for first, last in result['stacks'])
+        state = "ok" if result['healthy'] else f"FAILED ({result['error']})"
+        print(f"{result['printer']}: {result['units']} batches, {result['labels_per_second']:.2f} labels/s, {state}")
+        if stacks:
+            print(f"    Stacks (labels, in print order): {stacks}")
+        if len(result['stacks']) > 1:
+            print("    Took over a failed printer's labels: keep these stacks apart")
+    print(f"Fleet throughput: {report['labels_per_second']:.2f} labels/s")
+    print("="*60)
+    return report
+
+def open_journal_job(csv_file, columns, rows, label_type, journal_path=None):
+    """
+    Open the print journal and this file's job in it
+
+    Jobs are keyed by the CSV's content hash and the grid layout, so renamed
+    or moved files resume and same-named files in other folders don't mix.
+
+    Returns:
+        (journal, job_id, total_labels)
+    """
+    products_per_label = columns * rows
+    stats = csv_ingest.get_stats(csv_file)
+    total_labels = (stats['rows'] + products_per_label - 1) // products_per_label
+    log = journal.Journal(journal_path)
+    job_id = log.open_job(stats['sha256'], total_labels,
+                          settings={'layout': '4up', 'columns': columns, 'rows': rows, 'label_type': label_type},
+                          csv_path=os.path.abspath(csv_file))
+    return log, job_id, total_labels
+
+def list_failed_labels(csv_file, label_type='62', columns=4, rows=1, journal_path=None):
+    """Print the labels the journal recorded as failed, with their products"""
+    products_per_label = columns * rows
+    index = csv_index.get_index(csv_file)
+    log, job_id, total_labels = open_journal_job(csv_file, columns, rows, label_type, journal_path)
+    with log:
+        failed = log.failed(job_id)
+        summary = log.summary(job_id)
+
+    counts = ', '.join(f"{count} {state}" for state, count in summary['states'].items() if count)
+    print(f"Journal for {csv_file}: {total_labels} labels ({counts})")
+    if not failed:
+        print("No failed labels")
+        return
+    print(f"\n{len(failed)} failed labels:")
+    for label, error in failed:
+        products = index.column('Product Name', label * products_per_label, (label + 1) * products_per_label)
+        print(f"  Label {label + 1} (products {label * products_per_label + 1}-"
+              f"{label * products_per_label + len(products)}): {error}")
+        for p in products:
+            print(f"    - {p}")
+    print("\nReprint just these with --batch --reprint-failed")
+
 def print_all_products_batch(csv_file, printer_identifier='usb://0x04f9:0x2042', label_type='62',
-                            batch_size=20, columns=4, rows=1, no_resume=False):
+                            batch_size=20, columns=4, rows=1, no_resume=False, mode='RGB', workers=0,
+                            printers=None, journal_path=None, reprint_failed=False, cache_dir=None,
+                            backend_identifier=DEFAULT_BACKEND, printer_weights=None):
     """
     Print all products in batches with resume functionality
-    Cuts after each batch for easy handling
+    Each batch goes out as one multi-page print job and is cut after its last label.
+    With several printers the batches are shared out between them as contiguous runs.
+
+    Every label's state (rendered, sent, confirmed, failed) is kept in the print
+    journal, so an interrupted run resumes at the first label the printer did not
+    confirm - not at the start of its batch.
 
     Args:
         csv_file: Path to CSV file
@@ -279,9 +469,15 @@ def print_all_products_batch(csv_file, printer_identifier='usb://0x04f9:0x2042',
         columns: Number of columns per label (default: 4)
         rows: Number of rows per label (default: 1)
         no_resume: If True, force fresh start (default: False)
+        mode: Canvas mode for rendering ('RGB', 'L' or '1')
+        workers: Worker processes rendering batches ahead of the printer (default: 0, render inline)
+        printers: Printer identifiers to share the batches between (overrides printer_identifier)
+        journal_path: Print journal database (default: journal.DEFAULT_PATH)
+        reprint_failed: Only print the labels the journal recorded as failed
+        cache_dir: Raster cache directory - batches printed before are sent from it without rendering
+        backend_identifier: Printer backend, e.g. 'emulator' for a dry run (default: printer_session.DEFAULT_BACKEND)
+        printer_weights: {printer: relative speed} for sharing batches (default: speeds measured on earlier runs)
     """
-    import json
-    import os
     import time
     from datetime import datetime
 
@@ -292,53 +488,65 @@ def print_all_products_batch(csv_file, printer_identifier='usb://0x04f9:0x2042',
         print(f"Adjusting batch_size to {(batch_size // products_per_label) * products_per_label}")
         batch_size = (batch_size // products_per_label) * products_per_label
 
-    # Load all products
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        products = [row['Product Name'] for row in reader]
-
-    total_products = len(products)
-    total_batches = (total_products + batch_size - 1) // batch_size
-    labels_per_batch = batch_size // products_per_label
+    # Index the rows so a resumed job reads only the labels it still has to print
+    index = csv_index.get_index(csv_file)
 
-    # Progress file setup
-    csv_basename = os.path.basename(csv_file).replace('.csv', '')
-    progress_file = f"{csv_basename}_progress.json"
+    total_products = len(index)
+    labels_per_batch = max(1, batch_size // products_per_label)
 
-    # Check for existing progress
-    start_batch = 0
-    if os.path.exists(progress_file) and not no_resume:
-        try:
-            with open(progress_file, 'r') as f:
-                progress = json.load(f)
+    log, job_id, total_labels = open_journal_job(csv_file, columns, rows, label_type, journal_path)
+    summary = log.summary(job_id)
+    states = summary['states']
+    started = states[journal.QUEUED] < total_labels
 
-            last_batch = progress.get('last_completed_batch', -1)
-            last_product = progress.get('last_product_index', -1)
-            saved_time = progress.get('timestamp', 'unknown')
+    # Pick the labels to print this run
+    resuming = False
+    if reprint_failed:
+        labels = [label for label, _ in log.failed(job_id)]
+        if not labels:
+            print("No failed labels to reprint")
+            log.close()
+            return
+        print(f"Reprinting {len(labels)} failed labels")
+        resuming = True
+    elif started and summary['finished'] is None and not no_resume:
+        labels = log.remaining(job_id)
+        saved_time = datetime.fromtimestamp(summary['updated']).strftime('%Y-%m-%d %H:%M:%S')
+        unconfirmed = states[journal.SENT]
 
-            start_product = (last_batch + 1) * batch_size
-            end_product = min(start_product + batch_size, total_products)
+        print("\n" + "="*60)
+        print("📋 RESUME AVAILABLE")
+        print("="*60)
+        print(f"Last session: {saved_time}")
+        print(f"Labels confirmed: {states[journal.CONFIRMED]}/{total_labels}")
+        if states[journal.FAILED]:
+            print(f"Failed labels: {states[journal.FAILED]} (will be printed again)")
+        if unconfirmed:
+            print(f"Unconfirmed labels: {unconfirmed} (may have printed - check the last labels out)")
+        if states[journal.RENDERED]:
+            print(f"Rendered but not sent: {states[journal.RENDERED]} (will be printed)")
+        if labels:
+            print(f"Next label: {labels[0] + 1} (products {labels[0] * products_per_label + 1}-"
+                  f"{min((labels[0] + 1) * products_per_label, total_products)})")
+        print("="*60)
 
-            print("\n" + "="*60)
-            print("📋 RESUME AVAILABLE")
-            print("="*60)
-            print(f"Last session: {saved_time}")
-            print(f"Last completed batch: {last_batch + 1}/{total_batches}")
-            print(f"Last product printed: {last_product + 1}/{total_products}")
-            print(f"Next batch: {last_batch + 2} (products {start_product + 1}-{end_product})")
-            print("="*60)
+        response = input("\nResume from this position? [y/N]: ").strip().lower()
+        if response == 'y':
+            resuming = True
+            print(f"✓ Resuming with {len(labels)} labels left")
+        else:
+            print("✓ Starting fresh from beginning")
+            log.reset(job_id)
+            labels = list(range(total_labels))
+    else:
+        log.reset(job_id)
+        labels = list(range(total_labels))
 
-            response = input("\nResume from this position? [y/N]: ").strip().lower()
-            if response == 'y':
-                start_batch = last_batch + 1
-                print(f"✓ Resuming from batch {start_batch + 1}")
-            else:
-                print("✓ Starting fresh from beginning")
-                start_batch = 0
-        except Exception as e:
-            print(f"⚠️  Could not load progress file: {e}")
-            print("Starting fresh from beginning")
-            start_batch = 0
+    # Consecutive labels grouped into batches; a gap (already printed labels) starts a new batch
+    batches = []
+    for first, last in journal.runs(labels):
+        for start in range(first, last + 1, labels_per_batch):
+            batches.append(list(range(start, min(start + labels_per_batch, last + 1))))
 
     # Display job summary
     print("\n" + "="*60)
@@ -347,17 +555,18 @@ def print_all_products_batch(csv_file, printer_identifier='usb://0x04f9:0x2042',
     print(f"Total products: {total_products}")
     print(f"Batch size: {batch_size} products")
     print(f"Labels per batch: {labels_per_batch} labels")
-    print(f"Total batches: {total_batches}")
-    print(f"Starting from: Batch {start_batch + 1}")
-    print(f"�� Progress will be saved to: {progress_file}")
+    print(f"Labels to print: {len(labels)} of {total_labels}")
+    print(f"Batches: {len(batches)}")
+    print(f"📝 Progress is journaled in: {log.path}")
     print("="*60)
     print()
 
     # Confirm start
-    if start_batch == 0:
+    if not resuming:
         response = input("Start printing? [y/N]: ").strip().lower()
         if response != 'y':
             print("Cancelled.")
+            log.close()
             return
 
     # Print batches
@@ -365,97 +574,145 @@ def print_all_products_batch(csv_file, printer_identifier='usb://0x04f9:0x2042',
     error_count = 0
     start_time = time.time()
 
-    for batch_num in range(start_batch, total_batches):
-        batch_start_idx = batch_num * batch_size
-        batch_end_idx = min(batch_start_idx + batch_size, total_products)
-        batch_products = products[batch_start_idx:batch_end_idx]
+    def label_batches_for(batch):
+        batch_products = index.column('Product Name', batch[0] * products_per_label,
+                                      (batch[-1] + 1) * products_per_label)
+        return [batch_products[i:i+products_per_label] for i in range(0, len(batch_products), products_per_label)]
+
+    # Whole batch as one job - only cut after the last label. Workers render
+    # the next batches while the current one prints. Repeated labels are rendered once per run.
+    token = render_dedup.new_job()
+    render = functools.partial(build_grid_instructions, label_type=label_type, columns=columns, rows=rows, mode=mode,
+                               dedup=token)
+    if cache_dir:
+        render = raster_cache.CachedRender(render, cache_dir)
+    jobs = ((label_batches, [False] * (len(label_batches) - 1) + [True])
+            for label_batches in map(label_batches_for, batches))
+
+    if printers and len(printers) > 1:
+        # Fleet workers render and send back to back, so batches go straight to sent
+        report = print_batches_on_fleet(printers, render, jobs, batches,
+                                        lambda batch_num: log.mark(job_id, batches[batch_num], journal.CONFIRMED),
+                                        lambda batch_num: log.mark(job_id, batches[batch_num], journal.SENT),
+                                        backend_identifier=backend_identifier, weights=printer_weights)
+        success_batches = sum(printer['units'] for printer in report['printers'])
+        for first, last in report['unprinted']:
+            unprinted = [label for batch in batches[first:last] for label in batch]
+            log.mark(job_id, unprinted, journal.FAILED, "Every printer failed")
+    else:
+        if printers:
+            printer_identifier = printers[0]
+        engine = pipeline.RenderPipeline(render, workers=workers)
 
-        print("\n" + "="*60)
-        print(f"📦 BATCH {batch_num + 1}/{total_batches}")
-        print("="*60)
-        print(f"Products: {batch_start_idx + 1} to {batch_end_idx} ({len(batch_products)} products)")
-        print(f"Labels in this batch: {(len(batch_products) + products_per_label - 1) // products_per_label}")
-        print("="*60)
+        for batch_num, ((label_batches, _), instructions, render_error) in enumerate(engine.results(jobs)):
+            batch = batches[batch_num]
+            if render_error is None:
+                log.mark(job_id, batch, journal.RENDERED)
+            batch_start_idx = batch[0] * products_per_label
+            batch_end_idx = min((batch[-1] + 1) * products_per_label, total_products)
+
+            print("\n" + "="*60)
+            print(f"📦 BATCH {batch_num + 1}/{len(batches)}")
+            print("="*60)
+            print(f"Products: {batch_start_idx + 1} to {batch_end_idx} ({batch_end_idx - batch_start_idx} products)")
+            print(f"Labels in this batch: {len(label_batches)} (labels {batch[0] + 1}-{batch[-1] + 1})")
+            print("="*60)
 
-        # Print labels in this batch (continuous, no cut between labels)
-        label_num_in_batch = 0
-        for i in range(0, len(batch_products), products_per_label):
-            label_products = batch_products[i:i+products_per_label]
-            label_num_in_batch += 1
+            # Print labels in this batch (continuous, no cut between labels)
+            for i, label_products in enumerate(label_batches):
+                first = batch_start_idx + i * products_per_label
+                product_indices = f"{first + 1}-{first + len(label_products)}"
+                print(f"\n  Label {batch[i] + 1}: Products {product_indices}")
+                for j, p in enumerate(label_products, 1):
+                    print(f"    [{j}] {p}")
 
-            product_indices = f"{batch_start_idx + i + 1}-{batch_start_idx + i + len(label_products)}"
-            print(f"\n  Label {label_num_in_batch}: Products {product_indices}")
-            for j, p in enumerate(label_products, 1):
-                print(f"    [{j}] {p}")
+            confirmed = [0]
 
-            try:
-                # Print without cutting (except last label of batch)
-                is_last_label = (i + products_per_label >= len(batch_products))
-                cut_after = is_last_label  # Only cut after last label of batch
+            def on_page(printed, batch=batch):
+                # The printer confirms each label as it comes out
+                confirmed[0] = printed
+                log.mark(job_id, batch[printed - 1], journal.CONFIRMED)
 
-                print_grid_label(printer_identifier, label_products, label_type,
-                               cut=cut_after, columns=columns, rows=rows)
-                print(f"    ✓ Printed successfully" + (" & CUT" if cut_after else ""))
+            try:
+                if render_error is not None:
+                    raise render_error
+                log.mark(job_id, batch, journal.SENT)
+                status = send(instructions=instructions, printer_identifier=printer_identifier,
+                              backend_identifier=backend_identifier, blocking=True, pages=len(label_batches),
+                              on_page=on_page)
+                if status and status.get('outcome') == 'error':
+                    raise Exception(', '.join(status['printer_state']['errors']))
+                print(f"\n    ✓ Printed {len(label_batches)} labels successfully & CUT")
 
             except Exception as e:
                 error_count += 1
+                log.mark(job_id, batch[confirmed[0]:], journal.FAILED, str(e))
                 print(f"    ✗ Error: {e}")
-                response = input("    Continue with next label? (y/n): ")
+                response = input("    Continue with next batch? (y/n): ")
                 if response.lower() != 'y':
+                    engine.close()
+                    log.close()
+                    render_dedup.release(token)
                     print("\n⚠️  Printing stopped by user")
-                    print(f"Progress saved. You can resume from batch {batch_num + 1}")
+                    print(f"Progress saved. You can resume from label {batch[confirmed[0]] + 1}")
                     return
+                continue
+
+            # Batch completed successfully
+            success_batches += 1
 
-        # Batch completed successfully
-        success_batches += 1
-
-        # Save progress after successful batch
-        progress_data = {
-            'last_completed_batch': batch_num,
-            'last_product_index': batch_end_idx - 1,
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'total_batches': total_batches,
-            'batch_size': batch_size
-        }
-
-        try:
-            with open(progress_file, 'w') as f:
-                json.dump(progress_data, f, indent=2)
-            print(f"\n  ✓ Batch {batch_num + 1} completed and saved")
-        except Exception as e:
-            print(f"\n  ⚠️  Could not save progress: {e}")
-
-        # Show progress
-        elapsed = time.time() - start_time
-        remaining_batches = total_batches - (batch_num + 1)
-        if success_batches > 0:
+            # Show progress
+            elapsed = time.time() - start_time
+            remaining_batches = len(batches) - (batch_num + 1)
             avg_time_per_batch = elapsed / success_batches
             est_remaining = avg_time_per_batch * remaining_batches
-            print(f"  Progress: {batch_num + 1}/{total_batches} batches ({((batch_num + 1) / total_batches * 100):.1f}%)")
+            print(f"  Progress: {batch_num + 1}/{len(batches)} batches ({((batch_num + 1) / len(batches) * 100):.1f}%)")
             print(f"  Estimated time remaining: {est_remaining / 60:.1f} minutes")
 
-    # All batches complete!
+        engine.close()
+
+    summary = log.summary(job_id)
+    states = summary['states']
     elapsed = time.time() - start_time
+    dedup = render_dedup.release(token)
+    # Render savings, for both summaries below
+    reuse_lines = []
+    if dedup is not None and dedup.lookups:
+        reuse_lines.append(f"Duplicate labels: {dedup.summary()}")
+    if cache_dir and raster_cache.get_cache(cache_dir).lookups:
+        reuse_lines.append(f"Cached: {raster_cache.get_cache(cache_dir).summary()}")
+    if states[journal.CONFIRMED] < total_labels:
+        log.close()
+        print("\n" + "="*60)
+        print("⚠️  PRINTING INCOMPLETE")
+        print("="*60)
+        print(f"Labels confirmed: {states[journal.CONFIRMED]}/{total_labels}")
+        print(f"Failed labels: {states[journal.FAILED]}")
+        print(f"Time elapsed: {elapsed / 60:.1f} minutes")
+        for line in reuse_lines:
+            print(line)
+        print("="*60)
+        print("List them with --list-failed, reprint them with --batch --reprint-failed,")
+        print("or run --batch again to resume with everything not yet printed")
+        return
+
+    # All labels confirmed!
+    log.finish(job_id)
+    log.close()
     print("\n" + "="*60)
     print("🎉 PRINTING COMPLETE!")
     print("="*60)
     print(f"Total batches printed: {success_batches}")
     print(f"Total products printed: {total_products}")
-    print(f"Total labels printed: {(total_products + products_per_label - 1) // products_per_label}")
+    print(f"Total labels printed: {total_labels}")
     print(f"Time elapsed: {elapsed / 60:.1f} minutes")
     if success_batches > 0:
         print(f"Average time per batch: {elapsed / success_batches:.1f} seconds")
+    for line in reuse_lines:
+        print(line)
     print("="*60)
 
-    # Delete progress file on successful completion
-    try:
-        if os.path.exists(progress_file):
-            os.remove(progress_file)
-            print(f"✓ Progress file deleted (job complete)")
-    except Exception as e:
-        print(f"⚠️  Could not delete progress file: {e}")
-
-def generate_preview(csv_file, output_file='preview_4up.png', num_labels=3, columns=4, rows=1):
+def generate_preview(csv_file, output_file='preview_4up.png', num_labels=3, columns=4, rows=1, mode='RGB', workers=0):
     """
     Generate preview images of multiple labels without printing
 
@@ -465,8 +722,11 @@ def generate_preview(csv_file, output_file='preview_4up.png', num_labels=3, colu
         num_labels: Number of labels to preview (default: 3)
         columns: Number of columns per label
         rows: Number of rows per label
+        mode: Canvas mode for rendering ('RGB', 'L' or '1')
+        workers: Worker processes rendering labels in parallel (default: 0, render inline)
     """
     import os
+    import time
 
     with open(csv_file, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
@@ -481,24 +741,28 @@ def generate_preview(csv_file, output_file='preview_4up.png', num_labels=3, colu
 
     print(f"Generating preview of {num_labels} labels ({products_per_label} products each)...")
 
-    # Create individual label images
-    label_images = []
-    for label_idx in range(num_labels):
-        start_idx = label_idx * products_per_label
-        batch = all_products[start_idx:start_idx + products_per_label]
-
+    batches = [all_products[i * products_per_label:(i + 1) * products_per_label] for i in range(num_labels)]
+    for label_idx, batch in enumerate(batches):
         print(f"\nLabel {label_idx + 1}:")
         for i, p in enumerate(batch, 1):
             print(f"  [{i}] {p}")
 
-        label_img = create_grid_label(batch, columns=columns, rows=rows)
-        label_images.append(label_img)
+    # Render individual label images (in parallel with workers > 0)
+    render = functools.partial(create_grid_label, columns=columns, rows=rows, mode=mode)
+    label_images = []
+    start_time = time.time()
+    with pipeline.RenderPipeline(render, workers=workers) as engine:
+        for _, label_img, error in engine.results((batch,) for batch in batches):
+            if error is not None:
+                raise error
+            label_images.append(label_img)
+    elapsed = time.time() - start_time
 
     # Stack labels vertically for preview
     total_height = sum(img.height for img in label_images) + (len(label_images) - 1) * 20  # 20px gap
     preview_width = label_images[0].width
 
-    preview = Image.new('RGB', (preview_width, total_height), 'white')
+    preview = raster_utils.new_canvas((preview_width, total_height), mode)
 
     y_offset = 0
     for img in label_images:
@@ -508,8 +772,19 @@ def generate_preview(csv_file, output_file='preview_4up.png', num_labels=3, colu
     preview.save(output_file)
     print(f"\n✓ Preview saved: {output_file}")
     print(f"Dimensions: {preview.width}x{preview.height}px")
+    if elapsed > 0:
+        print(f"Rendered {num_labels} labels in {elapsed:.1f}s ({num_labels / elapsed:.1f} labels/s)")
     print(f"Open it to review before printing!")
 
+def print_profile(workers=0):
+    """Print the --profile stage summary"""
+    print("\n" + "="*60)
+    print("PROFILE")
+    print("="*60)
+    print(metrics.profile_report())
+    if workers > 0:
+        print("Rendering ran in worker processes, so only send and parent-side stages are included")
+
 if __name__ == "__main__":
     import argparse
 
@@ -537,14 +812,45 @@ if __name__ == "__main__":
                         help='Number of products per batch (default: 20, must be multiple of columns×rows)')
     parser.add_argument('--no-resume', action='store_true',
                         help='Start from beginning, ignore saved progress')
+    parser.add_argument('--journal', metavar='PATH',
+                        help=f'Print journal database for --batch progress (default: {journal.DEFAULT_PATH})')
+    parser.add_argument('--reprint-failed', action='store_true',
+                        help='With --batch: print only the labels the journal recorded as failed')
+    parser.add_argument('--list-failed', action='store_true',
+                        help='List the labels the journal recorded as failed and exit')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Worker processes rendering labels ahead of the printer or previews in parallel '
+                             '(default: 0, render inline)')
+    parser.add_argument('--printers', nargs='+', metavar='PRINTER',
+                        help="With --batch: share the batches between several printers "
+                             "('all' = every attached Brother printer)")
+    parser.add_argument('--printer-weights', nargs='+', metavar='PRINTER=WEIGHT',
+                        help='With --printers: relative speed of each printer, sizing its share of the batches '
+                             f'(default: labels/s measured on earlier runs, kept in {fleet.RATES_PATH})')
+    parser.add_argument('--render-mode', default='RGB', choices=raster_utils.RENDER_MODES,
+                        help="Canvas mode: RGB (default), L (greyscale) or 1 (native 1-bit, skips RGB conversion)")
+    parser.add_argument('--raster-cache', nargs='?', const=raster_cache.DEFAULT_DIR, metavar='DIR',
+                        help='Reuse instruction bytes of labels printed before from a disk cache '
+                             f'(default directory: {raster_cache.DEFAULT_DIR})')
+    parser.add_argument('--backend', default=DEFAULT_BACKEND,
+                        help=f"Printer backend: pyusb, network, linux_kernel, or emulator for a dry run "
+                             f"(default: {DEFAULT_BACKEND}, set with LABEL_PRINTER_BACKEND)")
+    parser.add_argument('--profile', action='store_true',
+                        help='Time each stage (text fitting, QR, render, convert, send) and print a summary at exit')
 
     args = parser.parse_args()
 
+    if args.profile:
+        import atexit
+        metrics.enable()
+        atexit.register(print_profile, args.workers)
+
     products_per_label = args.columns * args.rows
 
     if args.preview:
         # Generate preview only
-        generate_preview(args.csv_file, num_labels=args.preview_labels, columns=args.columns, rows=args.rows)
+        generate_preview(args.csv_file, num_labels=args.preview_labels, columns=args.columns, rows=args.rows,
+                         mode=args.render_mode, workers=args.workers)
     elif args.test:
         with open(args.csv_file, 'r', encoding='utf-8') as f:
             reader = csv.DictReader(f)
@@ -552,12 +858,37 @@ if __name__ == "__main__":
         print(f"Test printing {len(test_products)} products ({args.columns}×{args.rows} grid):")
         for i, p in enumerate(test_products, 1):
             print(f"  {i}. {p}")
-        print_grid_label(args.printer, test_products, args.label, cut=True, columns=args.columns, rows=args.rows)
+        print_grid_label(args.printer, test_products, args.label, cut=True, columns=args.columns, rows=args.rows,
+                         mode=args.render_mode, backend_identifier=args.backend)
         print("✓ Test complete!")
+    elif args.list_failed:
+        list_failed_labels(args.csv_file, args.label, columns=args.columns, rows=args.rows,
+                           journal_path=args.journal)
     elif args.batch:
+        printers = args.printers
+        if printers == ['all']:
+            printers = fleet.discover_fleet(args.backend)
+            if not printers:
+                parser.error("No printers found")
+        printer_weights = None
+        if args.printer_weights:
+            printer_weights = {}
+            for item in args.printer_weights:
+                printer, _, weight = item.rpartition('=')
+                try:
+                    printer_weights[printer] = float(weight)
+                except ValueError:
+                    printer = None
+                if not printer or printer_weights[printer] <= 0:
+                    parser.error(f"--printer-weights: expected PRINTER=WEIGHT with a positive weight, got '{item}'")
         # Batch printing with resume functionality
         print_all_products_batch(args.csv_file, args.printer, args.label,
                                 batch_size=args.batch_size, columns=args.columns,
-                                rows=args.rows, no_resume=args.no_resume)
+                                rows=args.rows, no_resume=args.no_resume, mode=args.render_mode,
+                                workers=args.workers, printers=printers, journal_path=args.journal,
+                                reprint_failed=args.reprint_failed, cache_dir=args.raster_cache,
+                                backend_identifier=args.backend, printer_weights=printer_weights)
     else:
-        print_all_products_grid(args.csv_file, args.printer, args.label, no_cut=args.no_cut, columns=args.columns, rows=args.rows)
+        print_all_products_grid(args.csv_file, args.printer, args.label, no_cut=args.no_cut, columns=args.columns, rows=args.rows,
+                                mode=args.render_mode, workers=args.workers, cache_dir=args.raster_cache,
+                                backend_identifier=args.backend)
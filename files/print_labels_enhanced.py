@@ -6,187 +6,233 @@ Includes batch processing, preview generation, and more options
 """
 
 import csv
-import qrcode
-from PIL import Image, ImageDraw, ImageFont
-from brother_ql.conversion import convert
-from brother_ql.backends.helpers import send
+import functools
+from brother_ql.devicedependent import label_type_specs, ENDLESS_LABEL
 from brother_ql.raster import BrotherQLRaster
 import os
+import sys
 import time
-
-def create_label_image(product_name, label_width=696, label_height=271, qr_size=180, font_size=None):
+from pathlib import Path
+from PIL import Image
+
+# Shared rendering utilities live alongside the web app
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'webapp'))
+
+import csv_index
+import label_templates
+import metrics
+import pipeline
+import raster_cache
+import raster_utils
+import render_dedup
+from printer_session import DEFAULT_BACKEND, send
+from raster_utils import convert
+
+def label_template(label_width=696, label_height=271, qr_size=180, font_size=None, scale=1.0):
     """
-    Create a label image with product name and QR code
+    Template for a product label: product name on the LEFT, QR code on the RIGHT
 
     Args:
-        product_name: Name of the product
         label_width: Width in pixels (62mm = 696px at 300dpi)
         label_height: Height in pixels (29mm = 271px at 300dpi)
         qr_size: Size of QR code in pixels (default: 180, fixed)
         font_size: Font size for product name (optional, auto-sizes if None)
+        scale: Size of QR, fonts and margins relative to the 271px-high label (default: 1.0)
 
     Returns:
-        PIL Image object
+        label_templates template dict
     """
-    # Create white background
-    img = Image.new('RGB', (label_width, label_height), 'white')
-    draw = ImageDraw.Draw(img)
-
-    # Generate QR code - FIXED SIZE for consistency
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=2,
-        border=1,
-    )
-    qr.add_data(product_name)
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-
     # QR code FIXED size on RIGHT side
-    qr_size = min(qr_size, label_height - 20)
-    qr_img = qr_img.resize((qr_size, qr_size))
-
-    # Paste QR code on the RIGHT side
-    qr_x = label_width - qr_size - 10
+    qr_size = min(round(qr_size * scale), label_height - round(20 * scale))
+    qr_x = label_width - qr_size - round(10 * scale)
     qr_y = (label_height - qr_size) // 2
-    img.paste(qr_img, (qr_x, qr_y))
-
-    # Find BOLD font path for better readability
-    font_path = None
-    font_index = 0  # For TTC files with multiple fonts
-
-    # Try bold fonts in order of preference
-    bold_font_options = [
-        ("/System/Library/Fonts/Helvetica.ttc", 1),  # macOS Helvetica Bold (index 1)
-        ("/System/Library/Fonts/Arial Black.ttf", 0),  # macOS Arial Black
-        ("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 0),  # Linux bold
-        ("C:\\Windows\\Fonts\\arialbd.ttf", 0),  # Windows bold
-        ("/System/Library/Fonts/Supplemental/Arial Bold.ttf", 0),  # macOS alternate
-        ("/System/Library/Fonts/Helvetica.ttc", 0),  # macOS Helvetica regular as fallback
-    ]
-
-    for path, index in bold_font_options:
-        try:
-            ImageFont.truetype(path, 24, index=index)
-            font_path = path
-            font_index = index
-            break
-        except:
-            continue
-
-    # Text area is LEFT side (before QR code)
-    text_x = 10  # Start closer to edge for maximum space
-    text_area_width = qr_x - 25  # Maximum space for text
-    max_lines = 3  # Up to 3 lines for better text fitting
 
     # Auto-size font if not specified - Original readable sizes
     if font_size is None:
         font_sizes = [32, 28, 24, 20, 18]  # Original sizes
     else:
         font_sizes = [font_size]  # Use specified size
+    font_sizes = [round(size * scale) for size in font_sizes]
+    margin = round(10 * scale)
+
+    return {
+        'size': [label_width, label_height],
+        'elements': [
+            # 1-bit QR scaled by whole modules, cached per payload and size
+            {'type': 'qr', 'box': [qr_x, qr_y, qr_size, qr_size], 'border': 1},
+            # Text area is LEFT side (before QR code), up to 3 lines centered vertically;
+            # the largest size whose wrapped text fits in 3 lines wins
+            {'type': 'text', 'box': [margin, margin, qr_x - round(25 * scale), label_height - 2 * margin],
+             'max_height': None, 'sizes': font_sizes, 'max_lines': 3, 'leading': round(12 * scale), 'metric': 'ink'},
+        ],
+    }
+
+@functools.lru_cache(maxsize=32)
+def label_plan(label_width=696, label_height=271, qr_size=180, font_size=None, mode='RGB', template_path=None,
+               scale=1.0):
+    """Compiled label template (built in, or a JSON file), built once per layout and render mode"""
+    if template_path:
+        template = label_templates.load_template(template_path)
+    else:
+        template = label_template(label_width, label_height, qr_size, font_size, scale)
+    return label_templates.compile_template(template, mode)
 
-    best_font = None
-    best_lines = []
-
-    # Find the best font size that fits
-    for size in font_sizes:
-        if font_path:
-            try:
-                font = ImageFont.truetype(font_path, size, index=font_index)
-            except:
-                font = ImageFont.load_default()
-        else:
-            font = ImageFont.load_default()
-
-        # Wrap text with this font size
-        words = product_name.split()
-        lines = []
-        current_line = []
-
-        for word in words:
-            test_line = ' '.join(current_line + [word])
-            bbox = draw.textbbox((0, 0), test_line, font=font)
-            if bbox[2] - bbox[0] <= text_area_width:
-                current_line.append(word)
-            else:
-                if current_line:
-                    lines.append(' '.join(current_line))
-                    current_line = [word]
-                else:
-                    # Word is too long, add it anyway
-                    lines.append(word)
-
-        if current_line:
-            lines.append(' '.join(current_line))
+@metrics.timed('render')
+def create_label_image(product_name, label_width=696, label_height=271, qr_size=180, font_size=None, mode='RGB',
+                       template_path=None):
+    """
+    Create a label image with product name and QR code
 
-        # Check if text fits within max_lines
-        if len(lines) <= max_lines:
-            best_font = font
-            best_lines = lines
-            break
+    Args:
+        product_name: Name of the product - or a CSV row dict for templates that map other columns
+        label_width: Width in pixels (62mm = 696px at 300dpi)
+        label_height: Height in pixels (29mm = 271px at 300dpi)
+        qr_size: Size of QR code in pixels (default: 180, fixed)
+        font_size: Font size for product name (optional, auto-sizes if None)
+        mode: Canvas mode - 'RGB', or 'L' / '1' to draw natively in grey / 1-bit
+        template_path: Label template JSON file to use instead of the built-in layout
 
-    # If no font worked, use the smallest
-    if best_font is None:
-        if font_path:
-            try:
-                best_font = ImageFont.truetype(font_path, font_sizes[-1], index=font_index)
-            except:
-                best_font = ImageFont.load_default()
-        else:
-            best_font = ImageFont.load_default()
-        best_lines = best_lines[:max_lines] if best_lines else lines[:max_lines]
+    Returns:
+        PIL Image object
+    """
+    return label_plan(label_width, label_height, qr_size, font_size, mode, template_path).render(product_name)
 
-    # Limit to max_lines
-    best_lines = best_lines[:max_lines]
+@metrics.timed('render')
+def create_native_label_image(product_name, label_type='62', label_width=696, label_height=271, qr_size=180,
+                              font_size=None, mode='1'):
+    """
+    Create the built-in label already in the printer's raster orientation
 
-    # Calculate line height based on font with better spacing
-    bbox = draw.textbbox((0, 0), "Ay", font=best_font)
-    line_height = (bbox[3] - bbox[1]) + 12  # More spacing between lines
+    The landscape layout is drawn at the tape's full printable width (the
+    size the raster stage would otherwise enlarge it to) and turned with one
+    lossless transpose, so a 1-bit canvas prints with rotate='0' and is
+    never scaled. Endless tape only.
 
-    # Draw text centered vertically
-    total_text_height = len(best_lines) * line_height
-    text_y = (label_height - total_text_height) // 2
+    Args:
+        product_name: Name of the product
+        label_type: Label size (default: '62' for 62mm continuous)
+        label_width, label_height, qr_size, font_size: As for create_label_image, at the 271px-high size
+        mode: Canvas mode - 'L' or '1'
 
-    for i, line in enumerate(best_lines):
-        draw.text((text_x, text_y + i * line_height), line, fill='black', font=best_font)
+    Returns:
+        PIL Image object, printable width wide
+    """
+    tape_width = label_type_specs[label_type]['dots_printable'][0]
+    scale = tape_width / label_height
+    plan = label_plan(int(label_width * scale), tape_width, qr_size, font_size, mode, scale=scale)
+    return plan.render(product_name).transpose(Image.Transpose.ROTATE_90)
 
-    return img
+def label_renderer(label_type='62', **kwargs):
+    """
+    (render, rotate) for build_label_instructions: render turns one product into a label image
 
-def print_label(printer_identifier, product_name, label_type='62', cut=True, **kwargs):
+    Labels are landscape and printed turned by 90 degrees. On endless tape,
+    native modes draw the built-in layout at printable width instead; a
+    template file is then drawn in grey, so the raster stage resamples it
+    before thresholding rather than enlarging a 1-bit image.
     """
-    Print a single label
+    mode = kwargs.get('mode', 'RGB')
+    if mode not in raster_utils.NATIVE_MODES or label_type_specs[label_type]['kind'] != ENDLESS_LABEL:
+        return functools.partial(create_label_image, **kwargs), '90'
+    template_path = kwargs.pop('template_path', None)
+    if template_path:
+        return functools.partial(create_label_image, **dict(kwargs, mode='L', template_path=template_path)), '90'
+    return functools.partial(create_native_label_image, label_type=label_type, **kwargs), '0'
+
+def build_label_instructions(product_names, label_type='62', cut=True, dedup=None, **kwargs):
+    """
+    Render labels and convert them to printer instructions
+
+    A single label is converted exactly as before; several labels become
+    one multi-page job with the cut flag set per page. Top-level so the
+    render pipeline can run it in worker processes.
 
     Args:
-        printer_identifier: Printer identifier
-        product_name: Product name to print
+        product_names: Product names (or rows, for templates), one label each
         label_type: Label size
-        cut: Whether to cut after printing (default: True)
+        cut: Whether to cut after each label (default: True)
+        dedup: render_dedup job token - labels repeated within the job are rendered once
         **kwargs: Additional parameters for label creation
-    """
-    # Create label image
-    img = create_label_image(product_name, **kwargs)
 
-    # Convert to Brother QL format
-    qlr = BrotherQLRaster('QL-700')
-    instructions = convert(
-        qlr=qlr,
-        images=[img],
-        label=label_type,
-        rotate='90',  # Rotate 90 degrees to print horizontally
+    Returns:
+        Instruction bytes
+    """
+    render, rotate = label_renderer(label_type, **kwargs)
+    options = dict(
+        rotate=rotate,  # '90' turns the landscape label to print horizontally
         threshold=70.0,
         dither=False,
         compress=False,
         red=False,
         dpi_600=False,
         hq=True,
-        cut=cut
+        cut=cut if len(product_names) == 1 else [cut] * len(product_names)
     )
 
-    # Send to printer
-    send(instructions=instructions, printer_identifier=printer_identifier, backend_identifier='pyusb', blocking=True)
+    # Convert to Brother QL format
+    qlr = BrotherQLRaster('QL-700')
+    if dedup is not None:
+        # Rows only count by the columns the template reads
+        fields = label_plan(**kwargs).fields
+        values = [value if isinstance(value, str) else {field: value.get(field) for field in sorted(fields)}
+                  for value in product_names]
+        return render_dedup.for_job(dedup).convert(qlr, values, render, label_type, kwargs,
+                                                   render.keywords.get('mode', 'RGB'), **options)
+    images = [render(product_name) for product_name in product_names]
+    return convert(qlr=qlr, images=images, label=label_type, **options)
+
+def print_label(printer_identifier, product_name, label_type='62', cut=True, backend_identifier=DEFAULT_BACKEND,
+                **kwargs):
+    """
+    Print a single label
+
+    Args:
+        printer_identifier: Printer identifier
+        product_name: Product name to print
+        label_type: Label size
+        cut: Whether to cut after printing (default: True)
+        backend_identifier: Printer backend, e.g. 'emulator' for a dry run (default: printer_session.DEFAULT_BACKEND)
+        **kwargs: Additional parameters for label creation
+    """
+    instructions = build_label_instructions([product_name], label_type, cut, **kwargs)
+
+    # Send to printer (device stays open between labels)
+    send(instructions=instructions, printer_identifier=printer_identifier, backend_identifier=backend_identifier,
+         blocking=True)
+
+def print_labels(printer_identifier, product_names, label_type='62', cut=True, backend_identifier=DEFAULT_BACKEND,
+                 **kwargs):
+    """
+    Print several labels as one multi-page job (one raster header, one USB transfer)
+
+    Args:
+        printer_identifier: Printer identifier
+        product_names: Product names to print, one label each
+        label_type: Label size
+        cut: Whether to cut after each label (default: True)
+        backend_identifier: Printer backend, e.g. 'emulator' for a dry run (default: printer_session.DEFAULT_BACKEND)
+        **kwargs: Additional parameters for label creation
+    """
+    instructions = build_label_instructions(product_names, label_type, cut, **kwargs)
+
+    # Send the whole batch at once over the shared printer session
+    send(instructions=instructions, printer_identifier=printer_identifier, backend_identifier=backend_identifier,
+         blocking=True, pages=len(product_names))
+
+def label_values(row, template_path=None):
+    """What a label is rendered from: the whole row for a template, else the product name"""
+    return row if template_path else row['Product Name']
+
+def display_name(values):
+    """Product name for progress output, from a product name or a row"""
+    return values if isinstance(values, str) else values.get('Product Name') or next(iter(values.values()), '')
+
+def render_preview(product_name, filename, mode='RGB', template_path=None):
+    """Render one label and save it as a PNG, returning the filename"""
+    create_label_image(product_name, mode=mode, template_path=template_path).save(filename)
+    return filename
 
-def generate_previews(csv_file, output_dir='previews', max_previews=10):
+def generate_previews(csv_file, output_dir='previews', max_previews=10, mode='RGB', workers=0, template_path=None):
     """
     Generate preview images of labels without printing
     
@@ -194,6 +240,10 @@ def generate_previews(csv_file, output_dir='previews', max_previews=10):
         csv_file: Path to CSV file
         output_dir: Directory to save previews
         max_previews: Maximum number of previews to generate
+        mode: Canvas mode for rendering ('RGB', 'L' or '1')
+        workers: Worker processes rendering previews in parallel (default: 0, render inline).
+                 Files are written as they finish, so they may appear out of order.
+        template_path: Label template JSON file (default: built-in layout)
     """
     os.makedirs(output_dir, exist_ok=True)
     
@@ -202,19 +252,32 @@ def generate_previews(csv_file, output_dir='previews', max_previews=10):
         products = list(reader)[:max_previews]
     
     print(f"Generating {len(products)} preview images...")
-    
-    for i, row in enumerate(products, 1):
-        product_name = row['Product Name']
-        img = create_label_image(product_name)
-        filename = os.path.join(output_dir, f"preview_{i:03d}.png")
-        img.save(filename)
-        print(f"  {i}/{len(products)}: {filename}")
-    
+    if workers > 0:
+        print(f"Rendering with {workers} worker processes")
+
+    render = functools.partial(render_preview, mode=mode, template_path=template_path)
+    jobs = ((label_values(row, template_path), os.path.join(output_dir, f"preview_{i:03d}.png"))
+            for i, row in enumerate(products, 1))
+    done = 0
+    start_time = time.time()
+
+    with pipeline.RenderPipeline(render, workers=workers) as engine:
+        for (values, filename), _, error in engine.completed(jobs):
+            done += 1
+            if error is not None:
+                print(f"  {done}/{len(products)}: ✗ {display_name(values)}: {error}")
+            else:
+                print(f"  {done}/{len(products)}: {filename}")
+
+    elapsed = time.time() - start_time
     print(f"\nPreviews saved to '{output_dir}/' directory")
+    if elapsed > 0:
+        print(f"Rendered {done} previews in {elapsed:.1f}s ({done / elapsed:.1f} labels/s)")
 
 def print_products(csv_file, printer_identifier='usb://0x04f9:0x2042',
                   label_type='62', start=None, end=None,
-                  delay=0, no_cut=False, **kwargs):
+                  delay=0, no_cut=False, batch_size=1, workers=0, cache_dir=None, backend_identifier=DEFAULT_BACKEND,
+                  **kwargs):
     """
     Print labels for products in CSV file
 
@@ -226,19 +289,28 @@ def print_products(csv_file, printer_identifier='usb://0x04f9:0x2042',
         end: Ending index (1-based)
         delay: Delay between prints in seconds
         no_cut: If True, print continuously without cutting (default: False)
+        batch_size: Labels sent per print job (default: 1). Larger batches go out
+                    as a single multi-page job; delay then applies between batches.
+        workers: Worker processes rendering jobs ahead of the printer (default: 0,
+                 render inline). Labels still print in CSV order.
+        cache_dir: Raster cache directory - jobs printed before (same labels, layout
+                   and batching) are sent from it without rendering (default: no cache)
+        backend_identifier: Printer backend, e.g. 'emulator' for a dry run (default: printer_session.DEFAULT_BACKEND)
         **kwargs: Additional parameters for label creation
     """
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        products = list(reader)
+    batch_size = max(1, batch_size)
+
+    # The row index lets a range seek straight to its first row instead of parsing the whole file
+    index = csv_index.get_index(csv_file)
 
     # Apply range filtering
     if start is not None or end is not None:
         start_idx = (start - 1) if start else 0
-        end_idx = end if end else len(products)
-        products = products[start_idx:end_idx]
+        end_idx = end if end else len(index)
+        products = list(index.rows(start_idx, end_idx))
         print(f"Printing products {start_idx + 1} to {end_idx} ({len(products)} total)")
     else:
+        products = list(index.rows())
         print(f"Printing all {len(products)} products")
 
     if no_cut:
@@ -249,31 +321,57 @@ def print_products(csv_file, printer_identifier='usb://0x04f9:0x2042',
     error_count = 0
     start_time = time.time()
 
-    for i, row in enumerate(products, 1):
-        product_name = row['Product Name']
-        actual_number = (start - 1 + i) if start else i
+    if batch_size > 1:
+        print(f"Sending {batch_size} labels per print job")
+    if workers > 0:
+        print(f"Rendering ahead with {workers} worker processes")
+
+    # Workers render and rasterize upcoming jobs while the current one prints;
+    # repeated labels are rendered once per job (per worker process)
+    token = render_dedup.new_job()
+    render = functools.partial(build_label_instructions, label_type=label_type, cut=not no_cut, dedup=token,
+                               **kwargs)
+    template_path = kwargs.get('template_path')
+    if cache_dir:
+        files = label_templates.template_files(template_path) if template_path else ()
+        render = raster_cache.CachedRender(render, cache_dir, files=files)
+    jobs = ((tuple(label_values(row, template_path) for row in products[i:i + batch_size]),)
+            for i in range(0, len(products), batch_size))
+    batch_start = 0
+
+    with pipeline.RenderPipeline(render, workers=workers) as engine:
+        for (product_names,), instructions, render_error in engine.results(jobs):
+            for i, values in enumerate(product_names, batch_start + 1):
+                actual_number = (start - 1 + i) if start else i
+                print(f"\n[{actual_number}/{len(products) if not start else end}] {display_name(values)}")
+            batch_start += len(product_names)
 
-        print(f"\n[{actual_number}/{len(products) if not start else end}] {product_name}")
-
-        try:
-            print_label(printer_identifier, product_name, label_type, cut=not no_cut, **kwargs)
-            success_count += 1
-            print("  ✓ Printed successfully")
+            try:
+                if render_error is not None:
+                    raise render_error
+                send(instructions=instructions, printer_identifier=printer_identifier,
+                     backend_identifier=backend_identifier, blocking=True, pages=len(product_names))
+                if len(product_names) == 1:
+                    print("  ✓ Printed successfully")
+                else:
+                    print(f"  ✓ Printed {len(product_names)} labels successfully")
+                success_count += len(product_names)
 
-            # Add delay if specified
-            if delay > 0 and i < len(products):
-                print(f"  Waiting {delay} seconds...")
-                time.sleep(delay)
+                # Add delay if specified
+                if delay > 0 and batch_start < len(products):
+                    print(f"  Waiting {delay} seconds...")
+                    time.sleep(delay)
 
-        except Exception as e:
-            error_count += 1
-            print(f"  ✗ Error: {e}")
-            response = input("  Continue? (y/n): ")
-            if response.lower() != 'y':
-                break
+            except Exception as e:
+                error_count += len(product_names)
+                print(f"  ✗ Error: {e}")
+                response = input("  Continue? (y/n): ")
+                if response.lower() != 'y':
+                    break
 
     # Print summary
     elapsed = time.time() - start_time
+    dedup = render_dedup.release(token)
     print("\n" + "="*50)
     print("PRINTING SUMMARY")
     print("="*50)
@@ -283,10 +381,23 @@ def print_products(csv_file, printer_identifier='usb://0x04f9:0x2042',
     print(f"Time elapsed: {elapsed/60:.1f} minutes")
     if success_count > 0:
         print(f"Average time per label: {elapsed/success_count:.1f} seconds")
+    if dedup is not None and dedup.lookups:
+        print(f"Duplicate labels: {dedup.summary()}")
+    if cache_dir and raster_cache.get_cache(cache_dir).lookups:
+        print(f"Cached: {raster_cache.get_cache(cache_dir).summary()}")
     print("="*50)
     if no_cut:
         print("Remember to cut your continuous label roll!")
 
+def print_profile(workers=0):
+    """Print the --profile stage summary"""
+    print("\n" + "="*60)
+    print("PROFILE")
+    print("="*60)
+    print(metrics.profile_report())
+    if workers > 0:
+        print("Rendering ran in worker processes, so only send and parent-side stages are included")
+
 if __name__ == "__main__":
     import argparse
     
@@ -304,11 +415,26 @@ Examples:
   # Print products 1-100
   %(prog)s products.csv --start 1 --end 100
   
+  # Send 20 labels per print job
+  %(prog)s products.csv --batch-size 20
+  
   # Generate preview images
   %(prog)s products.csv --preview
   
+  # Proofread 5000 labels using 8 worker processes
+  %(prog)s products.csv --preview --preview-count 5000 --workers 8
+  
   # Custom QR code size and font
   %(prog)s products.csv --qr-size 250 --font-size 28
+
+  # Own layout: text and QR boxes mapped to CSV columns (see webapp/label_templates.py)
+  %(prog)s products.csv --template shelf_label.json --preview
+
+  # Keep rendered jobs on disk, so tomorrow's run of the same catalog skips rendering
+  %(prog)s products.csv --batch-size 20 --raster-cache
+
+  # See where the time goes for the first 50 labels
+  %(prog)s products.csv --end 50 --profile
         """
     )
     
@@ -335,25 +461,51 @@ Examples:
                         help='Number of previews to generate (default: 10)')
     parser.add_argument('--no-cut', action='store_true',
                         help='Print continuously without cutting (cut manually later)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Labels sent per print job (default: 1); larger batches print as one multi-page job')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Worker processes rendering labels ahead of the printer or previews in parallel '
+                             '(default: 0, render inline)')
+    parser.add_argument('--render-mode', default='RGB', choices=raster_utils.RENDER_MODES,
+                        help="Canvas mode: RGB (default), L (greyscale) or 1 (native 1-bit, skips RGB conversion)")
+    parser.add_argument('--template', metavar='JSON',
+                        help='Label template file (text/QR boxes mapped to CSV columns) instead of the built-in layout')
+    parser.add_argument('--raster-cache', nargs='?', const=raster_cache.DEFAULT_DIR, metavar='DIR',
+                        help='Reuse instruction bytes of jobs printed before from a disk cache '
+                             f'(default directory: {raster_cache.DEFAULT_DIR})')
+    parser.add_argument('--backend', default=DEFAULT_BACKEND,
+                        help=f"Printer backend: pyusb, network, linux_kernel, or emulator for a dry run "
+                             f"(default: {DEFAULT_BACKEND}, set with LABEL_PRINTER_BACKEND)")
+    parser.add_argument('--profile', action='store_true',
+                        help='Time each stage (text fitting, QR, render, convert, send) and print a summary at exit')
 
     args = parser.parse_args()
 
+    if args.profile:
+        import atexit
+        metrics.enable()
+        atexit.register(print_profile, args.workers)
+
     # Generate previews
     if args.preview:
-        generate_previews(args.csv_file, max_previews=args.preview_count)
+        generate_previews(args.csv_file, max_previews=args.preview_count, mode=args.render_mode,
+                          workers=args.workers, template_path=args.template)
 
     # Test print
     elif args.test:
         with open(args.csv_file, 'r', encoding='utf-8') as f:
             reader = csv.DictReader(f)
-            first_product = next(reader)['Product Name']
-        print(f"Test printing: {first_product}")
-        print_label(args.printer, first_product, args.label, cut=not args.no_cut,
-                   qr_size=args.qr_size, font_size=args.font_size)
+            first_product = label_values(next(reader), args.template)
+        print(f"Test printing: {display_name(first_product)}")
+        print_label(args.printer, first_product, args.label, cut=not args.no_cut, backend_identifier=args.backend,
+                   qr_size=args.qr_size, font_size=args.font_size, mode=args.render_mode,
+                   template_path=args.template)
         print("✓ Test complete!")
 
     # Normal printing
     else:
         print_products(args.csv_file, args.printer, args.label,
                       start=args.start, end=args.end, delay=args.delay, no_cut=args.no_cut,
-                      qr_size=args.qr_size, font_size=args.font_size)
+                      batch_size=args.batch_size, workers=args.workers, cache_dir=args.raster_cache,
+                      backend_identifier=args.backend, qr_size=args.qr_size, font_size=args.font_size,
+                      mode=args.render_mode, template_path=args.template)
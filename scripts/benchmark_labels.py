@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Label pipeline benchmarks
+Times every stage - CSV indexing, label / cell / grid rendering, raster
+conversion, transfer and the full print_products loop - on synthetic
+catalogs, against the emulated printer. Results can be saved as a baseline
+and later runs compared against it.
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / 'webapp'))
+sys.path.append(str(ROOT / 'files'))
+
+import csv_index
+import emulator
+import printer_session
+import qr_utils
+import raster_utils
+import text_layout
+import print_labels_4up
+import print_labels_enhanced
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Name profiles for synthetic catalogs
+WORDS = ['Organic', 'Premium', 'Whole', 'Roasted', 'Coffee', 'Beans', 'Almond', 'Milk', 'Dark', 'Chocolate',
+         'Sea', 'Salt', 'Crackers', 'Extra', 'Virgin', 'Olive', 'Oil', 'Green', 'Tea', 'Honey', 'Oat', 'Flakes',
+         'Sparkling', 'Water', 'Lemon', 'Ginger', 'Cookies', 'Brown', 'Rice', 'Pasta', 'Tomato', 'Sauce']
+UNICODE_WORDS = ['Café', 'Crème', 'Brûlée', 'Jalapeño', 'Müsli', 'Smørbrød', 'Ærøskøbing', 'Łódź', 'Gruyère',
+                 'Χαλβάς', 'Мёд', 'Гречка', '抹茶', '緑茶', 'ラーメン', '김치', 'Piña', 'Açaí', '½ kg', '☕', '🍫']
+PROFILES = {
+    'short': (1, 3, WORDS),
+    'long': (8, 16, WORDS),
+    'unicode': (2, 6, WORDS + UNICODE_WORDS * 2),
+}
+
+# Allowed slowdown before a comparison run fails
+DEFAULT_TOLERANCE = 0.15
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+
+def synthetic_names(count, profile, seed=0):
+    """Unique product names (unique so the layout and QR caches can't hide the work)"""
+    low, high, words = PROFILES[profile]
+    rng = random.Random(f"{profile}-{seed}")
+    for n in range(1, count + 1):
+        name = ' '.join(rng.choice(words) for _ in range(rng.randint(low, high)))
+        yield f"{name} #{n}"
+
+
+def write_catalog(path, rows, profile, seed=0):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Product Name', 'SKU'])
+        for n, name in enumerate(synthetic_names(rows, profile, seed), 1):
+            writer.writerow([name, f"SKU-{n:07d}"])
+    return path
+
+
+def peak_rss_mb():
+    """The process's peak RSS so far - a high-water mark that never drops, so it includes earlier stages"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, round(p / 100 * (len(sorted_values) - 1)))]
+
+
+def summarize(latencies, labels, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'labels': labels,
+        'seconds': round(elapsed, 4),
+        'labels_per_second': round(labels / elapsed, 2) if elapsed > 0 else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'process_peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def measure(items, fn, labels_per_item=1):
+    """Call fn on every item, timing each call"""
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        t = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, len(latencies) * labels_per_item, elapsed)
+
+
+def bench_index(path, rows):
+    """Build the row index for a catalog from scratch"""
+    start = time.perf_counter()
+    index = csv_index.build_index(path)
+    elapsed = time.perf_counter() - start
+    assert len(index) == rows, f"indexed {len(index)} rows, expected {rows}"
+    return summarize([elapsed], rows, elapsed)
+
+
+def clear_name_caches():
+    """Forget fitted text, word masks and QR codes, so no stage reuses the work of the one before it"""
+    text_layout.clear_cache()
+    qr_utils.clear_cache()
+
+
+def bench_render(names, mode, columns=4):
+    """Label, grid cell and grid label rendering, each stage starting with cold per-name caches"""
+    results = {}
+    clear_name_caches()
+    results['render_label'] = measure(names, lambda name: print_labels_enhanced.create_label_image(name, mode=mode))
+    clear_name_caches()
+    results['render_cell'] = measure(names, lambda name: print_labels_4up.create_single_product_cell(name, mode=mode))
+    clear_name_caches()
+    groups = [names[i:i + columns] for i in range(0, len(names), columns)]
+    results['render_grid'] = measure(groups, lambda group: print_labels_4up.create_grid_label(group, columns=columns,
+                                                                                                mode=mode), columns)
+    return results
+
+
+def bench_raster(names, mode):
+    """convert() on pre-rendered labels, the same settings the CLIs use"""
+    images = [print_labels_enhanced.create_label_image(name, mode=mode) for name in names]
+
+    def raster(image):
+        return raster_utils.convert(qlr=print_labels_enhanced.BrotherQLRaster('QL-700'), images=[image], label='62',
+                                    rotate='90', threshold=70.0, dither=False, compress=False, red=False,
+                                    dpi_600=False, hq=True, cut=True)
+
+    return measure(images, raster), raster(images[0])
+
+
+def bench_transfer(instructions, count, scale):
+    """Send a finished instruction stream to the emulated printer"""
+    identifier = f"emulator://bench-transfer?scale={scale}"
+    return measure(range(count), lambda _: printer_session.send(instructions, identifier, emulator.BACKEND_NAME))
+
+
+def bench_end_to_end(path, count, mode, batch_size, workers, scale):
+    """The full print_products loop: index, render, raster and send to the emulator"""
+    identifier = f"emulator://bench-e2e?scale={scale}"
+    cycle_times = []
+    last = [time.perf_counter()]
+
+    def send(**kwargs):
+        kwargs['backend_identifier'] = emulator.BACKEND_NAME
+        status = printer_session.send(**kwargs)
+        now = time.perf_counter()
+        cycle_times.append((now - last[0]) / kwargs.get('pages', 1))
+        last[0] = now
+        return status
+
+    original_send = print_labels_enhanced.send
+    print_labels_enhanced.send = send
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            print_labels_enhanced.print_products(path, identifier, start=1, end=count, batch_size=batch_size,
+                                                 workers=workers, mode=mode)
+        elapsed = time.perf_counter() - start
+    finally:
+        print_labels_enhanced.send = original_send
+
+    result = summarize(cycle_times, len(emulator.get_printer(identifier).pages), elapsed)
+    result['modelled_labels_per_second'] = round(emulator.get_printer(identifier).stats['labels_per_second'], 2)
+    return result
+
+
+def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='label-bench-') as tmp:
+        for rows in args.rows:
+            path = write_catalog(os.path.join(tmp, f"catalog_{rows}.csv"), rows, 'long')
+            results[f"index/{rows}"] = bench_index(path, rows)
+            os.remove(path)
+            print(f"  index/{rows}: done", file=sys.stderr)
+
+        for profile in args.profiles:
+            names = list(synthetic_names(args.samples, profile))
+            for stage, result in bench_render(names, args.mode).items():
+                results[f"{stage}/{profile}"] = result
+            results[f"raster/{profile}"], instructions = bench_raster(names, args.mode)
+            print(f"  render and raster/{profile}: done", file=sys.stderr)
+
+        results['transfer'] = bench_transfer(instructions, args.samples, args.emulator_scale)
+
+        path = write_catalog(os.path.join(tmp, 'catalog_e2e.csv'), args.samples, args.profiles[0])
+        results['end_to_end'] = bench_end_to_end(path, args.samples, args.mode, args.batch_size, args.workers,
+                                                 args.emulator_scale)
+        print("  end_to_end: done", file=sys.stderr)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'mode': args.mode,
+            'samples': args.samples,
+            'batch_size': args.batch_size,
+            'workers': args.workers,
+            'emulator_scale': args.emulator_scale,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'stages': results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Stages that got slower than baseline allows: [(stage, metric, baseline, now)]"""
+    regressions = []
+    for stage, before in baseline['stages'].items():
+        now = report['stages'].get(stage)
+        if now is None:
+            continue
+        if now['labels_per_second'] < before['labels_per_second'] * (1 - tolerance):
+            regressions.append((stage, 'labels_per_second', before['labels_per_second'], now['labels_per_second']))
+        if before['p50_ms'] > 0 and now['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+            regressions.append((stage, 'p50_ms', before['p50_ms'], now['p50_ms']))
+    return regressions
+
+
+def print_report(report, baseline=None):
+    print(f"\n{'stage':<22} {'labels/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'peak MB*':>8}  vs baseline")
+    print("-" * 72)
+    for stage, result in report['stages'].items():
+        change = ''
+        before = (baseline or {}).get('stages', {}).get(stage)
+        if before and before['labels_per_second']:
+            change = f"{(result['labels_per_second'] / before['labels_per_second'] - 1) * 100:+.1f}%"
+        print(f"{stage:<22} {result['labels_per_second']:>10.1f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+              f"{result['process_peak_rss_mb'] or 0:>8.1f}  {change}")
+    print("* Process peak RSS when the stage ended; it never drops, so it includes every earlier stage")
+    e2e = report['stages'].get('end_to_end')
+    if e2e:
+        print(f"\nEmulated printer throughput: {e2e['modelled_labels_per_second']:.2f} labels/s "
+              f"(host side: {e2e['labels_per_second']:.1f} labels/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark label rendering, raster conversion and printing (emulated printer)',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Quick run
+  %(prog)s
+
+  # Index catalogs of 1k, 100k and 1M rows (index stage only), 500 labels per other stage
+  %(prog)s --rows 1000 100000 1000000 --samples 500
+
+  # Record a baseline, then fail if a later run is more than 15%% slower
+  %(prog)s --save-baseline
+  %(prog)s --compare
+        """
+    )
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000],
+                        help='Catalog sizes for the indexing stage only; render, raster, transfer and '
+                             'end-to-end use --samples names (default: 1000)')
+    parser.add_argument('--samples', type=int, default=200,
+                        help='Labels per render, raster, transfer and end-to-end stage (default: 200)')
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES),
+                        help='Product name profiles (default: all)')
+    parser.add_argument('--render-mode', dest='mode', default='RGB', choices=raster_utils.RENDER_MODES,
+                        help='Canvas mode (default: RGB)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Labels per print job in the end-to-end stage (default: 1)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Render worker processes in the end-to-end stage (default: 0)')
+    parser.add_argument('--emulator-scale', type=float, default=0.0,
+                        help='Emulated printer speed: 0 = no waiting (default), 1 = real QL-700 timing')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help=f'Baseline file (default: {DEFAULT_BASELINE})')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store this run as the baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare against the baseline and exit with status 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'Allowed slowdown for --compare (default: {DEFAULT_TOLERANCE})')
+    parser.add_argument('--json', metavar='FILE',
+                        help='Also write the full report to FILE')
+
+    args = parser.parse_args()
+
+    # brother_ql warns on every resized or mode-switched label
+    logging.getLogger('brother_ql').setLevel(logging.ERROR)
+
+    print(f"Benchmarking ({args.samples} labels per stage, mode {args.mode})...", file=sys.stderr)
+    report = run(args)
+
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, IOError, ValueError) as e:
+            print(f"Could not load baseline {args.baseline}: {e}")
+            sys.exit(2)
+        for key in ('mode', 'samples', 'batch_size', 'workers', 'emulator_scale', 'cpus'):
+            if baseline['meta'].get(key) != report['meta'][key]:
+                print(f"⚠️  Baseline was recorded with {key}={baseline['meta'].get(key)}, "
+                      f"this run used {report['meta'][key]}")
+
+    print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n✗ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for stage, metric, before, now in regressions:
+                print(f"  {stage}: {metric} {before} → {now}")
+            sys.exit(1)
+        print(f"\n✓ No regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,819 @@
+#!/usr/bin/env python3
+"""
+Regression checks for the print pipeline
+Small end-to-end checks of behaviour that broke before (CSV splitting,
+printer sessions, ...), runnable without a printer. Exits non-zero if any
+check fails.
+
+Usage:
+    python scripts/selfcheck.py            # every check
+    python scripts/selfcheck.py csv_index  # checks whose name contains csv_index
+"""
+
+import argparse
+from collections import deque
+import csv
+import functools
+import hashlib
+import io
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / 'webapp'))
+sys.path.append(str(ROOT / 'files'))
+
+from brother_ql.conversion import convert as brother_ql_convert
+from brother_ql.devicedependent import label_type_specs
+from brother_ql.raster import BrotherQLRaster
+from PIL import Image, ImageDraw
+import qrcode
+
+import csv_index
+import csv_ingest
+import emulator
+import fleet
+import font_utils
+import job_engine
+import journal
+import log_buffer
+import pipeline
+import printer_session
+import qr_utils
+import raster_cache
+import raster_utils
+import render_dedup
+import text_layout
+import print_labels_4up
+import print_labels_enhanced
+
+# (name, function) in definition order
+CHECKS = []
+
+
+def check(fn):
+    CHECKS.append((fn.__name__[len('check_'):], fn))
+    return fn
+
+
+# Files csv.DictReader reads that naive quote counting splits wrongly
+CSV_CASES = {
+    'inch_marks': 'Product Name,SKU\nMonitor 27" wide,A1\nDesk,B2\nChair 18" seat,C3\nLamp,D4\n',
+    'quoted': ('Product Name,SKU\r\n"Line one\nline two",A\r\n\r\n"He said ""hi""",B\r\n"x"y,C\r\n'
+               'no newline at end,D'),
+    'cr_only': 'Product Name,SKU\rA,1\rB,2\r',
+}
+
+
+def write_csv_cases(directory):
+    paths = {}
+    for name, text in CSV_CASES.items():
+        path = os.path.join(directory, f"{name}.csv")
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        paths[name] = path
+    return paths
+
+
+def dict_reader_rows(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+@check
+def check_csv_index_matches_dictreader():
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, path in write_csv_cases(tmp).items():
+            expected = dict_reader_rows(path)
+            # Tiny chunks put record and '\r\n' boundaries across reads
+            for chunk in (1, 5, csv_index.SCAN_CHUNK):
+                saved, csv_index.SCAN_CHUNK = csv_index.SCAN_CHUNK, chunk
+                try:
+                    index = csv_index.build_index(path)
+                finally:
+                    csv_index.SCAN_CHUNK = saved
+                rows = list(index.rows())
+                assert rows == expected, f"{name} (chunk {chunk}): {len(rows)} rows, DictReader {len(expected)}"
+                for i, row in enumerate(expected):
+                    assert list(index.rows(i, i + 1)) == [row], f"{name}: row {i} read on its own differs"
+
+
+@check
+def check_csv_index_sidecar_follows_the_file():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'catalog.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write('Product Name,SKU\n' + ''.join(f"Item {n},S{n}\n" for n in range(50)))
+        expected = dict_reader_rows(path)
+        index = csv_index.get_index(path)
+        assert os.path.exists(csv_index.index_path(path)), "sidecar not written"
+        # Seeks like a list slice
+        for start, end in ((0, None), (10, 13), (48, 60), (-3, None), (7, 7), (60, 70)):
+            assert list(index.rows(start, end)) == expected[start:end], f"rows({start}, {end})"
+
+        # Loaded from the sidecar in a new process
+        csv_index._indexes.clear()
+        assert csv_index.load_index(path) is not None, "sidecar not loaded"
+        assert list(csv_index.get_index(path).rows()) == expected
+
+        # A changed file (same size, new mtime) and a damaged sidecar are both rescanned
+        with open(path, 'r+', encoding='utf-8', newline='') as f:
+            f.seek(len('Product Name,SKU\n'))
+            f.write('Iten')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        assert csv_index.load_index(path) is None, "stale sidecar accepted"
+        assert next(csv_index.get_index(path).rows())['Product Name'] == 'Iten 0'
+        with open(csv_index.index_path(path), 'r+b') as f:
+            f.truncate(len(csv_index.INDEX_MAGIC) + 4)
+        csv_index._indexes.clear()
+        assert list(csv_index.get_index(path).rows()) == dict_reader_rows(path), "damaged sidecar used"
+
+
+@check
+def check_csv_ingest_matches_dictreader():
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, path in write_csv_cases(tmp).items():
+            expected = dict_reader_rows(path)
+            # Upload path: the stream is copied to a new file while it is parsed
+            copy = os.path.join(tmp, f"upload_{name}.csv")
+            with open(path, 'rb') as stream:
+                stats = csv_ingest.ingest(stream, copy)
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                columns = next(csv.reader(f))
+            assert stats['columns'] == columns, f"{name}: columns {stats['columns']}"
+            assert stats['rows'] == len(expected), f"{name}: {stats['rows']} rows, DictReader {len(expected)}"
+            for column in columns:
+                first = next((i for i, row in enumerate(expected) if (row.get(column) or '').strip()), None)
+                assert stats['first_row'][column] == first, f"{name}: first_row[{column}]"
+            assert list(csv_index.get_index(copy).rows()) == expected, f"{name}: index rows differ"
+
+
+@check
+def check_csv_ingest_stats_and_copy():
+    data = ('Product Name,SKU,Note\r\n,A1,\r\nCafé "Crème",B22,"two\nlines"\r\nLamp,,x\r\n').encode('utf-8')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'upload.csv')
+        # Tiny reads put the multi-byte 'é' and quoted newlines across chunks
+        saved, csv_ingest.CHUNK_SIZE = csv_ingest.CHUNK_SIZE, 3
+        try:
+            stats = csv_ingest.ingest(io.BytesIO(data), path)
+        finally:
+            csv_ingest.CHUNK_SIZE = saved
+        with open(path, 'rb') as f:
+            assert f.read() == data, "upload not copied byte for byte"
+        rows = dict_reader_rows(path)
+        assert stats['sha256'] == hashlib.sha256(data).hexdigest()
+        for column in stats['columns']:
+            values = [row[column] for row in rows]
+            assert stats['non_empty'][column] == sum(1 for value in values if value.strip()), f"non_empty[{column}]"
+            assert stats['max_length'][column] == max(map(len, values)), f"max_length[{column}]"
+        assert csv_ingest.first_row_with_data(stats, ['Product Name', 'Note']) == 1
+        assert csv_ingest.first_row_with_data(stats, []) is None
+
+        # Served from the sidecar while the file is unchanged, re-ingested after a change
+        csv_ingest._stats.clear()
+        assert csv_ingest.get_stats(path) == stats
+        with open(path, 'ab') as f:
+            f.write(b'Desk,C3,\r\n')
+        assert csv_ingest.get_stats(path)['rows'] == stats['rows'] + 1, "stale stats served"
+        csv_ingest._stats.clear()
+        with open(path + csv_ingest.STATS_SUFFIX, 'w') as f:
+            f.write('{"version": ')
+        assert csv_ingest.get_stats(path)['rows'] == stats['rows'] + 1, "damaged sidecar not rebuilt"
+
+        try:
+            csv_ingest.ingest(io.BytesIO(b''), os.path.join(tmp, 'empty.csv'))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("a file without a header was accepted")
+
+
+@check
+def check_journal_resumes_at_first_unconfirmed_label():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'journal.sqlite3')
+        with journal.Journal(path) as first:
+            job = first.open_job('hash', 10, settings={'columns': 4})
+            assert first.open_job('hash', 10, settings={'columns': 3}) != job, "settings not part of the job key"
+            first.mark(job, range(4), journal.CONFIRMED)
+            first.mark(job, [4, 5], journal.SENT)
+            first.mark(job, 6, journal.FAILED, error='end of media')
+            first.mark(job, 7, journal.RENDERED)
+
+        with journal.Journal(path) as resumed:
+            assert resumed.open_job('hash', 10, settings={'columns': 4}) == job, "same file and settings, new job"
+            assert resumed.remaining(job) == list(range(4, 10))
+            assert journal.runs(resumed.remaining(job)) == [(4, 9)]
+            assert resumed.failed(job) == [(6, 'end of media')]
+            states = resumed.summary(job)['states']
+            assert states == {journal.QUEUED: 2, journal.RENDERED: 1, journal.SENT: 2, journal.CONFIRMED: 4,
+                              journal.FAILED: 1}, f"summary {states}"
+
+            # Changes still buffered when the process dies are lost: those labels print again, none are skipped
+            resumed.flush_interval = 3600
+            resumed.mark(job, range(4, 10), journal.CONFIRMED)
+            with journal.Journal(path) as crashed:
+                assert crashed.remaining(job) == list(range(4, 10)), "unflushed labels counted as printed"
+            resumed.flush()
+            with journal.Journal(path) as later:
+                assert later.remaining(job) == []
+            resumed.reset(job)
+            assert resumed.remaining(job) == list(range(10))
+
+
+@check
+def check_compression_only_on_supported_models():
+    page = Image.new('1', (696, 120), 1)
+    ImageDraw.Draw(page).rectangle((100, 20, 400, 100), fill=0)
+    for model, supported in (('QL-700', False), ('QL-720NW', True)):
+        plain = raster_utils.convert(BrotherQLRaster(model), [page], '62', compress=False)
+        packed = raster_utils.convert(BrotherQLRaster(model), [page], '62', compress=True)
+        deduped = render_dedup.RenderDedup().convert(BrotherQLRaster(model), ['a'], lambda value: page, '62', 't',
+                                                     mode='1', compress=True, cut=[True])
+        assert deduped == packed, f"{model}: deduplicated stream differs"
+        if supported:
+            assert b'\x4d\x02' in packed and len(packed) < len(plain), f"{model}: rows not compressed"
+        else:
+            # Packed rows without the M command would print as garbage
+            assert packed == plain, f"{model}: rows compressed on a model without compression support"
+
+
+@check
+def check_render_dedup_keeps_open_jobs():
+    tokens = [render_dedup.new_job() for _ in range(render_dedup.JOBS_KEPT + 4)]
+    caches = [render_dedup.for_job(token) for token in tokens]
+    for token, cache in zip(tokens, caches):
+        cache.get('key', lambda: b'page')
+        # Still the same cache: more jobs in flight than JOBS_KEPT don't evict each other
+        assert render_dedup.for_job(token) is cache, f"open job {token} evicted"
+    # Tokens from another process (a render worker's view) are bounded
+    foreign = [f"worker-{n}" for n in range(render_dedup.JOBS_KEPT + 2)]
+    for token in foreign:
+        render_dedup.for_job(token)
+    kept = [token for token in foreign if token in render_dedup._jobs]
+    assert kept == foreign[-render_dedup.JOBS_KEPT:], f"kept {kept}"
+    for token, cache in zip(tokens, caches):
+        assert render_dedup.release(token) is cache and cache.misses == 1
+    for token in kept:
+        render_dedup.release(token)
+    assert not render_dedup._jobs and not render_dedup._open
+
+
+@check
+def check_native_raster_matches_brother_ql():
+    # Tape width, the enhanced layout's size and its transpose: no resize, downscale and upscale
+    for size in ((720, 300), (696, 271), (271, 696)):
+        page = Image.new('L', size, 255)
+        draw = ImageDraw.Draw(page)
+        draw.rectangle((30, 20, 200, 120), fill=0)
+        draw.ellipse((210, 40, 260, 250), fill=90)
+        draw.text((20, 150), 'Lamp 27"', fill=0)
+        for rotate in ('0', '90', 'auto'):
+            native = raster_utils.convert(BrotherQLRaster('QL-700'), [page], '62', rotate=rotate)
+            reference = brother_ql_convert(BrotherQLRaster('QL-700'), [page.convert('RGB')], '62', rotate=rotate)
+            assert native == reference, f"{size} rotate={rotate}: native stream differs from brother_ql"
+
+    # Native enhanced labels are drawn at the tape width, not scaled up from the RGB layout
+    name = 'Ergonomic Office Chair with Lumbar Support and Adjustable Armrests'
+    reference = print_labels_enhanced.build_label_instructions([name], mode='RGB')
+    reference_size = decoded_page_images(reference)[0].size
+    printable = label_type_specs['62']['dots_printable'][0]
+    for mode in raster_utils.NATIVE_MODES:
+        render, rotate = print_labels_enhanced.label_renderer(mode=mode)
+        image = render(name)
+        assert rotate == '0' and image.size[0] == printable, f"mode {mode}: drawn at {image.size}, rotate={rotate}"
+        pages = decoded_page_images(print_labels_enhanced.build_label_instructions([name], mode=mode))
+        assert pages[0].size == reference_size, f"mode {mode}: page {pages[0].size}, RGB page {reference_size}"
+
+
+def decoded_page_images(instructions):
+    """Each printed page of an instruction stream, as the printer would put it on paper"""
+    printer = emulator.EmulatedPrinter('selfcheck', timing=emulator.TimingModel(scale=0), decode=True)
+    printer.write(instructions)
+    return [page.image for page in printer.pages]
+
+
+def decoded_pages(instructions):
+    return [image.tobytes() for image in decoded_page_images(instructions)]
+
+
+@check
+def check_batch_pages_match_single_labels():
+    names = ['Monitor 27" wide', 'Ergonomic Office Chair with Lumbar Support and Adjustable Armrests', 'Lamp']
+    for mode in raster_utils.RENDER_MODES:
+        singles = [decoded_pages(print_labels_enhanced.build_label_instructions([name], mode=mode)) for name in names]
+        batch = decoded_pages(print_labels_enhanced.build_label_instructions(names, mode=mode))
+        assert len(batch) == len(names), f"mode {mode}: {len(batch)} pages for {len(names)} labels"
+        for name, single, page in zip(names, singles, batch):
+            assert [page] == single, f"mode {mode}: '{name}' prints differently in a batch"
+
+
+def reference_product_label(name, mode):
+    # The enhanced layout as drawn before it became a template
+    img = raster_utils.new_canvas((696, 271), mode)
+    qr_x, qr_y = 696 - 180 - 10, (271 - 180) // 2
+    qr_utils.paste_qr(img, name, (qr_x, qr_y), size=180, border=1)
+    layout = text_layout.fit_text(name, qr_x - 25, [32, 28, 24, 20, 18], max_lines=3, leading=12, metric='ink')
+    text_y = (271 - len(layout.lines[:3]) * layout.line_height) // 2
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(layout.lines[:3]):
+        draw.text((10, text_y + i * layout.line_height), line, fill='black', font=layout.font)
+    return img
+
+
+def reference_grid_label(products, columns, mode):
+    # The 4-up grid as drawn before it became a template: separators, then each cell in its box
+    cell_width, cell_height, label_height, gap = print_labels_4up.grid_geometry(696, columns)
+    label = raster_utils.new_canvas((696, label_height), mode)
+    draw = ImageDraw.Draw(label)
+    for column in range(1, columns):
+        line_x = column * (cell_width + gap) - gap + gap // 2
+        draw.line([(line_x, 0), (line_x, label_height)], fill=raster_utils.ink('lightgray', mode), width=1)
+    qr_x = cell_width - 100 - 5
+    for column, name in enumerate(products):
+        cell_x = column * (cell_width + gap)
+        qr_utils.paste_qr(label, name, (cell_x + qr_x, (cell_height - 100) // 2), size=100, border=1)
+        layout = text_layout.fit_text(name, cell_height - 20, [18, 16, 14, 12, 10], max_lines=3,
+                                      max_height=qr_x - 15, leading=4, metric='ink')
+        lines = layout.lines[:3] or (name,)
+        width = max(int(text_layout.text_width(layout.font, line)) + 1 for line in lines)
+        text_img = raster_utils.new_canvas((width + 10, len(lines) * layout.line_height + 10), mode)
+        text_draw = ImageDraw.Draw(text_img)
+        for i, line in enumerate(lines):
+            text_layout.draw_line(text_draw, (5, 5 + i * layout.line_height), line, layout.font)
+        text_img = text_img.transpose(Image.Transpose.ROTATE_90)
+        text_y = (cell_height - text_img.height) // 2
+        top = max(0, -text_y)
+        right = min(text_img.width, cell_width - 5)
+        bottom = min(text_img.height, cell_height - text_y)
+        if top or right < text_img.width or bottom < text_img.height:
+            text_img = text_img.crop((0, top, right, bottom))
+        label.paste(text_img, (cell_x + 5, text_y + top))
+    return label
+
+
+@check
+def check_templates_match_hand_drawn_layouts():
+    names = ['Lamp', 'Monitor 27" wide', 'Café Crème 250 g', 'Ergonomic Office Chair with Lumbar Support and '
+             'Adjustable Armrests', 'Antidisestablishmentarianism-Supercalifragilistic Extra Long Words']
+    for mode in raster_utils.RENDER_MODES:
+        for name in names:
+            image = print_labels_enhanced.create_label_image(name, mode=mode)
+            assert image.tobytes() == reference_product_label(name, mode).tobytes(), f"mode {mode}: '{name}' differs"
+        for columns in (3, 4):
+            for products in (names[:columns], names[-columns:], names[:1]):
+                image = print_labels_4up.create_grid_label(products, columns=columns, mode=mode)
+                expected = reference_grid_label(products, columns, mode)
+                assert image.tobytes() == expected.tobytes(), f"mode {mode}: {columns}-up grid {products} differs"
+
+
+@check
+def check_qr_image_matches_qrcode():
+    for data in ['Lamp', 'Ergonomic Office Chair with Lumbar Support and Adjustable Armrests', 'Café 抹茶 ½ kg', 'x' * 300]:
+        # Pixel for pixel what qrcode draws at the same box size
+        qr = qrcode.QRCode(version=1, error_correction=qr_utils.ERROR_CORRECT_L, box_size=3, border=1)
+        qr.add_data(data)
+        qr.make(fit=True)
+        reference = qr.make_image(fill_color='black', back_color='white').convert('1')
+        image = qr_utils.qr_image(data, box_size=3)
+        assert image.mode == '1' and image.tobytes() == reference.tobytes(), f"'{data[:20]}': differs from qrcode"
+
+        # Fitted to a size: whole pixels per module, centred on white
+        for size in (100, 156, 180):
+            image = qr_utils.qr_image(data, size=size)
+            modules = len(qr_utils.qr_matrix(data))
+            scale = size // modules
+            offset = (size - modules * scale) // 2
+            box = (offset, offset, offset + modules * scale, offset + modules * scale)
+            assert image.size == (size, size), f"'{data[:20]}' at {size}: {image.size}"
+            assert image.crop(box).tobytes() == qr_utils.qr_image(data, box_size=scale).tobytes(), \
+                f"'{data[:20]}' at {size}: modules not scaled by {scale}"
+            margin = Image.new('1', (size, size), 1)
+            margin.paste(image.crop(box), box[:2])
+            assert margin.tobytes() == image.tobytes(), f"'{data[:20]}' at {size}: margin not white"
+
+
+def reference_fit(text, max_width, sizes, max_lines):
+    """The plain search fit_text replaces: every size, largest first, whole lines measured as they grow"""
+    for size in sizes:
+        font = font_utils.get_font(size)
+        lines = []
+        line = []
+        for word in text.split():
+            if line and font.getlength(' '.join(line + [word])) > max_width:
+                lines.append(' '.join(line))
+                line = []
+            line.append(word)
+        if line:
+            lines.append(' '.join(line))
+        if len(lines) <= max_lines:
+            break
+    return size, tuple(lines)
+
+
+@check
+def check_fit_text_matches_linear_search():
+    rng = random.Random(2)
+    words = ['Organic', 'Premium', 'Roasted', 'Coffee', 'Beans', 'Café', 'Crème', 'Brûlée', 'Гречка', '抹茶', '½ kg',
+             'Extra-Virgin', 'Supercalifragilisticexpialidocious', '27"', 'x']
+    names = ['', 'Lamp', 'Ergonomic Office Chair with Lumbar Support and Adjustable Armrests']
+    names += [' '.join(rng.choice(words) for _ in range(rng.randint(1, 14))) for _ in range(150)]
+    # The enhanced label's text box, a 4-up cell's and a box narrower than some words
+    boxes = [(431, (32, 28, 24, 20, 18)), (120, (18, 16, 14, 12, 10)), (54, (18, 16, 14, 12, 10))]
+    for cold in (True, False):
+        if cold:
+            text_layout.clear_cache()
+        for name in names:
+            for max_width, sizes in boxes:
+                layout = text_layout.fit_text(name, max_width, sizes, max_lines=3)
+                expected = reference_fit(name, max_width, sizes, 3)
+                assert (layout.size, layout.lines) == expected, \
+                    f"'{name}' in {max_width}px: {layout.size} {layout.lines}, expected {expected}"
+
+
+@check
+def check_draw_line_matches_draw_text():
+    line = 'Monitor 27" wide  x'
+    for mode in raster_utils.RENDER_MODES:
+        for size in (14, 23):
+            font = font_utils.get_font(size)
+            for xy in ((3, 7), (3.5, 7)):
+                expected = Image.new(mode, (400, 60), 'white')
+                ImageDraw.Draw(expected).text(xy, line, fill='black', font=font)
+                drawn = Image.new(mode, (400, 60), 'white')
+                text_layout.draw_line(ImageDraw.Draw(drawn), xy, line, font)
+                assert drawn.tobytes() == expected.tobytes(), f"mode {mode}, size {size}, at {xy}"
+
+
+class FakeBackend:
+    """In-memory printer backend: fails the next fail_writes writes, then confirms pages_per_job pages per job"""
+
+    fail_writes = 0
+    pages_per_job = 1
+    printing = False  # What a status request reports
+    instances = []
+
+    def __init__(self, device_specifier):
+        self.written = []
+        self.replies = deque()
+        self.disposed = False
+        FakeBackend.instances.append(self)
+
+    def write(self, data):
+        if bytes(data) == printer_session.STATUS_REQUEST:
+            phase = emulator.PHASE_PRINTING if FakeBackend.printing else emulator.PHASE_WAITING
+            self.replies.append(emulator.status_reply(emulator.STATUS_REPLY, phase))
+            return
+        if FakeBackend.fail_writes:
+            FakeBackend.fail_writes -= 1
+            raise OSError("stale USB handle")
+        self.written.append(bytes(data))
+        if not bytes(data).strip(b'\x00'):
+            return  # Invalidate bytes alone print nothing
+        for _ in range(FakeBackend.pages_per_job):
+            self.replies.append(emulator.status_reply(emulator.STATUS_PRINTING_COMPLETED, emulator.PHASE_PRINTING))
+        self.replies.append(emulator.status_reply(emulator.STATUS_PHASE_CHANGE, emulator.PHASE_WAITING))
+
+    def read(self, length=32):
+        return self.replies.popleft() if self.replies else b''
+
+    def dispose(self):
+        self.disposed = True
+
+
+@check
+def check_printer_session_retry_and_on_page():
+    printer_session.register_backend('selfcheck-fake', FakeBackend)
+    FakeBackend.instances.clear()
+    FakeBackend.pages_per_job = 3
+    FakeBackend.printing = False
+    session = printer_session.PrinterSession('fake://ql700', 'selfcheck-fake', status_timeout=1)
+    job = b'\x00' * 200 + b'job 1'
+
+    # A write failing on the leading invalidate bytes sent nothing: reconnect and send the job again.
+    # Each confirmed page reaches on_page
+    FakeBackend.fail_writes = 1
+    printed = []
+    status = session.send(job, pages=3, on_page=printed.append)
+    assert status['outcome'] == 'printed' and status['did_print'], f"status: {status}"
+    assert printed == [1, 2, 3], f"on_page calls: {printed}"
+    assert session.reconnects == 1 and len(FakeBackend.instances) == 2, "write was not retried on a new handle"
+    assert FakeBackend.instances[0].disposed and FakeBackend.instances[1].written == [job]
+
+    # The open handle is reused by the next job
+    session.send(b'job 2', pages=3)
+    assert len(FakeBackend.instances) == 2 and FakeBackend.instances[1].written == [job, b'job 2']
+
+    # Part of the job was sent: sent again only if the printer reports it is idle ...
+    FakeBackend.fail_writes = 1
+    status = session.send(b'job 3', pages=3)
+    assert status['outcome'] == 'printed' and session.reconnects == 2, "idle printer: job not sent again"
+    assert FakeBackend.instances[-1].written == [b'job 3']
+
+    # ... not while it is printing, which could print a label twice
+    FakeBackend.fail_writes = 1
+    FakeBackend.printing = True
+    logging.disable(logging.ERROR)  # The refusal is logged as an error
+    try:
+        session.send(b'job 4', pages=3)
+    except OSError:
+        pass
+    else:
+        raise AssertionError("job sent again while the printer was printing")
+    finally:
+        logging.disable(logging.NOTSET)
+    assert session.reconnects == 2 and not any(b'job 4' in data for data in FakeBackend.instances[-1].written)
+    FakeBackend.printing = False
+
+    # A second failure in a row is raised, and the device is closed for the next job
+    FakeBackend.fail_writes = 2
+    try:
+        session.send(job, pages=3)
+    except OSError:
+        pass
+    else:
+        raise AssertionError("a write failing after the retry was not raised")
+    assert not session.is_open and session.reconnects == 3
+
+
+@check
+def check_fleet_stacks_stay_ordered():
+    sent = []
+
+    def send(instructions, printer_identifier, **kwargs):
+        sent.append((printer_identifier, instructions))
+        if printer_identifier == 'b' and sum(printer == 'b' for printer, _ in sent) == 3:
+            return {'outcome': 'error', 'printer_state': {'errors': ['End of media']}}
+        return {'outcome': 'printed'}
+
+    report = fleet.FleetScheduler(['a', 'b', 'c'], render=lambda unit: unit, send=send,
+                                  log=lambda message: None).run([(unit,) for unit in range(30)])
+    assert not report['unprinted'], f"unprinted: {report['unprinted']}"
+    for result in report['printers']:
+        printed = [unit for printer, unit in sent if printer == result['printer']]
+        if not result['healthy']:
+            printed = printed[:-1]  # The failed unit is printed again elsewhere
+        stacks = [unit for first, last in result['stacks'] for unit in range(first, last + 1)]
+        assert stacks == printed, f"{result['printer']}: stacks {result['stacks']}, printed {printed}"
+        # Only taking over a failed printer's range starts a second stack
+        assert len(result['stacks']) <= 2, f"{result['printer']}: stacks {result['stacks']}"
+    assert {unit for _, unit in sent} == set(range(30))
+
+
+@check
+def check_fleet_shares_follow_measured_rates():
+    def run(weights):
+        return fleet.FleetScheduler(['a', 'b', 'c'], render=lambda unit: unit, send=lambda **kwargs: None,
+                                    weights=weights, log=lambda message: None).run([(unit,) for unit in range(50)])
+
+    report = run({'a': 3.0, 'b': 1.0})  # c gets the average
+    stacks = {result['printer']: result['stacks'] for result in report['printers']}
+    assert stacks == {'a': [(0, 24)], 'b': [(25, 32)], 'c': [(33, 49)]}, f"stacks {stacks}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'rates.json')
+        assert fleet.load_rates(path) == {}
+        fleet.save_rates(report, path)
+        rates = fleet.load_rates(path)
+        assert set(rates) == {'a', 'b', 'c'} and all(rate > 0 for rate in rates.values()), f"rates {rates}"
+        # A printer that printed nothing keeps its earlier rate
+        idle = {'printers': [{'printer': 'a', 'units': 0, 'labels_per_second': 99.0}]}
+        fleet.save_rates(idle, path)
+        assert fleet.load_rates(path) == rates
+        with open(path, 'w') as f:
+            f.write('not json')
+        assert fleet.load_rates(path) == {}
+
+
+def render_or_die(value):
+    # Top level, so spawned workers can unpickle it
+    if value is None:
+        os._exit(1)
+    return value * 2
+
+
+def render_slowly(value):
+    # Later jobs of each five finish first, so results() has to put them back in order
+    if value < 0:
+        raise ValueError(f"bad job {value}")
+    time.sleep(0.02 * (5 - value % 5))
+    return value * 2
+
+
+@check
+def check_job_engine_priority_and_cancel():
+    sending, release = threading.Event(), threading.Event()
+    sent = []
+
+    def send(instructions, printer_identifier, pages, **kwargs):
+        sending.set()
+        assert release.wait(10), "send never released"
+        sent.append(printer_identifier)
+        return {'outcome': 'printed'}
+
+    started = []
+
+    def on_update(job):
+        if job.state == job_engine.RUNNING and job.id not in started:
+            started.append(job.id)
+
+    saved = job_engine.send
+    job_engine.send = send
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'jobs.csv')
+            with open(path, 'w', newline='') as f:
+                f.write('Name\nAlpha\nBeta\nGamma\n')
+            engine = job_engine.JobEngine(queue_size=3, on_update=on_update)
+
+            def job(priority, end=1):
+                return engine.submit(job_engine.PrintJob(path, ['Name'], printer='selfcheck', end=end,
+                                                         priority=priority, mode='1'))
+
+            # The first job holds the printer in its first batch while the others queue up behind it
+            running = job('normal', end=3)
+            assert sending.wait(10), "first job never reached the printer"
+            low, urgent, high = job('low'), job('urgent'), job('high')
+            try:
+                job('normal')
+            except job_engine.QueueFull:
+                pass
+            else:
+                raise AssertionError("a fourth job fitted in a queue of three")
+            positions = engine.queue_positions()
+            assert [positions[j.id] for j in (urgent, high, low)] == [1, 2, 3], f"queue positions {positions}"
+
+            # A queued job is dropped at once, a running one stops before its next batch
+            assert engine.cancel(low.id).state == job_engine.CANCELLED and engine.queue_depth() == 2
+            engine.cancel(running.id)
+            release.set()
+            deadline = time.time() + 10
+            while not all(j.finished_state for j in (running, urgent, high)) and time.time() < deadline:
+                time.sleep(0.01)
+            assert running.state == job_engine.CANCELLED and running.progress == 1, \
+                f"running job {running.state} after {running.progress} labels"
+            assert (urgent.state, high.state) == (job_engine.COMPLETED, job_engine.COMPLETED)
+            assert started == [running.id, urgent.id, high.id], f"jobs ran in order {started}"
+            assert sent == ['selfcheck'] * 3, f"{len(sent)} batches sent"
+    finally:
+        job_engine.send = saved
+        release.set()
+
+
+@check
+def check_pipeline_keeps_order_and_bounds_queue():
+    jobs = [(n,) for n in range(5)] + [(-1,)] + [(n,) for n in range(5, 12)]
+    expected = [(job, None if job[0] < 0 else job[0] * 2, ValueError if job[0] < 0 else None) for job in jobs]
+    for workers in (0, 2):
+        taken = []
+
+        def feed():
+            for job in jobs:
+                taken.append(job)
+                yield job
+
+        with pipeline.RenderPipeline(render_slowly, workers=workers) as engine:
+            results = []
+            for job, result, error in engine.results(feed()):
+                # Topped up by one before each hand-over, never further ahead than that
+                assert len(taken) <= len(results) + 1 + engine.queue_size, f"{len(taken)} jobs taken"
+                results.append((job, result, type(error) if error else None))
+            assert results == expected, f"workers={workers}: {results}"
+            # A failed job doesn't stop the ones after it, in completion order too
+            done = sorted((job, result, type(error) if error else None)
+                          for job, result, error in engine.completed(jobs))
+            assert done == sorted(expected), f"workers={workers}: completed() gave {done}"
+
+
+@check
+def check_raster_cache_put_get_evict():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = raster_cache.RasterCache(os.path.join(tmp, 'cache'), max_bytes=10000)
+        assert cache.get('ab' * 32) is None and cache.misses == 1
+        cache.put('ab' * 32, b'instructions')
+        assert bytes(cache.get('ab' * 32)) == b'instructions' and cache.hits == 1
+
+        # Writers racing on the same keys: readers only ever see a whole entry
+        keys = [f"{n:02x}" * 32 for n in range(8)]
+        payloads = {key: bytes([n]) * 500 for n, key in enumerate(keys)}
+        torn = []
+
+        def writer():
+            for _ in range(20):
+                for key in keys:
+                    cache.put(key, payloads[key])
+                    data = cache.get(key)
+                    if data is not None and bytes(data) != payloads[key]:
+                        torn.append(key)
+
+        threads = [threading.Thread(target=writer) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not torn, f"partial entries read for {sorted(set(torn))}"
+        assert not [name for _, _, names in os.walk(cache.directory) for name in names if name.endswith('.tmp')]
+
+        # Least recently used go first, down to EVICT_TO of the bound
+        for age, key in enumerate(keys):
+            os.utime(cache.path(key), (time.time() - 1000 + age, time.time() - 1000 + age))
+        for n in range(8, 24):
+            cache.put(f"{n:02x}" * 32, bytes(500))
+        assert cache.size <= cache.max_bytes, f"{cache.size} bytes left"
+        kept = [key for key in keys if os.path.exists(cache.path(key))]
+        assert len(kept) < len(keys) and kept == keys[len(keys) - len(kept):], "newer entries evicted before older ones"
+        assert all(os.path.exists(cache.path(f"{n:02x}" * 32)) for n in range(8, 24)), "a recent entry was evicted"
+        cache.clear()
+        assert cache.size == 0
+
+        # Worker processes fill the cache, a later inline run is served from it
+        # (keyed like the print scripts' renders; a function of this script would be __mp_main__ in a worker)
+        build = functools.partial(print_labels_enhanced.build_label_instructions, mode='1')
+        render = raster_cache.CachedRender(build, os.path.join(tmp, 'shared'))
+        jobs = [([name],) for name in ('Lamp', 'Desk', 'Lamp', 'Chair')]
+        expected = [build(*job) for job in jobs]
+        with pipeline.RenderPipeline(render, workers=2) as engine:
+            assert [bytes(result) for _, result, _ in engine.results(jobs)] == expected
+        shared = raster_cache.get_cache(render.directory)
+        before = shared.hits
+        assert [bytes(render(*job)) for job in jobs] == expected
+        assert shared.hits - before == len(jobs), "entries written by workers were not reused"
+
+
+@check
+def check_log_buffer_since_pages_without_gaps():
+    logs = log_buffer.LogBuffer(capacity=4)
+    for n in range(3):
+        logs.append(f"m{n}", job_id='a' if n % 2 else 'b')
+    records, cursor, complete = logs.since(0, limit=2)
+    assert [r.message for r in records] == ['m0', 'm1'] and cursor == 2 and complete
+    records, cursor, complete = logs.since(cursor)
+    assert [r.message for r in records] == ['m2'] and cursor == 3 and complete
+    assert [r.message for r in logs.since(0, job_id='a')[0]] == ['m1']
+
+    # A number appended but not written yet: the cursor stops before it, so it isn't skipped
+    seq = next(logs._counter)
+    logs._last = seq
+    records, cursor, complete = logs.since(3)
+    assert records == [] and cursor == 3, f"cursor {cursor} past an unwritten record"
+    logs._slots[seq % logs.capacity] = log_buffer.LogRecord(seq, 0.0, 0.0, 'info', None, 'late')
+    records, cursor, _ = logs.since(cursor)
+    assert [r.message for r in records] == ['late'] and cursor == seq
+
+    # Records that fell out of the buffer are reported
+    for n in range(6):
+        logs.append(f"n{n}")
+    records, cursor, complete = logs.since(2)
+    assert not complete and [r.message for r in records] == ['n2', 'n3', 'n4', 'n5'] and cursor == logs.last_seq
+
+
+@check
+def check_pipeline_survives_dead_worker():
+    with pipeline.RenderPipeline(render_or_die, workers=1, queue_size=2) as engine:
+        jobs = [(1,), (2,), (None,), (4,), (5,), (6,), (7,)]
+        results = list(engine.results(jobs))
+        assert [job for job, _, _ in results] == jobs, "results out of order"
+        failed = [job for job, _, error in results if error is not None]
+        assert all(isinstance(error, (BrokenProcessPool, type(None))) for _, _, error in results)
+        # Only what was in flight when the worker died fails: the queue plus the job topped up before the crash showed
+        assert failed == jobs[2:2 + len(failed)] and len(failed) <= engine.queue_size + 1, f"failed jobs: {failed}"
+        assert results[-1][1] == 14, "jobs after the crash did not get a new pool"
+        assert [result for _, result, _ in engine.results([(8,), (9,)])] == [16, 18], "pool not recreated"
+        assert sorted(result for _, result, _ in engine.completed([(None,), (3,)]) if result) in ([], [6])
+        assert [result for _, result, _ in engine.completed([(10,)])] == [20], "pool not recreated after completed()"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the print pipeline regression checks')
+    parser.add_argument('names', nargs='*', help='Only run checks whose name contains one of these')
+    args = parser.parse_args()
+    # Checks provoke warnings on purpose (reconnects, fallbacks)
+    logging.basicConfig(level=logging.ERROR)
+
+    selected = [(name, fn) for name, fn in CHECKS if not args.names or any(part in name for part in args.names)]
+    failed = 0
+    for name, fn in selected:
+        try:
+            fn()
+        except Exception:
+            failed += 1
+            print(f"FAIL {name}")
+            traceback.print_exc()
+        else:
+            print(f"ok   {name}")
+    print(f"{len(selected) - failed}/{len(selected)} checks passed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
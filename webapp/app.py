@@ -5,20 +5,27 @@ A Flask web application for printing labels with QR codes
 """
 
 import os
-import io
-import csv
 import threading
 import base64
 import logging
 import webbrowser
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from werkzeug.utils import secure_filename
 
 # Import print utilities
 try:
-    from . import print_utils
+    from . import (csv_index, csv_ingest, event_stream, job_engine, log_buffer, metrics, pipeline, preview_cache,
+                   print_utils)
 except ImportError:
+    import csv_index
+    import csv_ingest
+    import event_stream
+    import job_engine
+    import log_buffer
+    import metrics
+    import pipeline
+    import preview_cache
     import print_utils
 
 # Configure logging
@@ -33,7 +40,14 @@ app.config.update({
     'MAX_CONTENT_LENGTH': 5 * 1024 * 1024,  # 5MB upload limit
     'UPLOAD_FOLDER': os.path.join(os.path.dirname(__file__), 'uploads'),
     'SAMPLE_FOLDER': os.path.join(os.path.dirname(__file__), 'defaults'),
-    'SECRET_KEY': os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
+    'SECRET_KEY': os.environ.get('SECRET_KEY', 'dev-key-change-in-production'),
+    'RENDER_MODE': os.environ.get('RENDER_MODE', 'RGB'),  # 'RGB', 'L' or '1' (native 1-bit)
+    'PREVIEW_WORKERS': int(os.environ.get('PREVIEW_WORKERS', pipeline.default_workers())),  # 0 renders in-thread
+    'PRINT_QUEUE_SIZE': int(os.environ.get('PRINT_QUEUE_SIZE', job_engine.QUEUE_SIZE)),  # Queued jobs per printer
+    'PRINT_WORKERS': int(os.environ.get('PRINT_WORKERS', 0)),  # Render-ahead processes per running job
+    'RASTER_CACHE': os.environ.get('RASTER_CACHE') or None,  # Directory of cached instruction bytes, unset = off
+    'LOG_CAPACITY': int(os.environ.get('LOG_CAPACITY', log_buffer.LOG_CAPACITY)),  # Log records kept in memory
+    'METRICS': os.environ.get('METRICS', '1') != '0'  # Stage timers and counters behind /metrics
 })
 
 # Create required directories
@@ -45,10 +59,20 @@ ALLOWED_EXTENSIONS = {'csv'}
 MAX_ROWS_PREVIEW = 1000
 MAX_PRINT_BATCH = 10000
 
+# Preview gallery paging
+DEFAULT_PREVIEW_PAGE = 24
+MAX_PREVIEW_PAGE = 100
+DEFAULT_THUMBNAIL_SIZE = 232
+PREVIEW_PAGE_CACHE_SIZE = 64
+
 # Application state
-app_logs = []
-job_status = {'running': False, 'progress': 0, 'total': 0, 'start_time': None}
-log_lock = threading.Lock()
+app_logs = log_buffer.LogBuffer(app.config['LOG_CAPACITY'])
+pipeline_lock = threading.Lock()
+events = event_stream.EventBus()
+preview_images = preview_cache.PreviewCache()
+preview_pages = preview_cache.PreviewCache(max_entries=PREVIEW_PAGE_CACHE_SIZE)
+prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview-prefetch')
+thumbnail_pipeline = None
 
 
 def allowed_file(filename):
@@ -56,18 +80,22 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def log_message(message, level='info'):
-    """Thread-safe logging with timestamp"""
-    timestamp = datetime.now().strftime('%H:%M:%S')
-    log_entry = f"[{timestamp}] {message}"
-    
-    with log_lock:
-        app_logs.append(log_entry)
-        # Keep only last 200 log entries
-        if len(app_logs) > 200:
-            app_logs.pop(0)
-    
-    logger.info(message)
+def log_message(message, level='info', job_id=None):
+    """Record a log line in the ring buffer and push it to event stream clients"""
+    record = app_logs.append(message, level, job_id)
+    events.publish('log', log_buffer.record_json(record))
+    getattr(logger, level, logger.info)(message)
+
+
+# Print jobs run on one worker thread per printer, never on request threads
+jobs = job_engine.JobEngine(queue_size=app.config['PRINT_QUEUE_SIZE'],
+                            render_workers=app.config['PRINT_WORKERS'], log=log_message,
+                            raster_cache_dir=app.config['RASTER_CACHE'],
+                            on_update=lambda job: events.publish('job', job.to_dict()))
+
+metrics.enable(app.config['METRICS'])
+metrics.registry.gauge('print_queue_depth', jobs.queue_depth, 'Print jobs waiting in printer queues')
+metrics.registry.gauge('print_jobs_running', jobs.running, 'Print jobs currently printing')
 
 
 @app.route('/')
@@ -112,23 +140,13 @@ def upload_csv():
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             counter += 1
         
-        file.save(filepath)
-        log_message(f"File uploaded: {filename}")
-        
-        # Parse CSV and extract columns
+        # Save and parse in one pass: row count, column stats and row index
         try:
-            with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-                reader = csv.DictReader(f)
-                fieldnames = reader.fieldnames or []
-                
-                if not fieldnames:
-                    raise ValueError("No column headers found")
-                
-                # Count rows for validation
-                row_count = sum(1 for _ in reader)
-                
-                if row_count > MAX_ROWS_PREVIEW:
-                    log_message(f"Large CSV detected: {row_count} rows", 'warning')
+            stats = csv_ingest.ingest(file.stream, filepath)
+            log_message(f"File uploaded: {filename}")
+            
+            if stats['rows'] > MAX_ROWS_PREVIEW:
+                log_message(f"Large CSV detected: {stats['rows']} rows", 'warning')
         
         except Exception as e:
             # Clean up failed upload
@@ -140,8 +158,9 @@ def upload_csv():
         
         return jsonify({
             'path': filepath,
-            'columns': fieldnames,
-            'rows': row_count
+            'columns': stats['columns'],
+            'rows': stats['rows'],
+            'column_stats': {'non_empty': stats['non_empty'], 'max_length': stats['max_length']}
         })
     
     except Exception as e:
@@ -158,17 +177,15 @@ def use_sample():
         if not os.path.exists(sample_file):
             return jsonify({'error': 'Sample data not available'}), 404
         
-        with open(sample_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            fieldnames = reader.fieldnames or []
-            row_count = sum(1 for _ in reader)
+        stats = csv_ingest.get_stats(sample_file)
         
         log_message("Sample data loaded")
         
         return jsonify({
             'path': sample_file,
-            'columns': fieldnames,
-            'rows': row_count
+            'columns': stats['columns'],
+            'rows': stats['rows'],
+            'column_stats': {'non_empty': stats['non_empty'], 'max_length': stats['max_length']}
         })
     
     except Exception as e:
@@ -176,13 +193,35 @@ def use_sample():
         return jsonify({'error': 'Failed to load sample data'}), 500
 
 
-@app.route('/preview', methods=['POST'])
+def row_text(filepath, columns, row_number):
+    """Label text for one CSV row (see print_utils.label_text)"""
+    index = csv_index.get_index(filepath, errors='replace')
+    for row in index.rows(row_number, row_number + 1):
+        return print_utils.label_text(row, columns)
+    return ''
+
+
+@app.route('/preview', methods=['GET', 'POST'])
 def preview():
-    """Generate label preview image"""
+    """
+    Label preview as a 1-bit PNG, cached per (file hash, columns, qr, row)
+
+    GET takes path, columns (repeated), qr and row as query parameters, so
+    browsers can revalidate with If-None-Match; POST takes the same fields
+    as JSON. row defaults to the first row with data in the selected columns.
+    """
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'error': 'No data provided'}), 400
+        if request.method == 'POST':
+            data = request.get_json(silent=True)
+            if not data:
+                return jsonify({'error': 'No data provided'}), 400
+        else:
+            data = {
+                'path': request.args.get('path'),
+                'columns': request.args.getlist('columns'),
+                'qr': request.args.get('qr', '1').lower() not in ('0', 'false', 'no'),
+                'row': request.args.get('row'),
+            }
         
         filepath = data.get('path')
         columns = data.get('columns', [])
@@ -195,47 +234,157 @@ def preview():
         if not columns:
             return jsonify({'error': 'No columns selected'}), 400
         
-        # Read first valid row
-        with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-            reader = csv.DictReader(f)
-            
-            if not reader.fieldnames:
-                return jsonify({'error': 'Invalid CSV format'}), 400
-            
-            # Validate columns exist
-            for col in columns:
-                if col not in reader.fieldnames:
-                    return jsonify({'error': f'Column "{col}" not found'}), 400
-            
-            # Find first non-empty row
-            preview_data = None
-            for row in reader:
-                values = [str(row.get(col, '')).strip() for col in columns]
-                if any(values):
-                    preview_data = ' - '.join(filter(None, values))
-                    break
-            
-            if not preview_data:
+        # Column stats from the upload pass know the file hash and the first non-empty row
+        try:
+            stats = csv_ingest.get_stats(filepath)
+        except ValueError:
+            return jsonify({'error': 'Invalid CSV format'}), 400
+        
+        # Validate columns exist
+        for col in columns:
+            if col not in stats['columns']:
+                return jsonify({'error': f'Column "{col}" not found'}), 400
+        
+        if data.get('row') not in (None, ''):
+            try:
+                row_number = int(data['row'])
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid row'}), 400
+            if not 0 <= row_number < stats['rows']:
+                return jsonify({'error': f'Row {row_number} out of range'}), 400
+        else:
+            row_number = csv_ingest.first_row_with_data(stats, columns)
+            if row_number is None:
                 return jsonify({'error': 'No data found in selected columns'}), 400
         
-        # Generate preview image
-        img = print_utils.create_label_image_preview(preview_data, qr_enabled=include_qr)
+        key = preview_cache.preview_key(stats['sha256'], columns, include_qr, row_number,
+                                        app.config['RENDER_MODE'])
+        etag = preview_cache.etag_for(key)
         
-        # Convert to base64
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        img_base64 = base64.b64encode(buffer.read()).decode('ascii')
+        def render():
+            preview_data = row_text(filepath, columns, row_number)
+            if not preview_data:
+                raise LookupError('No data found in selected columns')
+            log_message(f"Preview generated for: {preview_data[:50]}...")
+            return preview_cache.render_preview(preview_data, include_qr, app.config['RENDER_MODE'])
         
-        log_message(f"Preview generated for: {preview_data[:50]}...")
+        # The ETag only depends on the key, so a revalidation never renders
+        if etag not in request.if_none_match:
+            try:
+                png = preview_images.get(key, render)
+            except LookupError as e:
+                return jsonify({'error': str(e)}), 400
+        else:
+            png = b''
         
-        return jsonify({'image_base64': img_base64})
+        response = Response(png, mimetype='image/png')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     
     except Exception as e:
         logger.error(f"Preview error: {e}")
         return jsonify({'error': 'Preview generation failed'}), 500
 
 
+def get_thumbnail_pipeline():
+    """Worker processes rendering gallery thumbnails, started on first use"""
+    global thumbnail_pipeline
+    with pipeline_lock:
+        if thumbnail_pipeline is None:
+            thumbnail_pipeline = pipeline.RenderPipeline(preview_cache.render_preview,
+                                                         workers=app.config['PREVIEW_WORKERS'])
+        return thumbnail_pipeline
+
+
+def build_preview_page(filepath, stats, columns, include_qr, offset, limit, size):
+    """Render one gallery page: thumbnails for rows offset..offset+limit-1"""
+    mode = app.config['RENDER_MODE']
+    index = csv_index.get_index(filepath, errors='replace')
+    items = []
+    todo = []
+    
+    # Seek straight to the page and reuse any thumbnails already rendered
+    for row_number, row in enumerate(index.rows(offset, offset + limit), offset):
+        text = print_utils.label_text(row, columns)
+        key = preview_cache.preview_key(stats['sha256'], columns, include_qr, row_number, mode, size)
+        item = {'row': row_number, 'text': text, 'image_base64': None}
+        items.append(item)
+        if text:
+            png = preview_images.peek(key)
+            if png is not None:
+                item['image_base64'] = base64.b64encode(png).decode('ascii')
+            else:
+                todo.append((item, key))
+    
+    # Render the rest concurrently, caching each thumbnail for /preview and later pages
+    jobs = [(item['text'], include_qr, mode, size) for item, _ in todo]
+    for (item, key), (_, png, error) in zip(todo, get_thumbnail_pipeline().results(jobs)):
+        if error is not None:
+            logger.error(f"Thumbnail error for row {item['row']}: {error}")
+            item['error'] = 'Preview generation failed'
+        else:
+            preview_images.put(key, png)
+            item['image_base64'] = base64.b64encode(png).decode('ascii')
+    
+    next_offset = offset + limit if offset + limit < stats['rows'] else None
+    return {'offset': offset, 'limit': limit, 'size': size, 'total': stats['rows'],
+            'next_offset': next_offset, 'items': items}
+
+
+@app.route('/previews', methods=['GET'])
+def previews():
+    """
+    Paged preview gallery: thumbnails for a page of rows
+    
+    Query parameters: path, columns (repeated), qr, offset, limit and size
+    (thumbnail width in pixels). Pages are cached, and the next page is
+    rendered in the background while the current one is being viewed.
+    """
+    try:
+        filepath = request.args.get('path')
+        columns = request.args.getlist('columns')
+        include_qr = request.args.get('qr', '1').lower() not in ('0', 'false', 'no')
+        
+        if not filepath or not os.path.exists(filepath):
+            return jsonify({'error': 'CSV file not found'}), 400
+        
+        if not columns:
+            return jsonify({'error': 'No columns selected'}), 400
+        
+        try:
+            offset = max(0, int(request.args.get('offset', 0)))
+            limit = min(MAX_PREVIEW_PAGE, max(1, int(request.args.get('limit', DEFAULT_PREVIEW_PAGE))))
+            size = min(print_utils.LABEL_SPECS['62']['width'], max(32, int(request.args.get('size', DEFAULT_THUMBNAIL_SIZE))))
+        except ValueError:
+            return jsonify({'error': 'offset, limit and size must be integers'}), 400
+        
+        try:
+            stats = csv_ingest.get_stats(filepath)
+        except ValueError:
+            return jsonify({'error': 'Invalid CSV format'}), 400
+        
+        for col in columns:
+            if col not in stats['columns']:
+                return jsonify({'error': f'Column "{col}" not found'}), 400
+        
+        def page_for(page_offset):
+            key = (stats['sha256'], tuple(columns), include_qr, page_offset, limit, size, app.config['RENDER_MODE'])
+            return key, lambda: build_preview_page(filepath, stats, columns, include_qr, page_offset, limit, size)
+        
+        page = preview_pages.get(*page_for(offset))
+        
+        # Prefetch the next page so paging forward doesn't wait for renders
+        if page['next_offset'] is not None:
+            prefetch_pool.submit(preview_pages.get, *page_for(page['next_offset']))
+        
+        return jsonify(page)
+    
+    except Exception as e:
+        logger.error(f"Preview gallery error: {e}")
+        return jsonify({'error': 'Preview gallery failed'}), 500
+
+
 @app.route('/printers', methods=['GET'])
 def detect_printers():
     """Detect available Brother QL printers"""
@@ -249,18 +398,186 @@ def detect_printers():
         return jsonify({'printers': [], 'error': str(e)})
 
 
+def job_json(job, positions=None):
+    data = job.to_dict()
+    if positions is not None and job.id in positions:
+        data['position'] = positions[job.id]
+    return data
+
+
+@app.route('/print', methods=['POST'])
+def start_print():
+    """Queue a print job for a row range of a CSV file"""
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        filepath = data.get('path')
+        columns = data.get('columns', [])
+        
+        if not filepath or not os.path.exists(filepath):
+            return jsonify({'error': 'CSV file not found'}), 400
+        
+        if not columns:
+            return jsonify({'error': 'No columns selected'}), 400
+        
+        try:
+            stats = csv_ingest.get_stats(filepath)
+        except ValueError:
+            return jsonify({'error': 'Invalid CSV format'}), 400
+        
+        for col in columns:
+            if col not in stats['columns']:
+                return jsonify({'error': f'Column "{col}" not found'}), 400
+        
+        try:
+            start = int(data.get('start') or 1)
+            end = int(data['end']) if data.get('end') not in (None, '') else None
+            batch_size = int(data.get('batch_size') or 1)
+            job = job_engine.PrintJob(filepath, columns, printer=data.get('printer'), start=start, end=end,
+                                      batch_size=batch_size, qr=bool(data.get('qr', True)),
+                                      priority=data.get('priority', 'normal'), mode=app.config['RENDER_MODE'])
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'Invalid print options: {e}'}), 400
+        
+        count = min(end or stats['rows'], stats['rows']) - (start - 1)
+        if count <= 0:
+            return jsonify({'error': 'No rows in the selected range'}), 400
+        if count > MAX_PRINT_BATCH:
+            return jsonify({'error': f'Too many labels ({count}), max {MAX_PRINT_BATCH} per job'}), 400
+        
+        # Events after this sequence number cover the job from the moment it is queued
+        seq = events.last_seq
+        try:
+            jobs.submit(job)
+        except job_engine.QueueFull as e:
+            return jsonify({'error': str(e)}), 429
+        
+        return jsonify(dict(job_json(job, jobs.queue_positions()), seq=seq)), 202
+    
+    except Exception as e:
+        logger.error(f"Print job error: {e}")
+        return jsonify({'error': 'Failed to start print job'}), 500
+
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """All jobs in the job table, newest first"""
+    positions = jobs.queue_positions()
+    return jsonify({'jobs': [job_json(job, positions) for job in jobs.jobs()]})
+
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """One job's state and progress"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_json(job, jobs.queue_positions()))
+
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued job, or stop a running one before its next label batch"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_json(job))
+
+
+@app.route('/logs', methods=['GET'])
+def get_logs():
+    """
+    Structured log records after a cursor
+    
+    ?since=<seq> (default 0), ?limit=<n> (default 500) and ?job=<id>.
+    Pass the returned seq as since to read on; complete is False if older
+    records were already overwritten.
+    """
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', 500, type=int), app_logs.capacity)
+    records, cursor, complete = app_logs.since(since, limit=limit, job_id=request.args.get('job', type=int))
+    return jsonify({
+        'seq': cursor,
+        'complete': complete,
+        'records': [log_buffer.record_json(record) for record in records]
+    })
+
+
 @app.route('/status', methods=['GET'])
 def get_status():
-    """Get current job status and recent logs"""
-    with log_lock:
-        recent_logs = app_logs[-50:]  # Last 50 log entries
+    """
+    Get current job status and recent logs
+    
+    With ?since=<seq> only log lines and job updates newer than seq are
+    returned, plus the new seq to pass next time. If those events have
+    already dropped out of the history the full status is returned with
+    reset set.
+    """
+    seq = events.last_seq
+    since = request.args.get('since', type=int)
+    job_id = request.args.get('job', type=int)
+    
+    if since is not None:
+        new_events, complete = events.since(since)
+        if complete:
+            updates = {event['data']['id']: event['data'] for event in new_events if event['type'] == 'job'}
+            return jsonify({
+                'seq': new_events[-1]['seq'] if new_events else since,
+                'job': updates.get(job_id),
+                'jobs': list(updates.values()),
+                'logs': [event['data']['line'] for event in new_events if event['type'] == 'log']
+            })
+    
+    recent_logs = [log_buffer.format_record(record) for record in app_logs.tail(50)]  # Last 50 log entries
+    
+    # 'job' is the requested job, else the running (or most recent) one, for the progress bar
+    all_jobs = jobs.jobs()
+    current = jobs.get(job_id)
+    current = current or next((job for job in all_jobs if job.state == job_engine.RUNNING), None)
+    current = current or next(iter(all_jobs), None)
+    idle = {'running': False, 'progress': 0, 'total': 0, 'start_time': None}
     
+    positions = jobs.queue_positions()
     return jsonify({
-        'job': job_status,
+        'seq': seq,
+        'reset': since is not None,
+        'job': job_json(current, positions) if current else idle,
+        'jobs': [job_json(job, positions) for job in all_jobs if not job.finished_state],
         'logs': recent_logs
     })
 
 
+@app.route('/events', methods=['GET'])
+def event_feed():
+    """
+    Server-Sent Events stream of job updates ('job') and log lines ('log')
+    
+    Resumes after the Last-Event-ID header (sent by EventSource on reconnect)
+    or ?since=<seq>; otherwise only events from now on are sent.
+    """
+    last_seq = request.headers.get('Last-Event-ID', type=int)
+    if last_seq is None:
+        last_seq = request.args.get('since', type=int)
+    if last_seq is None:
+        last_seq = events.last_seq
+    
+    response = Response(stream_with_context(event_stream.stream(events, last_seq)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let a reverse proxy buffer the stream
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Stage timings, counters and queue depth in Prometheus text format"""
+    if not metrics.enabled():
+        return jsonify({'error': 'Metrics are disabled (METRICS=0)'}), 404
+    return Response(metrics.registry.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.errorhandler(413)
 def too_large(e):
     return jsonify({'error': 'File too large (max 5MB)'}), 413
@@ -306,6 +623,7 @@ if __name__ == '__main__':
     print("   • CSV upload and column selection")
     print("   • Live label preview with QR codes")
     print("   • Automatic printer detection")
+    print("   • Background print queue with priorities and cancel")
     print("   • Real-time progress tracking")
     print("=" * 50)
     print("Press Ctrl+C to stop")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Byte-offset row index for product CSV files
+One streaming pass records where every row starts, so a range of rows can be
+read by seeking straight to it instead of parsing everything before it
+"""
+
+from array import array
+import csv
+import io
+import logging
+import os
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Sidecar file written next to the CSV: products.csv -> products.csv.idx
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'QLCSVIDX2\n'  # 2: records split by csv.reader
+
+# File size, mtime (ns) and row count, followed by one unsigned 64-bit offset per row
+_HEADER = struct.Struct('<QqQ')
+
+# Bytes read per chunk while scanning
+SCAN_CHUNK = 1 << 20
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def index_path(csv_path):
+    """Sidecar index path for a CSV file"""
+    return str(csv_path) + INDEX_SUFFIX
+
+
+def iter_rows(chunks, encoding='utf-8', errors='strict'):
+    """
+    Yield (start, end, fields) for every record in a stream of byte chunks
+
+    The records are split by csv.reader itself, fed lines cut from the bytes
+    the way a file opened with newline='' cuts them ('\n', '\r\n' or '\r'),
+    so quoting - multi-line fields, a literal quote inside an unquoted field
+    like 27" - is exactly what csv.DictReader sees. csv.reader never reads
+    past the end of a record, so the bytes handed over so far mark where
+    each record ends. The header is the first record; blank lines come
+    through as empty field lists, which csv.DictReader skips.
+    """
+    position = 0
+
+    def lines():
+        nonlocal position
+        carry = b''
+        for chunk in chunks:
+            parts = (carry + chunk).splitlines(keepends=True)
+            # The last line may go on in the next chunk (a final '\r' may be half of '\r\n')
+            carry = parts.pop() if parts and not parts[-1].endswith(b'\n') else b''
+            for line in parts:
+                position += len(line)
+                yield line.decode(encoding, errors)
+        if carry:
+            position += len(carry)
+            yield carry.decode(encoding, errors)
+
+    start = 0
+    for fields in csv.reader(lines()):
+        yield start, position, fields
+        start = position
+
+
+def scan_offsets(f, encoding='utf-8', errors='strict'):
+    """Return (header_end, offsets) for a CSV opened in binary mode"""
+    offsets = array('Q')
+    header_end = None
+    for start, end, fields in iter_rows(iter(lambda: f.read(SCAN_CHUNK), b''), encoding, errors):
+        if header_end is None:
+            header_end = end
+        elif fields:
+            offsets.append(start)
+    return header_end or 0, offsets
+
+
+class CSVIndex:
+    """Row offsets of one CSV file plus its header"""
+
+    def __init__(self, csv_path, size, mtime_ns, header_end, offsets, encoding='utf-8', errors='strict'):
+        self.csv_path = str(csv_path)
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.header_end = header_end
+        self.offsets = offsets
+        self.encoding = encoding
+        self.errors = errors
+        with open(self.csv_path, 'r', encoding=encoding, errors=errors, newline='') as f:
+            self.fieldnames = next(csv.reader(f), [])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def is_current(self, stat=None):
+        """True if the CSV hasn't changed since the index was built"""
+        stat = stat or os.stat(self.csv_path)
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def rows(self, start=0, end=None):
+        """
+        Yield rows start..end-1 (0-based, like a list slice) as dicts
+
+        Only the requested rows are read and parsed.
+        """
+        start, end, _ = slice(start, end).indices(len(self.offsets))
+        if start >= end:
+            return
+        with open(self.csv_path, 'rb') as raw:
+            raw.seek(self.offsets[start])
+            text = io.TextIOWrapper(raw, encoding=self.encoding, errors=self.errors, newline='')
+            reader = csv.DictReader(text, fieldnames=self.fieldnames)
+            for _, row in zip(range(end - start), reader):
+                yield row
+
+    def column(self, name, start=0, end=None):
+        """Values of one column for rows start..end-1"""
+        return [row[name] for row in self.rows(start, end)]
+
+    def save(self, path=None):
+        """Write the sidecar file atomically"""
+        path = path or index_path(self.csv_path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            f.write(_HEADER.pack(self.size, self.mtime_ns, len(self.offsets)))
+            f.write(struct.pack('<Q', self.header_end))
+            self.offsets.tofile(f)
+        os.replace(tmp_path, path)
+
+
+def build_index(csv_path, encoding='utf-8', errors='strict'):
+    """Scan a CSV file and return a fresh CSVIndex (not saved)"""
+    with open(csv_path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        header_end, offsets = scan_offsets(f, encoding, errors)
+    return CSVIndex(csv_path, stat.st_size, stat.st_mtime_ns, header_end, offsets, encoding, errors)
+
+
+def remember(index):
+    """Make an index built elsewhere (e.g. during an upload) available to get_index"""
+    with _lock:
+        _indexes[os.path.abspath(index.csv_path)] = index
+
+
+def load_index(csv_path, encoding='utf-8', errors='strict'):
+    """Read the sidecar index if it exists and still matches the CSV, else None"""
+    try:
+        with open(index_path(csv_path), 'rb') as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                return None
+            size, mtime_ns, count = _HEADER.unpack(f.read(_HEADER.size))
+            header_end, = struct.unpack('<Q', f.read(8))
+            offsets = array('Q')
+            offsets.fromfile(f, count)
+    except (OSError, IOError, struct.error, EOFError):
+        return None
+
+    index = CSVIndex(csv_path, size, mtime_ns, header_end, offsets, encoding, errors)
+    return index if index.is_current() else None
+
+
+def get_index(csv_path, encoding='utf-8', errors='strict', save=True):
+    """
+    Return an up-to-date index for a CSV file
+
+    Uses the in-process copy or the sidecar file while the CSV's size and
+    mtime are unchanged, otherwise rescans and rewrites the sidecar.
+    """
+    key = os.path.abspath(csv_path)
+    stat = os.stat(csv_path)
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None and index.is_current(stat):
+            return index
+
+        index = load_index(csv_path, encoding, errors)
+        if index is None:
+            index = build_index(csv_path, encoding, errors)
+            logger.info(f"Indexed {len(index)} rows of {csv_path}")
+            if save:
+                try:
+                    index.save()
+                except (OSError, IOError) as e:
+                    # Read-only location - the in-process index still works
+                    logger.debug(f"Could not write CSV index for {csv_path}: {e}")
+        _indexes[key] = index
+        return index
+
+
+def read_rows(csv_path, start=0, end=None, encoding='utf-8'):
+    """Rows start..end-1 of a CSV file as a list of dicts, via the index"""
+    return list(get_index(csv_path, encoding).rows(start, end))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Single-pass CSV ingest for the web interface
+Writes an upload to disk while parsing it, collecting the row count, column
+statistics and the row offset index in the same pass
+"""
+
+from array import array
+import hashlib
+import json
+import logging
+import os
+import threading
+
+try:
+    from . import csv_index
+except ImportError:
+    import csv_index
+
+logger = logging.getLogger(__name__)
+
+# Sidecar file with the column statistics: products.csv -> products.csv.stats.json
+STATS_SUFFIX = '.stats.json'
+
+# Bytes copied per read from the upload stream
+CHUNK_SIZE = 256 * 1024
+
+# Bumped whenever the stats layout changes, so older sidecars are rebuilt
+STATS_VERSION = 3
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def stats_path(csv_path):
+    """Sidecar statistics path for a CSV file"""
+    return str(csv_path) + STATS_SUFFIX
+
+
+def ingest(stream, filepath=None, encoding='utf-8', errors='replace'):
+    """
+    Parse a CSV byte stream in one pass, optionally copying it to filepath
+
+    Args:
+        stream: Binary file-like object (e.g. an upload's stream)
+        filepath: Where to write the bytes; None when stream already is that file
+        encoding: Text encoding
+        errors: Decoding error handling
+
+    Returns:
+        Stats dict: columns, rows, non_empty and max_length per column,
+        first_row per column (index of its first non-empty row, or None) and
+        the sha256 of the file contents.
+        The row index and stats are saved next to the file and cached.
+
+    Raises:
+        ValueError: If the file has no header row
+    """
+    out = open(filepath, 'wb') if filepath else None
+    source = filepath or stream.name
+    digest = hashlib.sha256()
+
+    def chunks():
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            if out:
+                out.write(chunk)
+            yield chunk
+
+    offsets = array('Q')
+    header_end = None
+    columns = []
+    non_empty = max_length = first_row = None
+
+    try:
+        for start, end, fields in csv_index.iter_rows(chunks(), encoding, errors):
+            if header_end is None:
+                header_end = end
+                columns = fields
+                non_empty = [0] * len(columns)
+                max_length = [0] * len(columns)
+                first_row = [None] * len(columns)
+                continue
+            if not fields:
+                continue
+
+            row_number = len(offsets)
+            offsets.append(start)
+            for i, value in enumerate(fields[:len(columns)]):
+                if len(value) > max_length[i]:
+                    max_length[i] = len(value)
+                if value.strip():
+                    non_empty[i] += 1
+                    if first_row[i] is None:
+                        first_row[i] = row_number
+    finally:
+        if out:
+            out.close()
+
+    if not columns or not any(columns):
+        raise ValueError("No column headers found")
+
+    stat = os.stat(source)
+    index = csv_index.CSVIndex(source, stat.st_size, stat.st_mtime_ns, header_end, offsets, encoding, errors)
+    stats = {
+        'columns': columns,
+        'rows': len(offsets),
+        'non_empty': dict(zip(columns, non_empty)),
+        'max_length': dict(zip(columns, max_length)),
+        'first_row': dict(zip(columns, first_row)),
+        'sha256': digest.hexdigest(),
+        'version': STATS_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    }
+
+    try:
+        index.save()
+        _save_stats(source, stats)
+    except (OSError, IOError) as e:
+        logger.debug(f"Could not write CSV sidecars for {source}: {e}")
+    csv_index.remember(index)
+    with _lock:
+        _stats[os.path.abspath(source)] = stats
+    return stats
+
+
+def _save_stats(csv_path, stats):
+    path = stats_path(csv_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f)
+    os.replace(tmp_path, path)
+
+
+def _is_current(stats, stat):
+    return (stats.get('version') == STATS_VERSION and
+            stats.get('size') == stat.st_size and stats.get('mtime_ns') == stat.st_mtime_ns)
+
+
+def get_stats(csv_path, encoding='utf-8', errors='replace'):
+    """
+    Return the ingest stats for a CSV file already on disk
+
+    Served from memory or the sidecar while the file is unchanged; otherwise
+    the file is ingested again (without copying).
+    """
+    key = os.path.abspath(csv_path)
+    stat = os.stat(csv_path)
+    with _lock:
+        stats = _stats.get(key)
+    if stats is not None and _is_current(stats, stat):
+        return stats
+
+    try:
+        with open(stats_path(csv_path), 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+        if _is_current(stats, stat):
+            with _lock:
+                _stats[key] = stats
+            return stats
+    except (OSError, IOError, ValueError):
+        pass
+
+    with open(csv_path, 'rb') as f:
+        return ingest(f, encoding=encoding, errors=errors)
+
+
+def first_row_with_data(stats, columns):
+    """Index of the first row with a non-empty value in any of columns, or None"""
+    rows = [stats['first_row'].get(col) for col in columns]
+    rows = [row for row in rows if row is not None]
+    return min(rows) if rows else None
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Emulated Brother QL-700 printer backend
+Takes the real raster instruction stream through the same write()/read()
+interface as brother_ql's backends, parses it into pages, answers with real
+32-byte status replies on a feed/cut timing model, and can decode the pages
+back into images - for benchmarking and testing without hardware
+"""
+
+from collections import deque, namedtuple
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+import packbits
+from PIL import Image
+
+try:
+    from .printer_session import register_backend
+except ImportError:
+    from printer_session import register_backend
+
+logger = logging.getLogger(__name__)
+
+# Backend name to pass as backend_identifier
+BACKEND_NAME = 'emulator'
+
+# QL-700 timing model: 300 dpi head, up to 150 mm/s feed, full cut
+DOTS_PER_MM = 300 / 25.4
+FEED_SPEED = 150.0  # mm/s
+CUT_TIME = 0.35  # s per cut
+PAGE_OVERHEAD = 0.1  # s to start each page
+
+# Status reply fields (see brother_ql.reader)
+STATUS_REPLY = 0x00
+STATUS_PRINTING_COMPLETED = 0x01
+STATUS_ERROR = 0x02
+STATUS_PHASE_CHANGE = 0x06
+PHASE_WAITING = 0x00
+PHASE_PRINTING = 0x01
+# Error information 2, bit 6: media cannot be fed (also when the end is detected)
+ERROR_MEDIA_END = 1 << 6
+
+# Media type codes sent in ESC i z
+CONTINUOUS_TAPE = 0x0A
+
+Page = namedtuple('Page', ['number', 'rows', 'width', 'length_mm', 'cut', 'seconds', 'image'])
+
+
+class TimingModel:
+    """
+    Seconds the printer needs for a page
+
+    scale multiplies every delay: 1.0 is real time, 0.1 ten times faster,
+    0 answers immediately (modelled times are still reported).
+    """
+
+    def __init__(self, feed_speed=FEED_SPEED, cut_time=CUT_TIME, page_overhead=PAGE_OVERHEAD, scale=1.0):
+        self.feed_speed = feed_speed
+        self.cut_time = cut_time
+        self.page_overhead = page_overhead
+        self.scale = scale
+
+    def page_seconds(self, length_mm, cut):
+        return self.page_overhead + length_mm / self.feed_speed + (self.cut_time if cut else 0.0)
+
+
+def status_reply(status_type=STATUS_REPLY, phase=PHASE_WAITING, media_width=62, media_type=CONTINUOUS_TAPE,
+                 media_length=0, error_1=0, error_2=0):
+    """A 32-byte status reply laid out like the QL-700's"""
+    reply = bytearray(32)
+    reply[0:8] = b'\x80\x20\x42\x34\x35\x30\x00\x00'  # Header, series/model code (QL-700), fixed bytes
+    reply[8] = error_1
+    reply[9] = error_2
+    reply[10] = media_width
+    reply[11] = media_type
+    reply[17] = media_length
+    reply[18] = status_type
+    reply[19] = phase
+    return bytes(reply)
+
+
+class EmulatedPrinter:
+    """
+    One emulated printer: parser state, media, timeline and what it printed
+
+    Outlives backend connections, so a reconnect sees the same printer.
+    Pages are printed one after another on a virtual timeline; status
+    replies become readable when the page they report on would be done.
+
+    Args:
+        identifier: Printer identifier
+        timing: TimingModel (default: real time)
+        decode: Keep each page as a mode '1' image
+        output_dir: Also save decoded pages there as PNG
+        media_mm: Tape left on the roll (default: unlimited)
+    """
+
+    def __init__(self, identifier, timing=None, decode=False, output_dir=None, media_mm=None):
+        self.identifier = identifier
+        self.timing = timing or TimingModel()
+        self.decode = decode or bool(output_dir)
+        self.output_dir = output_dir
+        self.media_mm = media_mm
+        self.media_width = 62
+        self.pages = []
+        self.cuts = 0
+        self.bytes_received = 0
+        self.busy_until = 0.0
+        self.modelled_seconds = 0.0
+        self.errors = 0
+        self.error_2 = 0
+        self._replies = deque()  # (ready time, reply bytes)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # ESC @ - back to power-on defaults
+        self._rows = []
+        self._compression = False
+        self._autocut = False
+        self._cut_every = 1
+        self._cut_at_end = False
+        self._uncut_pages = 0
+        self._job_failed = False
+
+    def load_media(self, media_mm=None):
+        """Put a new roll in (default: unlimited) and clear the media error"""
+        with self._lock:
+            self.media_mm = media_mm
+            self.error_2 = 0
+
+    def write(self, data):
+        with self._lock:
+            self.bytes_received += len(data)
+            self._parse(bytes(data))
+
+    def read(self, length=32):
+        """Next status reply whose time has come, or b''"""
+        with self._lock:
+            if self._replies and self._replies[0][0] <= time.time():
+                return self._replies.popleft()[1][:length]
+            return b''
+
+    @property
+    def stats(self):
+        with self._lock:
+            labels = len(self.pages)
+            return {
+                'pages': labels,
+                'cuts': self.cuts,
+                'bytes': self.bytes_received,
+                'errors': self.errors,
+                'modelled_seconds': round(self.modelled_seconds, 3),
+                'labels_per_second': labels / self.modelled_seconds if self.modelled_seconds else 0.0,
+            }
+
+    def _reply(self, delay_until, **fields):
+        self._replies.append((delay_until, status_reply(media_width=self.media_width, **fields)))
+
+    def _parse(self, data):
+        i = 0
+        end = len(data)
+        while i < end:
+            byte = data[i]
+            if byte == 0x00:  # Invalidate / preamble
+                i += 1
+            elif byte == 0x67:  # g 0x00 n: one raster line
+                length = data[i + 2]
+                row = data[i + 3:i + 3 + length]
+                self._rows.append(packbits.decode(row) if self._compression else row)
+                i += 3 + length
+            elif byte == 0x5A:  # Z: blank raster line
+                self._rows.append(None)
+                i += 1
+            elif byte == 0x4D:  # M: compression
+                self._compression = data[i + 1] == 0x02
+                i += 2
+            elif byte in (0x0C, 0x1A):  # Print page (0x1A = last page)
+                self._print_page(last_page=byte == 0x1A)
+                i += 1
+            elif byte == 0x1B:
+                i = self._parse_escape(data, i)
+            else:
+                logger.warning(f"Emulator {self.identifier}: unknown opcode 0x{byte:02X} at byte {i}")
+                i += 1
+
+    def _parse_escape(self, data, i):
+        command = data[i + 1:i + 3]
+        if command[:1] == b'\x40':  # ESC @: initialize
+            self._reset()
+            return i + 2
+        if command == b'\x69\x53':  # ESC i S: status request
+            busy = self.busy_until > time.time()
+            self._reply(time.time(), phase=PHASE_PRINTING if busy else PHASE_WAITING, error_2=self.error_2)
+            return i + 3
+        if command == b'\x69\x61':  # ESC i a: switch mode
+            return i + 4
+        if command == b'\x69\x21':  # ESC i !: automatic status
+            return i + 4
+        if command == b'\x69\x7A':  # ESC i z: media and quality
+            self.media_width = data[i + 5] or self.media_width
+            return i + 13
+        if command == b'\x69\x4D':  # ESC i M: various mode, bit 6 = auto cut
+            self._autocut = bool(data[i + 3] & 0x40)
+            return i + 4
+        if command == b'\x69\x41':  # ESC i A: cut every n labels
+            self._cut_every = data[i + 3] or 1
+            return i + 4
+        if command == b'\x69\x4B':  # ESC i K: expanded mode, bit 3 = cut at end
+            self._cut_at_end = bool(data[i + 3] & 0x08)
+            return i + 4
+        if command == b'\x69\x64':  # ESC i d: margins
+            return i + 5
+        logger.warning(f"Emulator {self.identifier}: unknown command ESC {command.hex(' ')} at byte {i}")
+        return i + 2
+
+    def _print_page(self, last_page):
+        rows = self._rows
+        self._rows = []
+        if self._job_failed:
+            # The printer stops at an error - the rest of the job is discarded
+            return
+        width = max((len(row) for row in rows if row is not None), default=90) * 8
+        length_mm = len(rows) / DOTS_PER_MM
+
+        self._uncut_pages += 1
+        cut = (self._autocut and self._uncut_pages % self._cut_every == 0) or (last_page and self._cut_at_end)
+        if cut:
+            self._uncut_pages = 0
+
+        timing = self.timing
+        start = max(time.time(), self.busy_until)
+        if self.error_2 or (self.media_mm is not None and length_mm > self.media_mm):
+            # Out of tape: report the error and drop the rest of the job
+            self.errors += 1
+            self.error_2 |= ERROR_MEDIA_END
+            self._job_failed = True
+            self._reply(start, status_type=STATUS_ERROR, error_2=self.error_2)
+            return
+        if self.media_mm is not None:
+            self.media_mm -= length_mm
+
+        seconds = timing.page_seconds(length_mm, cut)
+        self.modelled_seconds += seconds
+        self.busy_until = start + seconds * timing.scale
+        if cut:
+            self.cuts += 1
+
+        image = self._decode(rows, width) if self.decode else None
+        page = Page(len(self.pages) + 1, len(rows), width, length_mm, cut, seconds, image)
+        self.pages.append(page)
+        if image is not None and self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            image.save(os.path.join(self.output_dir, f"page{page.number:05d}.png"))
+
+        self._reply(start, status_type=STATUS_PHASE_CHANGE, phase=PHASE_PRINTING)
+        self._reply(self.busy_until, status_type=STATUS_PRINTING_COMPLETED, phase=PHASE_PRINTING)
+        self._reply(self.busy_until, status_type=STATUS_PHASE_CHANGE, phase=PHASE_WAITING)
+
+    def _decode(self, rows, width):
+        """Rows back into the label image: un-mirrored, black dots = 0"""
+        blank = bytes(width // 8)
+        raw = b''.join((row or blank).ljust(width // 8, b'\x00') for row in rows)
+        if not raw:
+            return Image.new('1', (width, 0))
+        inverted = bytes(255 - byte for byte in raw)
+        image = Image.frombytes('1', (width, len(rows)), inverted)
+        return image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+
+
+class EmulatorBackend:
+    """
+    Backend connection to an emulated printer, compatible with brother_ql's
+    BrotherQLBackendGeneric (write, read, dispose)
+
+    Options can ride on the identifier, e.g.
+    emulator://ql700-2?scale=0&decode=1&media_mm=5000&feed_speed=100
+    """
+
+    def __init__(self, device_specifier):
+        if isinstance(device_specifier, EmulatedPrinter):
+            self.printer = device_specifier
+        else:
+            self.printer = get_printer(device_specifier)
+
+    def write(self, data):
+        self.printer.write(data)
+
+    def read(self, length=32):
+        return self.printer.read(length)
+
+    def dispose(self):
+        pass
+
+
+# Emulated printers by identifier
+_printers = {}
+_printers_lock = threading.Lock()
+
+
+def _options(identifier):
+    query = dict(parse_qsl(urlsplit(identifier).query))
+    timing = TimingModel(
+        feed_speed=float(query.get('feed_speed', FEED_SPEED)),
+        cut_time=float(query.get('cut_time', CUT_TIME)),
+        page_overhead=float(query.get('page_overhead', PAGE_OVERHEAD)),
+        scale=float(query.get('scale', os.environ.get('EMULATOR_TIME_SCALE', 1.0))),
+    )
+    media_mm = query.get('media_mm')
+    return {
+        'timing': timing,
+        'decode': query.get('decode', '0') not in ('0', 'false', ''),
+        'output_dir': query.get('output_dir'),
+        'media_mm': float(media_mm) if media_mm else None,
+    }
+
+
+def get_printer(identifier, **options):
+    """The emulated printer for an identifier, created on first use"""
+    with _printers_lock:
+        printer = _printers.get(identifier)
+        if printer is None:
+            settings = _options(identifier or '')
+            settings.update(options)
+            printer = _printers[identifier] = EmulatedPrinter(identifier, **settings)
+        return printer
+
+
+def add_printers(count, prefix='emulator://ql700-', **options):
+    """Create count emulated printers (all listed by discovery) and return their identifiers"""
+    identifiers = [f"{prefix}{n}" for n in range(1, count + 1)]
+    for identifier in identifiers:
+        get_printer(identifier, **options)
+    return identifiers
+
+
+def list_available_devices():
+    with _printers_lock:
+        return [{'identifier': identifier, 'instance': printer} for identifier, printer in _printers.items()]
+
+
+def reset():
+    """Forget every emulated printer"""
+    with _printers_lock:
+        _printers.clear()
+
+
+register_backend(BACKEND_NAME, EmulatorBackend, list_available_devices)
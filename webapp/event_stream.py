@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Event bus for pushing job progress and log lines to the web interface
+Every event gets a sequence number, so Server-Sent Events clients can resume
+with Last-Event-ID and polling clients can ask for what they missed
+"""
+
+from collections import deque
+import json
+import threading
+
+# Events kept for resuming clients
+EVENT_HISTORY = 1000
+
+# Seconds between SSE keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = 15
+
+
+class EventBus:
+    """Sequenced, bounded history of events with blocking waits for new ones"""
+
+    def __init__(self, history=EVENT_HISTORY):
+        self._events = deque(maxlen=history)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    @property
+    def last_seq(self):
+        with self._cond:
+            return self._seq
+
+    def publish(self, event_type, data):
+        """Append an event and wake up waiting streams, returning its sequence number"""
+        with self._cond:
+            self._seq += 1
+            self._events.append({'seq': self._seq, 'type': event_type, 'data': data})
+            self._cond.notify_all()
+            return self._seq
+
+    def since(self, seq):
+        """
+        Events after seq, oldest first
+
+        Returns:
+            (events, complete) - complete is False when events after seq have
+            already dropped out of the history, so the client should resync
+        """
+        with self._cond:
+            return self._since(seq)
+
+    def wait(self, seq, timeout=KEEPALIVE_INTERVAL):
+        """Like since(), but block up to timeout seconds until there is something new"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq, timeout)
+            return self._since(seq)
+
+    def _since(self, seq):
+        if seq >= self._seq:
+            return [], True
+        complete = not self._events or self._events[0]['seq'] <= seq + 1
+        return [event for event in self._events if event['seq'] > seq], complete
+
+
+def format_sse(event):
+    """Encode one event in text/event-stream format"""
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+def stream(bus, last_seq, keepalive=KEEPALIVE_INTERVAL):
+    """Generate SSE text for every event after last_seq, forever"""
+    # Tell EventSource to wait 2s before reconnecting
+    yield "retry: 2000\n\n"
+    while True:
+        events, complete = bus.wait(last_seq, keepalive)
+        if not complete:
+            yield format_sse({'seq': events[0]['seq'] - 1, 'type': 'reset', 'data': {}})
+        if not events:
+            yield ": keep-alive\n\n"
+            continue
+        for event in events:
+            yield format_sse(event)
+        last_seq = events[-1]['seq']
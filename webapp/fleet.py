@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Multi-printer fleet scheduler for Brother QL printers
+Shards one job's print units (e.g. batches) into contiguous runs across all
+healthy printers, sized by each printer's throughput measured on earlier
+runs, with failover
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    from .printer_session import DEFAULT_BACKEND, get_backend, send as session_send
+except ImportError:
+    from printer_session import DEFAULT_BACKEND, get_backend, send as session_send
+
+logger = logging.getLogger(__name__)
+
+# Labels per second each printer managed on its last run (override with LABEL_PRINTER_RATES)
+RATES_PATH = os.environ.get('LABEL_PRINTER_RATES',
+                            os.path.join(os.path.expanduser('~'), '.brother_ql', 'printer_rates.json'))
+
+
+def discover_fleet(backend_identifier=DEFAULT_BACKEND):
+    """
+    Identifiers of every attached printer, serial number included
+
+    Unlike print_utils.discover_printers() the serial is kept, so two
+    printers of the same model get distinct identifiers.
+    """
+    try:
+        devices = get_backend(backend_identifier)['list_available_devices']()
+    except Exception as e:
+        logger.error(f"Error discovering printers: {e}")
+        return []
+    identifiers = [device.get('identifier') for device in devices]
+    return sorted(set(identifier for identifier in identifiers if identifier))
+
+
+def load_rates(path=None):
+    """{printer: labels per second} measured on earlier runs (see save_rates), {} if there are none"""
+    try:
+        with open(path or RATES_PATH, 'r', encoding='utf-8') as f:
+            rates = json.load(f)
+        return {printer: float(rate) for printer, rate in rates.items() if float(rate) > 0}
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning(f"Ignoring printer rates in {path or RATES_PATH}: {e}")
+        return {}
+
+
+def save_rates(report, path=None):
+    """
+    Keep the throughput each printer measured in a FleetScheduler report
+
+    The next run passes them as weights, so each printer's share matches
+    its speed. Printers that printed nothing keep their earlier rate.
+    """
+    path = path or RATES_PATH
+    rates = load_rates(path)
+    rates.update({result['printer']: result['labels_per_second']
+                  for result in report['printers'] if result['units'] and result['labels_per_second'] > 0})
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(rates, f, indent=2, sort_keys=True)
+    except OSError as e:
+        logger.warning(f"Could not save printer rates to {path}: {e}")
+
+
+class _Shard:
+    """One printer's share of the job: units next..end-1, plus what it has printed"""
+
+    def __init__(self, printer, rate):
+        self.printer = printer
+        self.rate = rate  # Labels per second (estimate, then measured)
+        self.seconds = 0.0  # Spent rendering and printing units
+        self.next = 0
+        self.end = 0
+        self.healthy = True
+        self.busy = False  # A claimed unit is rendering or printing
+        self.labels = 0
+        self.units = 0
+        self.error = None
+        self.stacks = []  # [first_unit, last_unit] per contiguous run, in print order
+
+    @property
+    def remaining(self):
+        return self.end - self.next
+
+    def assign(self, start, end):
+        self.next, self.end = start, end
+        self.stacks.append([start, None])
+
+
+class FleetScheduler:
+    """
+    Print a list of units across several printers
+
+    Units are split up front into one contiguous range per printer, sized
+    by the weights, and each printer prints only its own range, so its
+    output is one contiguous, ordered stack. Ranges are never rebalanced
+    while printing: a printer that runs dry waits rather than taking units
+    from the middle of another's stack, so the weights should be the
+    printers' real speeds (the rates a report measured, see save_rates and
+    load_rates). A printer that fails (send error or an error status such
+    as end of tape) drops out and its unprinted range is picked up whole by
+    the others - the one case where a printer starts a second stack. Stacks
+    are reported per printer.
+
+    Args:
+        printers: Printer identifiers
+        render: Callable turning a unit into instruction bytes
+        pages: Callable giving the number of labels in a unit (default: 1)
+        send: Send function with printer_session.send's signature
+        backend_identifier: Backend passed to send (default: printer_session.DEFAULT_BACKEND)
+        weights: Optional {printer: labels per second}; printers without one get the average (default: all equal)
+        on_unit_sent: Called as on_unit_sent(unit_index, printer) once a unit is rendered, before it is sent
+        on_unit_done: Called as on_unit_done(unit_index, printer) after each unit prints
+        log: Called with progress messages
+    """
+
+    def __init__(self, printers, render, pages=None, send=None, backend_identifier=DEFAULT_BACKEND, weights=None,
+                 on_unit_sent=None, on_unit_done=None, log=None):
+        if not printers:
+            raise ValueError("No printers given")
+        weights = {printer: float(weights[printer]) for printer in printers if printer in (weights or {})}
+        default_weight = sum(weights.values()) / len(weights) if weights else 1.0
+        self.render = render
+        self.pages = pages or (lambda unit: 1)
+        self.send = send or session_send
+        self.backend_identifier = backend_identifier
+        self.on_unit_sent = on_unit_sent or (lambda unit_index, printer: None)
+        self.on_unit_done = on_unit_done or (lambda unit_index, printer: None)
+        self.log = log or logger.info
+        self.shards = [_Shard(printer, weights.get(printer, default_weight)) for printer in printers]
+        self._orphans = []  # Ranges released by failed printers, oldest first
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)  # A unit finished or a printer failed
+
+    def run(self, units):
+        """
+        Print all units and return a report
+
+        Returns:
+            Dict with elapsed seconds, labels printed, labels per second,
+            per-printer results (labels_per_second measured over the printer's
+            units, or its weight if it printed none) and unprinted unit ranges
+            (if every printer failed)
+        """
+        units = list(units)
+        self._split(len(units))
+        start = time.time()
+
+        threads = [threading.Thread(target=self._worker, args=(shard, units), daemon=True,
+                                    name=f"fleet-{shard.printer}") for shard in self.shards]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.time() - start
+        labels = sum(shard.labels for shard in self.shards)
+        unprinted = [(shard.next, shard.end) for shard in self.shards if shard.remaining > 0] + self._orphans
+        return {
+            'elapsed': elapsed,
+            'labels': labels,
+            'labels_per_second': labels / elapsed if elapsed > 0 else 0.0,
+            'printers': [{
+                'printer': shard.printer,
+                'healthy': shard.healthy,
+                'error': shard.error,
+                'units': shard.units,
+                'labels': shard.labels,
+                'labels_per_second': round(shard.rate, 3),
+                'stacks': [tuple(stack) for stack in shard.stacks if stack[1] is not None],
+            } for shard in self.shards],
+            'unprinted': sorted(unprinted),
+        }
+
+    def _split(self, count):
+        # Contiguous ranges proportional to each printer's throughput
+        total_rate = sum(shard.rate for shard in self.shards)
+        start = 0
+        cumulative = 0.0
+        for i, shard in enumerate(self.shards):
+            cumulative += shard.rate
+            end = count if i == len(self.shards) - 1 else round(count * cumulative / total_rate)
+            shard.assign(start, max(start, end))
+            start = shard.end
+
+    def _claim(self, shard):
+        """Next unit index for shard, taking over work when its range is done; None when finished"""
+        with self._changed:
+            shard.busy = False
+            self._changed.notify_all()
+            while True:
+                if not shard.healthy:
+                    return None
+                if shard.remaining > 0 or self._steal(shard):
+                    shard.next += 1
+                    shard.busy = True
+                    return shard.next - 1
+                # Idle printers stay until the others are done, in case one fails and leaves work behind
+                if not any(other.healthy and (other.busy or other.remaining > 0)
+                           for other in self.shards if other is not shard):
+                    return None
+                self._changed.wait()
+
+    def _steal(self, thief):
+        # Only a failed printer's range is taken over: splitting a running range would break up its stack
+        for i, (start, end) in enumerate(self._orphans):
+            if start == thief.end:
+                del self._orphans[i]
+                thief.end = end
+                self.log(f"{thief.printer} took over units {start + 1}-{end} from a failed printer")
+                return True
+
+        if self._orphans:
+            # Failover: no healthy printer continues this range, so it becomes a new stack
+            start, end = self._orphans.pop(0)
+            thief.assign(start, end)
+            self.log(f"{thief.printer} took over units {start + 1}-{end} from a failed printer (new stack)")
+            return True
+        return False
+
+    def _worker(self, shard, units):
+        while True:
+            unit_index = self._claim(shard)
+            if unit_index is None:
+                return
+
+            unit = units[unit_index]
+            pages = self.pages(unit)
+            started = time.time()
+            try:
+                instructions = self.render(*unit)
+                self.on_unit_sent(unit_index, shard.printer)
+                status = self.send(instructions=instructions, printer_identifier=shard.printer,
+                                   backend_identifier=self.backend_identifier, blocking=True, pages=pages)
+                if status and status.get('outcome') == 'error':
+                    errors = (status.get('printer_state') or {}).get('errors') or ['printer reported an error']
+                    raise RuntimeError(', '.join(errors))
+            except Exception as e:
+                self._fail(shard, unit_index, e)
+                return
+
+            with self._lock:
+                shard.seconds += time.time() - started
+                shard.labels += pages
+                shard.rate = shard.labels / max(shard.seconds, 1e-6)
+                shard.units += 1
+                shard.stacks[-1][1] = unit_index
+            self.on_unit_done(unit_index, shard.printer)
+
+    def _fail(self, shard, unit_index, error):
+        # The failed unit may be partly printed - it is reprinted in full elsewhere
+        with self._changed:
+            shard.healthy = False
+            shard.busy = False
+            shard.error = str(error)
+            self._orphans.append((unit_index, shard.end))
+            self._orphans.sort()
+            shard.next = shard.end = unit_index
+            self._changed.notify_all()
+        self.log(f"{shard.printer} failed on unit {unit_index + 1} ({error}); "
+                 f"moving units {unit_index + 1}+ to the other printers")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Font registry for Brother QL-700 label rendering
+Resolves the best available font once per process and caches loaded faces
+"""
+
+from functools import lru_cache
+from PIL import ImageFont
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fonts in order of preference as (path, index) - index selects the face inside .ttc files
+BOLD_FONT_OPTIONS = [
+    ('/System/Library/Fonts/Helvetica.ttc', 1),  # macOS Helvetica Bold
+    ('/System/Library/Fonts/Arial Black.ttf', 0),  # macOS Arial Black
+    ('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 0),  # Linux
+    ('/usr/share/fonts/TTF/DejaVuSans-Bold.ttf', 0),  # Arch Linux
+    ('C:\\Windows\\Fonts\\arialbd.ttf', 0),  # Windows
+    ('/System/Library/Fonts/Supplemental/Arial Bold.ttf', 0),  # macOS alternate
+    ('/System/Library/Fonts/Helvetica.ttc', 0),  # macOS Helvetica regular as fallback
+]
+
+REGULAR_FONT_OPTIONS = [
+    ('/System/Library/Fonts/Helvetica.ttc', 0),  # macOS
+    ('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 0),  # Linux
+    ('/usr/share/fonts/TTF/DejaVuSans.ttf', 0),  # Arch Linux
+    ('C:\\Windows\\Fonts\\arial.ttf', 0),  # Windows
+]
+
+# Number of (path, index, size) faces kept open
+FONT_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=None)
+def resolve_font(bold=True):
+    """Return (path, index) of the best installed font, or None if none is found"""
+    options = BOLD_FONT_OPTIONS if bold else REGULAR_FONT_OPTIONS
+    for path, index in options:
+        try:
+            load_font(path, index, 24)
+            return path, index
+        except (OSError, IOError):
+            continue
+
+    logger.warning("No system fonts found, using default font")
+    return None
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(path, index, size):
+    """Load a FreeType face, cached on (path, index, size)"""
+    return ImageFont.truetype(path, size, index=index)
+
+
+@lru_cache(maxsize=1)
+def default_font():
+    """Pillow's built-in bitmap font"""
+    return ImageFont.load_default()
+
+
+def get_font(size=24, bold=True):
+    """Get a cached face of the best available font at the given size"""
+    resolved = resolve_font(bold)
+    if resolved is None:
+        return default_font()
+
+    path, index = resolved
+    try:
+        return load_font(path, index, size)
+    except (OSError, IOError):
+        return default_font()
+
+
+def clear_cache():
+    """Drop resolved fonts and open faces (e.g. after installing new fonts)"""
+    resolve_font.cache_clear()
+    load_font.cache_clear()
+    default_font.cache_clear()
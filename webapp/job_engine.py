@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Background print job engine for the web interface
+Keeps a job table and a bounded priority queue per printer; a dedicated
+worker thread per printer renders and sends the labels
+"""
+
+from datetime import datetime
+import functools
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+try:
+    from . import csv_index, metrics, pipeline, print_utils, raster_cache, render_dedup
+    from .printer_session import DEFAULT_BACKEND, send
+except ImportError:
+    import csv_index
+    import metrics
+    import pipeline
+    import print_utils
+    import raster_cache
+    import render_dedup
+    from printer_session import DEFAULT_BACKEND, send
+
+logger = logging.getLogger(__name__)
+
+# Priority levels, lower runs first
+PRIORITIES = {'urgent': 0, 'high': 1, 'normal': 2, 'low': 3}
+
+# Queued jobs allowed per printer
+QUEUE_SIZE = 16
+
+# Finished jobs kept in the job table
+MAX_FINISHED_JOBS = 200
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """The printer's queue has no room for another job"""
+
+
+class PrintJob:
+    """One print run: a row range of a CSV file sent to one printer"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, path, columns, printer=None, start=1, end=None, batch_size=1, qr=True,
+                 priority='normal', label_type='62', mode='RGB'):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}', expected one of {', '.join(PRIORITIES)}")
+        self.id = next(self._ids)
+        self.path = path
+        self.columns = list(columns)
+        self.printer = printer or None
+        self.start = max(1, start or 1)
+        self.end = end
+        self.batch_size = max(1, batch_size or 1)
+        self.qr = qr
+        self.priority = priority
+        self.label_type = label_type
+        self.mode = mode
+        self.state = QUEUED
+        self.progress = 0
+        self.total = 0
+        self.error = None
+        self.dedup_hit_rate = None  # Share of labels reused from earlier in the job (see render_dedup)
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = threading.Event()
+
+    @property
+    def finished_state(self):
+        return self.state in FINISHED_STATES
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'path': self.path,
+            'columns': self.columns,
+            'printer': self.printer,
+            'priority': self.priority,
+            'state': self.state,
+            'running': self.state == RUNNING,
+            'progress': self.progress,
+            'total': self.total,
+            'error': self.error,
+            'dedup_hit_rate': self.dedup_hit_rate,
+            'created': _iso(self.created),
+            'start_time': _iso(self.started),
+            'finish_time': _iso(self.finished),
+        }
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds') if timestamp else None
+
+
+class _PrinterQueue:
+    """Bounded priority queue plus the worker thread for one printer"""
+
+    def __init__(self, printer):
+        self.printer = printer
+        self.heap = []
+        self.seq = itertools.count()
+        self.thread = None
+
+
+class JobEngine:
+    """
+    Job table and per-printer queues
+
+    submit() only validates and enqueues, so HTTP request threads never
+    wait for rendering or USB I/O. Cancellation is cooperative: a running
+    job stops before its next batch of labels. With a raster cache
+    directory, batches printed before are sent from the cache (hits show in
+    /metrics as raster_cache).
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE, render_workers=0, log=None, on_update=None, raster_cache_dir=None):
+        self.queue_size = queue_size
+        self.render_workers = render_workers
+        self.raster_cache_dir = raster_cache_dir
+        self.log = log or (lambda message, level='info', job_id=None: logger.info(message))
+        # Called with the job after every state change and progress tick
+        self.on_update = on_update or (lambda job: None)
+        self._jobs = {}
+        self._queues = {}
+        self._cond = threading.Condition()
+
+    def submit(self, job):
+        """
+        Queue a job on its printer
+
+        Raises:
+            QueueFull: If the printer already has queue_size jobs waiting
+        """
+        index = csv_index.get_index(job.path, errors='replace')
+        first = job.start - 1
+        last = min(job.end or len(index), len(index))
+        job.total = max(0, last - first)
+
+        with self._cond:
+            queue = self._queues.get(job.printer)
+            if queue is None:
+                queue = self._queues[job.printer] = _PrinterQueue(job.printer)
+            if len(queue.heap) >= self.queue_size:
+                raise QueueFull(f"Queue for {job.printer or 'default printer'} is full ({self.queue_size} jobs)")
+            heapq.heappush(queue.heap, (PRIORITIES[job.priority], next(queue.seq), job))
+            self._jobs[job.id] = job
+            self._prune()
+            if queue.thread is None:
+                queue.thread = threading.Thread(target=self._worker, args=(queue,), daemon=True,
+                                                name=f"print-{job.printer or 'default'}")
+                queue.thread.start()
+            self._cond.notify_all()
+
+        self.on_update(job)
+        self.log(f"Job {job.id} queued: {job.total} labels ({job.priority} priority)", job_id=job.id)
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued job right away, or a running one before its next batch"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished_state:
+                return job
+            job.cancel_requested.set()
+            if job.state == QUEUED:
+                queue = self._queues[job.printer]
+                queue.heap = [entry for entry in queue.heap if entry[2] is not job]
+                heapq.heapify(queue.heap)
+                self._finish(job, CANCELLED)
+        self.log(f"Job {job_id} cancellation requested", 'warning', job_id=job_id)
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """All jobs in the table, newest first"""
+        with self._cond:
+            return sorted(self._jobs.values(), key=lambda job: job.id, reverse=True)
+
+    def queue_positions(self):
+        """{job id: position} for queued jobs, 1 = next to run on its printer"""
+        with self._cond:
+            positions = {}
+            for queue in self._queues.values():
+                for position, (_, _, job) in enumerate(sorted(queue.heap), 1):
+                    positions[job.id] = position
+            return positions
+
+    def queue_depth(self):
+        """Jobs waiting across all printers"""
+        with self._cond:
+            return sum(len(queue.heap) for queue in self._queues.values())
+
+    def running(self):
+        with self._cond:
+            return sum(1 for job in self._jobs.values() if job.state == RUNNING)
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.finished_state]
+        for job in sorted(finished, key=lambda job: job.id)[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+    def _finish(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        job.finished = time.time()
+        metrics.count('jobs', state=state)
+        self.on_update(job)
+
+    def _worker(self, queue):
+        while True:
+            with self._cond:
+                while not queue.heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(queue.heap)
+                job.state = RUNNING
+                job.started = time.time()
+
+            self.on_update(job)
+            try:
+                self._run(job)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                # Counted once, as jobs{state="failed"} - a send error behind it was counted where it happened
+                with self._cond:
+                    self._finish(job, FAILED, str(e))
+                self.log(f"Job {job.id} failed: {e}", 'error', job_id=job.id)
+
+    def _run(self, job):
+        printer = job.printer
+        if not printer:
+            printers = print_utils.discover_printers()
+            if not printers:
+                raise Exception("No printers found")
+            printer = printers[0]['identifier']
+
+        index = csv_index.get_index(job.path, errors='replace')
+        first = job.start - 1
+        rows = index.rows(first, first + job.total)
+        texts = [text for text in (print_utils.label_text(row, job.columns) for row in rows) if text]
+        job.total = len(texts)
+        self.on_update(job)
+        self.log(f"Job {job.id} started on {printer}: {job.total} labels", job_id=job.id)
+
+        # Repeated labels are rendered once per job (per worker process when rendering in parallel)
+        token = render_dedup.new_job()
+        render = functools.partial(print_utils.build_label_instructions, label_type=job.label_type,
+                                   include_qr=job.qr, mode=job.mode, dedup=token)
+        if self.raster_cache_dir:
+            render = raster_cache.CachedRender(render, self.raster_cache_dir)
+        jobs = ((texts[i:i + job.batch_size],) for i in range(0, len(texts), job.batch_size))
+
+        try:
+            with pipeline.RenderPipeline(render, workers=self.render_workers) as engine:
+                for (batch,), instructions, error in engine.results(jobs):
+                    # Cooperative cancellation between batches
+                    if job.cancel_requested.is_set():
+                        with self._cond:
+                            self._finish(job, CANCELLED)
+                        self.log(f"Job {job.id} cancelled after {job.progress}/{job.total} labels", 'warning',
+                                 job_id=job.id)
+                        return
+                    if error is not None:
+                        raise error
+                    status = send(instructions=instructions, printer_identifier=printer,
+                                  backend_identifier=DEFAULT_BACKEND, blocking=True, pages=len(batch))
+                    if status and status.get('outcome') == 'error':
+                        # E.g. end of media: the job fails with the printer's own error text
+                        raise Exception(', '.join(status['printer_state']['errors']))
+                    job.progress += len(batch)
+                    self.on_update(job)
+        finally:
+            # Worker processes keep their own caches; only inline rendering is counted here
+            dedup = render_dedup.release(token)
+            if dedup is not None and dedup.lookups:
+                job.dedup_hit_rate = round(dedup.hit_rate, 3)
+
+        with self._cond:
+            self._finish(job, COMPLETED)
+        reused = f", {dedup.summary()}" if dedup is not None and dedup.lookups else ''
+        self.log(f"Job {job.id} completed: {job.progress} labels printed{reused}", job_id=job.id)
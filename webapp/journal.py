@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Durable print job journal for Brother QL printers
+SQLite (WAL mode) record of every label's state, keyed by the CSV's content
+hash and print settings, so an interrupted run resumes at the first label
+that wasn't confirmed and failed labels can be reprinted on their own
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Default journal location (override with LABEL_JOURNAL or the CLIs' --journal)
+DEFAULT_PATH = os.environ.get('LABEL_JOURNAL',
+                              os.path.join(os.path.expanduser('~'), '.brother_ql', 'journal.sqlite3'))
+
+# Buffered state changes are committed at least this often (seconds) ...
+FLUSH_INTERVAL = 1.0
+# ... or once this many are waiting
+FLUSH_EVERY = 500
+
+# Label states, in pipeline order. Labels without a row are queued.
+QUEUED = 'queued'
+RENDERED = 'rendered'
+SENT = 'sent'
+CONFIRMED = 'confirmed'
+FAILED = 'failed'
+STATES = (QUEUED, RENDERED, SENT, CONFIRMED, FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    file_hash TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    csv_path TEXT,
+    total INTEGER NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    finished REAL,
+    UNIQUE (file_hash, settings)
+);
+CREATE TABLE IF NOT EXISTS labels (
+    job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    label INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (job_id, label)
+) WITHOUT ROWID;
+"""
+
+
+class Journal:
+    """
+    Per-label print state in a SQLite database
+
+    mark() only buffers the change; buffered changes are written in one
+    transaction every FLUSH_INTERVAL seconds or FLUSH_EVERY changes, and on
+    flush() / close(). A crash loses at most that window, and those labels
+    are simply printed again on resume - labels are never skipped.
+    Safe to share between threads.
+
+    Args:
+        path: Database file (default: DEFAULT_PATH)
+        flush_interval: Maximum seconds a state change stays buffered
+        flush_every: Maximum number of buffered state changes
+    """
+
+    def __init__(self, path=None, flush_interval=FLUSH_INTERVAL, flush_every=FLUSH_EVERY):
+        self.path = path or DEFAULT_PATH
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # WAL with synchronous=NORMAL: commits don't fsync, a power cut loses at most the last ones
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA foreign_keys=ON')
+        self._db.executescript(_SCHEMA)
+        self._pending = {}  # (job_id, label) -> (state, error, time)
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def open_job(self, file_hash, total, settings=None, csv_path=None):
+        """
+        Job id for a file and its print settings, created on first use
+
+        Label numbers are only comparable between runs with the same
+        settings (e.g. products per label), so they are part of the key.
+        """
+        settings = json.dumps(settings or {}, sort_keys=True)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT id FROM jobs WHERE file_hash = ? AND settings = ?',
+                                   (file_hash, settings)).fetchone()
+            if row is not None:
+                self._db.execute('UPDATE jobs SET total = ?, csv_path = ?, updated = ? WHERE id = ?',
+                                 (total, csv_path, now, row[0]))
+                return row[0]
+            cursor = self._db.execute(
+                'INSERT INTO jobs (file_hash, settings, csv_path, total, created, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                (file_hash, settings, csv_path, total, now, now))
+            return cursor.lastrowid
+
+    def mark(self, job_id, labels, state, error=None):
+        """Buffer a state change for labels (an int or an iterable of ints)"""
+        if state not in STATES:
+            raise ValueError(f"Unknown label state '{state}'")
+        if isinstance(labels, int):
+            labels = (labels,)
+        now = time.time()
+        with self._lock:
+            for label in labels:
+                self._pending[(job_id, label)] = (state, error, now)
+            if len(self._pending) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        """Commit buffered state changes in one transaction"""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            rows = [(job_id, label, state, error, updated)
+                    for (job_id, label), (state, error, updated) in self._pending.items()]
+            self._pending.clear()
+            try:
+                self._db.execute('BEGIN')
+                self._db.executemany('INSERT OR REPLACE INTO labels (job_id, label, state, error, updated) '
+                                     'VALUES (?, ?, ?, ?, ?)', rows)
+                job_ids = sorted({row[0] for row in rows})
+                self._db.execute(f"UPDATE jobs SET updated = ? WHERE id IN ({','.join('?' * len(job_ids))})",
+                                 (time.time(), *job_ids))
+                self._db.execute('COMMIT')
+            except sqlite3.Error as e:
+                self._db.execute('ROLLBACK')
+                logger.error(f"Could not write print journal {self.path}: {e}")
+                raise
+
+    def states(self, job_id):
+        """{label: state} for every label that has left the queue"""
+        with self._lock:
+            self.flush()
+            return dict(self._db.execute('SELECT label, state FROM labels WHERE job_id = ?', (job_id,)))
+
+    def remaining(self, job_id):
+        """Labels still to print, in order: everything not confirmed"""
+        with self._lock:
+            total = self._total(job_id)
+            confirmed = {label for label, state in self.states(job_id).items() if state == CONFIRMED}
+        return [label for label in range(total) if label not in confirmed]
+
+    def failed(self, job_id):
+        """[(label, error)] for labels that failed, in order"""
+        with self._lock:
+            self.flush()
+            return self._db.execute('SELECT label, error FROM labels WHERE job_id = ? AND state = ? ORDER BY label',
+                                    (job_id, FAILED)).fetchall()
+
+    def summary(self, job_id):
+        """Label count per state, plus total, creation and last update times"""
+        with self._lock:
+            self.flush()
+            counts = dict(self._db.execute('SELECT state, COUNT(*) FROM labels WHERE job_id = ? GROUP BY state',
+                                           (job_id,)))
+            total, created, updated, finished = self._db.execute(
+                'SELECT total, created, updated, finished FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        counts[QUEUED] = total - sum(counts.values())
+        return {'job_id': job_id, 'total': total, 'states': {state: counts.get(state, 0) for state in STATES},
+                'created': created, 'updated': updated, 'finished': finished}
+
+    def reset(self, job_id):
+        """Forget every label's state, so the whole job prints again"""
+        with self._lock:
+            self._pending = {key: value for key, value in self._pending.items() if key[0] != job_id}
+            self._db.execute('DELETE FROM labels WHERE job_id = ?', (job_id,))
+            self._db.execute('UPDATE jobs SET finished = NULL, updated = ? WHERE id = ?', (time.time(), job_id))
+
+    def finish(self, job_id):
+        """Flush and record the job as complete"""
+        with self._lock:
+            self.flush()
+            self._db.execute('UPDATE jobs SET finished = ? WHERE id = ?', (time.time(), job_id))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self.flush()
+                self._db.close()
+                self._db = None
+
+    def _total(self, job_id):
+        row = self._db.execute('SELECT total FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No journal job {job_id}")
+        return row[0]
+
+
+def runs(labels):
+    """Split sorted label numbers into (first, last) runs of consecutive labels"""
+    result = []
+    for label in labels:
+        if result and label == result[-1][1] + 1:
+            result[-1][1] = label
+        else:
+            result.append([label, label])
+    return [tuple(run) for run in result]
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Declarative label templates for Brother QL labels
+A template (a dict, or a JSON file) lists text boxes, QR boxes, lines and
+logos, with dynamic elements mapped to CSV columns. compile_template() turns
+it into a RenderPlan once: everything static is rasterized into a base layer,
+so rendering a label is one copy plus the dynamic fields.
+
+Example:
+    {
+        "size": [696, 271],
+        "elements": [
+            {"type": "qr", "field": "SKU", "box": [530, 57, 156, 156], "border": 2},
+            {"type": "text", "field": ["Product Name", "Price"], "box": [10, 10, 500, 251],
+             "sizes": [48, 40, 32, 24], "leading": 4},
+            {"type": "line", "from": [520, 10], "to": [520, 261], "color": "lightgray"},
+            {"type": "image", "path": "logo.png", "box": [10, 10, 80, 40]}
+        ]
+    }
+
+A "grid" entry ({"columns": 4, "rows": 1, "gap": 2, "separator": {...}})
+repeats the elements in every cell; the elements then use cell coordinates
+and render() takes one value per cell.
+"""
+
+import json
+import os
+from PIL import Image, ImageDraw
+
+try:
+    from . import qr_utils, raster_utils, text_layout
+except ImportError:
+    import qr_utils
+    import raster_utils
+    import text_layout
+
+# Field used when an element doesn't name one (plain-text rendering, e.g. render("Coffee"))
+DEFAULT_FIELD = 'text'
+# Joins the values of an element mapped to several columns
+FIELD_SEPARATOR = ' - '
+
+ELEMENT_TYPES = ('text', 'qr', 'line', 'image')
+
+
+def load_template(path):
+    """Read a template from a JSON file (image paths are relative to the file)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        template = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for element in template.get('elements', ()):
+        if element.get('type') == 'image' and 'path' in element:
+            element['path'] = os.path.join(base, element['path'])
+    return template
+
+
+def template_files(path):
+    """Files a template file reads: itself and its images"""
+    template = load_template(path)
+    return [os.path.abspath(path)] + [element['path'] for element in template.get('elements', ())
+                                      if element.get('type') == 'image' and 'path' in element]
+
+
+def field_value(values, field, separator=FIELD_SEPARATOR):
+    """
+    Text for a field from a row dict (or a plain string, which fills the default field)
+
+    field may be a column name or a list of columns, joined like the web
+    app's label text (empty values skipped).
+    """
+    if isinstance(values, str):
+        values = {DEFAULT_FIELD: values}
+    if isinstance(field, (list, tuple)):
+        parts = [str(values.get(name) or '').strip() for name in field]
+        return separator.join(filter(None, parts))
+    value = values.get(field)
+    return '' if value is None else str(value)
+
+
+class _Text:
+    """Fitted text in a box, horizontal or turned 90° counter-clockwise (reads bottom to top)"""
+
+    def __init__(self, element):
+        self.field = element.get('field', DEFAULT_FIELD)
+        self.separator = element.get('separator', FIELD_SEPARATOR)
+        self.x, self.y, self.width, self.height = _box(element)
+        self.rotate = element.get('rotate', 0)
+        if self.rotate not in (0, 90):
+            raise ValueError(f"Text rotate must be 0 or 90, got {self.rotate}")
+        self.padding = element.get('padding', 0)
+        # Fit limits are in the text's own direction: line length and stacked height
+        along, across = (self.height, self.width) if self.rotate else (self.width, self.height)
+        self.max_width = element.get('max_width', along - 2 * self.padding)
+        self.max_height = element.get('max_height', across - 2 * self.padding)
+        self.sizes = tuple(element.get('sizes', (24,)))
+        self.max_lines = element.get('max_lines')
+        self.clip_lines = element.get('clip_lines', self.max_lines)
+        self.leading = element.get('leading', 0)
+        self.metric = element.get('metric', 'size')
+        self.bold = element.get('bold', True)
+        self.color = element.get('color', 'black')
+        self.static = 'text' in element
+        self.text = element.get('text')
+
+    def draw(self, label, draw, origin, values, mode):
+        text = self.text if self.static else field_value(values, self.field, self.separator)
+        if not text:
+            return
+        layout = text_layout.fit_text(text, self.max_width, self.sizes, max_lines=self.max_lines,
+                                      max_height=self.max_height, leading=self.leading, metric=self.metric,
+                                      bold=self.bold)
+        lines = layout.lines[:self.clip_lines] if self.clip_lines else layout.lines
+        if not lines:
+            return
+        fill = raster_utils.ink(self.color, mode)
+        block_height = len(lines) * layout.line_height + 2 * self.padding
+        x, y = origin[0] + self.x, origin[1] + self.y
+
+        if not self.rotate:
+            # Vertically centered in the box, drawn straight onto the label
+            top = y + (self.height - block_height) // 2 + self.padding
+            for i, line in enumerate(lines):
+                text_layout.draw_line(draw, (x + self.padding, top + i * layout.line_height), line, layout.font, fill)
+            return
+
+        # Lay the lines out horizontally, then turn the block with a lossless transpose
+        block_width = max(int(text_layout.text_width(layout.font, line)) + 1 for line in lines) + 2 * self.padding
+        block = raster_utils.new_canvas((block_width, block_height), mode)
+        block_draw = ImageDraw.Draw(block)
+        for i, line in enumerate(lines):
+            text_layout.draw_line(block_draw, (self.padding, self.padding + i * layout.line_height), line,
+                                  layout.font, fill)
+        block = block.transpose(Image.Transpose.ROTATE_90)
+
+        # Centered along the box, clipped to it
+        top = (self.height - block.height) // 2
+        left, upper = 0, max(0, -top)
+        right = min(block.width, self.width)
+        lower = min(block.height, self.height - top)
+        if upper or right < block.width or lower < block.height:
+            block = block.crop((left, upper, right, lower))
+        label.paste(block, (x, y + top + upper))
+
+
+class _QR:
+    """QR code of a field, scaled by whole modules into a square box"""
+
+    def __init__(self, element):
+        self.field = element.get('field', DEFAULT_FIELD)
+        self.separator = element.get('separator', FIELD_SEPARATOR)
+        self.x, self.y, width, height = _box(element)
+        self.size = min(width, height)
+        self.border = element.get('border', 1)
+        self.static = 'data' in element
+        self.data = element.get('data')
+
+    def draw(self, label, draw, origin, values, mode):
+        data = self.data if self.static else field_value(values, self.field, self.separator)
+        qr_utils.paste_qr(label, data, (origin[0] + self.x, origin[1] + self.y), size=self.size, border=self.border)
+
+
+class _Line:
+    static = True
+
+    def __init__(self, element):
+        self.start = tuple(element['from'])
+        self.end = tuple(element['to'])
+        self.color = element.get('color', 'black')
+        self.width = element.get('width', 1)
+
+    def draw(self, label, draw, origin, values, mode):
+        ox, oy = origin
+        draw.line([(ox + self.start[0], oy + self.start[1]), (ox + self.end[0], oy + self.end[1])],
+                  fill=raster_utils.ink(self.color, mode), width=self.width)
+
+
+class _Logo:
+    """Image file fitted into a box (keeping its aspect ratio), binarized like the printer would for '1'"""
+    static = True
+
+    def __init__(self, element):
+        self.x, self.y, self.width, self.height = _box(element)
+        with Image.open(element['path']) as source:
+            source.load()
+            if source.mode in ('RGBA', 'LA', 'P'):
+                # Transparent areas print as paper
+                background = Image.new('RGB', source.size, 'white')
+                background.paste(source, mask=source.convert('RGBA').getchannel('A'))
+                source = background
+            source.thumbnail((self.width, self.height), Image.Resampling.LANCZOS)
+            self.image = source.copy()
+
+    def draw(self, label, draw, origin, values, mode):
+        image = raster_utils.binarize(self.image) if mode == '1' else self.image.convert(mode)
+        x = origin[0] + self.x + (self.width - image.width) // 2
+        y = origin[1] + self.y + (self.height - image.height) // 2
+        label.paste(image, (x, y))
+
+
+_ELEMENTS = {'text': _Text, 'qr': _QR, 'line': _Line, 'image': _Logo}
+
+
+def _box(element):
+    try:
+        x, y, width, height = element['box']
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"{element.get('type')} element needs a box [x, y, width, height]")
+    return x, y, width, height
+
+
+class RenderPlan:
+    """
+    A compiled template: the static layer plus the dynamic elements per cell
+
+    Plans hold no per-label state, so one plan can render from several
+    threads (each render works on its own copy of the static layer).
+    """
+
+    def __init__(self, size, mode, cells, static, dynamic, background):
+        self.size = size
+        self.mode = mode
+        self.cells = cells  # Top-left corner of each cell, row by row
+        self.static = static
+        self.dynamic = dynamic
+        self.background = background
+
+    @property
+    def fields(self):
+        """CSV columns the dynamic elements read"""
+        names = set()
+        for element in self.dynamic:
+            field = element.field
+            names.update(field if isinstance(field, (list, tuple)) else [field])
+        return names
+
+    def render(self, values):
+        """
+        Render one label
+
+        Args:
+            values: Row dict or plain string - or, for grid templates, a list
+                    of them filled into the cells row by row (empty cells stay blank)
+
+        Returns:
+            PIL Image in the plan's mode
+        """
+        label = self.background.copy()
+        draw = ImageDraw.Draw(label)
+        if len(self.cells) == 1 and not isinstance(values, (list, tuple)):
+            values = [values]
+        for origin, cell_values in zip(self.cells, values):
+            for element in self.dynamic:
+                element.draw(label, draw, origin, cell_values, self.mode)
+        return label
+
+
+def compile_template(template, mode='RGB'):
+    """
+    Compile a template into a RenderPlan for one canvas mode
+
+    Static elements (lines, logos, text with a literal "text", QR codes with
+    literal "data", grid separators) are drawn once into the background here.
+
+    Raises:
+        ValueError: The template is malformed
+    """
+    try:
+        width, height = template['size']
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Template needs a size [width, height]")
+
+    grid = template.get('grid') or {}
+    columns = grid.get('columns', 1)
+    rows = grid.get('rows', 1)
+    gap = grid.get('gap', 0)
+    if columns < 1 or rows < 1:
+        raise ValueError("Grid needs at least one column and one row")
+    cell_width = (width - (columns - 1) * gap) // columns
+    cell_height = (height - (rows - 1) * gap) // rows
+    cells = [(column * (cell_width + gap), row * (cell_height + gap))
+             for row in range(rows) for column in range(columns)]
+
+    elements = []
+    for element in template.get('elements', ()):
+        kind = element.get('type')
+        if kind not in _ELEMENTS:
+            raise ValueError(f"Unknown template element type '{kind}', expected one of {', '.join(ELEMENT_TYPES)}")
+        elements.append(_ELEMENTS[kind](element))
+    static = [element for element in elements if element.static]
+    dynamic = [element for element in elements if not element.static]
+
+    background = raster_utils.new_canvas((width, height), mode)
+    draw = ImageDraw.Draw(background)
+    separator = grid.get('separator')
+    if separator:
+        fill = raster_utils.ink(separator.get('color', 'lightgray'), mode)
+        line_width = separator.get('width', 1)
+        for column in range(1, columns):
+            line_x = column * (cell_width + gap) - gap + gap // 2
+            draw.line([(line_x, 0), (line_x, height)], fill=fill, width=line_width)
+        for row in range(1, rows):
+            line_y = row * (cell_height + gap) - gap + gap // 2
+            draw.line([(0, line_y), (width, line_y)], fill=fill, width=line_width)
+    for origin in cells:
+        for element in static:
+            element.draw(background, draw, origin, None, mode)
+
+    return RenderPlan((width, height), mode, cells, static, dynamic, background)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Fixed-capacity ring buffer of structured log records
+Appends are O(1) with a minimal critical section; readers page through it
+with a sequence number cursor
+"""
+
+from collections import namedtuple
+from datetime import datetime
+import itertools
+import threading
+import time
+
+# Records kept by default (configurable with LOG_CAPACITY in the web app)
+LOG_CAPACITY = 5000
+
+LogRecord = namedtuple('LogRecord', ['seq', 'time', 'monotonic', 'level', 'job_id', 'message'])
+
+
+class LogBuffer:
+    """
+    Ring buffer of LogRecords numbered from 1
+
+    append() claims a sequence number from an itertools counter and writes
+    one list slot - both atomic under the GIL. The lock only guards moving
+    the read cursor forward, so logging from print worker threads never
+    formats, copies or shifts anything while holding it.
+    """
+
+    def __init__(self, capacity=LOG_CAPACITY):
+        self.capacity = max(1, capacity)
+        self._slots = [None] * self.capacity
+        self._counter = itertools.count(1)
+        self._last = 0
+        self._lock = threading.Lock()
+
+    @property
+    def last_seq(self):
+        return self._last
+
+    def append(self, message, level='info', job_id=None):
+        """Store a record and return it"""
+        seq = next(self._counter)
+        record = LogRecord(seq, time.time(), time.monotonic(), level, job_id, message)
+        self._slots[seq % self.capacity] = record
+        # Concurrent appends may finish out of order; the cursor only moves forward
+        with self._lock:
+            if seq > self._last:
+                self._last = seq
+        return record
+
+    def since(self, seq=0, limit=None, job_id=None):
+        """
+        Records newer than seq, oldest first
+
+        Args:
+            seq: Cursor - the last sequence number the reader has seen
+            limit: Maximum number of records to return
+            job_id: Only records logged for this job
+
+        Returns:
+            (records, cursor, complete) - cursor is the seq to pass next time;
+            complete is False if records after seq were already overwritten
+        """
+        last = self._last
+        first = max(seq + 1, last - self.capacity + 1, 1)
+        complete = first == seq + 1
+        cursor = max(seq, first - 1)
+        records = []
+        for n in range(first, last + 1):
+            record = self._slots[n % self.capacity]
+            # A number is claimed before its slot is written: stop there, so the next read picks it up
+            if record is None or record.seq < n:
+                break
+            cursor = n
+            # Overwritten since we started reading
+            if record.seq != n:
+                complete = False
+                continue
+            if job_id is not None and record.job_id != job_id:
+                continue
+            records.append(record)
+            if limit is not None and len(records) >= limit:
+                break
+        return records, cursor, complete
+
+    def tail(self, count):
+        """The last count records, oldest first"""
+        return self.since(max(0, self._last - count))[0]
+
+    def clear(self):
+        self._slots = [None] * self.capacity
+
+
+def format_record(record):
+    """Classic one-line rendering: [HH:MM:SS] message"""
+    return f"[{datetime.fromtimestamp(record.time).strftime('%H:%M:%S')}] {record.message}"
+
+
+def record_json(record):
+    """JSON-friendly dict for a record, with the formatted line as 'line'"""
+    return dict(record._asdict(), line=format_record(record))
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Hot-path instrumentation for the print pipeline
+Stage timers, counters and gauges with Prometheus text exposition for
+/metrics and a plain-text profile for the CLIs' --profile flag. While
+disabled, a timed stage costs one flag check.
+"""
+
+from bisect import bisect_left
+import functools
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds (covers cached lookups up to slow prints)
+STAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Prefix for exported metric names
+NAMESPACE = 'labelprinter'
+
+# Flipped by enable(); checked on every timed call
+_enabled = False
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile q"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return 0.0
+
+
+class Registry:
+    """Stage histograms, labelled counters and scrape-time gauges"""
+
+    def __init__(self):
+        self._stages = {}
+        self._counters = {}
+        self._gauges = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, callback, help_text=''):
+        """Report callback() as a gauge at every scrape, e.g. the current queue depth"""
+        with self._lock:
+            self._gauges[name] = callback
+            self._help[name] = help_text
+
+    def describe(self, name, help_text):
+        with self._lock:
+            self._help[name] = help_text
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def stages(self):
+        """{stage: (count, total seconds, p50, p99)} snapshot"""
+        with self._lock:
+            return {stage: (h.count, h.sum, h.quantile(0.5), h.quantile(0.99)) for stage, h in self._stages.items()}
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            stages = {stage: (list(h.counts), h.sum, h.count, h.buckets) for stage, h in self._stages.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            help_texts = dict(self._help)
+
+        lines = []
+        name = f"{NAMESPACE}_stage_seconds"
+        lines.append(f"# HELP {name} Time spent in each print pipeline stage")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, (counts, total, count, buckets) in sorted(stages.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+        for counter in sorted(set(key[0] for key in counters)):
+            full_name = f"{NAMESPACE}_{counter}_total"
+            if counter in help_texts:
+                lines.append(f"# HELP {full_name} {help_texts[counter]}")
+            lines.append(f"# TYPE {full_name} counter")
+            for (key_name, labels), value in sorted(counters.items()):
+                if key_name == counter:
+                    lines.append(f"{full_name}{_labels(labels)} {value}")
+
+        for gauge, callback in sorted(gauges.items()):
+            full_name = f"{NAMESPACE}_{gauge}"
+            try:
+                value = callback()
+            except Exception:
+                continue
+            if help_texts.get(gauge):
+                lines.append(f"# HELP {full_name} {help_texts[gauge]}")
+            lines.append(f"# TYPE {full_name} gauge")
+            lines.append(f"{full_name} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+# Process-wide registry used by the print paths
+registry = Registry()
+registry.describe('labels_printed', 'Labels the printer confirmed')
+registry.describe('bytes_sent', 'Instruction bytes written to printers')
+registry.describe('errors', 'Errors by type')
+registry.describe('render_dedup', 'Label renders reused within a job (hit) or rendered (miss)')
+registry.describe('raster_cache', 'Print jobs sent from the disk raster cache (hit) or rendered (miss)')
+registry.describe('raster_cache_evictions', 'Entries evicted from the disk raster cache')
+
+
+class _Timer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_timer = _NoTimer()
+
+
+def timer(stage):
+    """Context manager timing a block as stage (a shared no-op while disabled)"""
+    return _Timer(stage) if _enabled else _no_timer
+
+
+def timed(stage):
+    """Decorator timing every call of a function as stage"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                registry.observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1, **labels):
+    """Add to a counter (no-op while disabled)"""
+    if _enabled:
+        registry.count(name, value, **labels)
+
+
+def error(kind):
+    """Count an error by type - an exception or a short description"""
+    if _enabled:
+        registry.count('errors', 1, type=kind if isinstance(kind, str) else type(kind).__name__)
+
+
+def profile_report():
+    """Per-stage table for --profile, slowest total first"""
+    stages = registry.stages()
+    if not stages:
+        return "No stages were timed"
+    lines = [f"{'stage':<14} {'calls':>8} {'total s':>9} {'mean ms':>9} {'p50 ms':>8} {'p99 ms':>8}"]
+    for stage, (calls, total, p50, p99) in sorted(stages.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{stage:<14} {calls:>8} {total:>9.3f} {total / calls * 1000:>9.2f} {p50 * 1000:>8.1f} "
+                     f"{p99 * 1000:>8.1f}")
+    # Stages nest (render includes text_fit and qr), so totals don't add up to the run time
+    lines.append("p50/p99 are histogram bucket upper bounds")
+    for (name, labels), value in sorted(registry.counters().items()):
+        label_text = ', '.join(f"{key}={value}" for key, value in labels)
+        lines.append(f"{name}{f' ({label_text})' if label_text else ''}: {value}")
+    return '\n'.join(lines)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Pipelined render/print engine for Brother QL-700 labels
+A pool of worker processes renders and rasterizes print jobs ahead of time
+into a bounded queue while a single writer sends them to the printer in order
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import threading
+
+# Jobs rendered ahead per worker process
+QUEUE_PER_WORKER = 2
+
+
+def default_workers():
+    """Worker processes to use when none are given: leave one core for the writer"""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+class RenderPipeline:
+    """
+    Render jobs in parallel, hand them back strictly in submission order
+
+    render must be a picklable top-level callable (or functools.partial of
+    one) returning the instruction bytes for a job. Each job is a tuple of
+    positional arguments for render. With workers=0 jobs are rendered inline,
+    one at a time, by the caller. If a worker process dies, the jobs in
+    flight fail with BrokenProcessPool and later jobs go to a fresh pool.
+
+    Usage:
+        with RenderPipeline(render, workers=4) as engine:
+            for job, instructions, error in engine.results(jobs):
+                send(instructions, ...)
+    """
+
+    def __init__(self, render, workers=0, queue_size=None):
+        self.render = render
+        self.workers = max(0, workers or 0)
+        self.queue_size = queue_size or max(2, self.workers * QUEUE_PER_WORKER)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Stop the workers, dropping anything rendered ahead but not yet consumed"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def results(self, jobs):
+        """
+        Yield (job, instructions, error) for each job, in order
+
+        error is the exception raised while rendering that job (instructions
+        is then None). Up to queue_size jobs are in flight at any time, and
+        the queue is topped up before each result is handed over so workers
+        keep rendering while the caller is busy printing.
+        """
+        if self.workers == 0:
+            for job in jobs:
+                try:
+                    yield job, self.render(*job), None
+                except Exception as e:
+                    yield job, None, e
+            return
+
+        jobs = iter(jobs)
+        pending = deque()
+
+        def submit_next():
+            for job in jobs:
+                pending.append((job, *self._submit(job)))
+                return True
+            return False
+
+        while len(pending) < self.queue_size and submit_next():
+            pass
+
+        while pending:
+            job, executor, future = pending.popleft()
+            submit_next()
+            try:
+                yield job, future.result(), None
+            except BrokenProcessPool as e:
+                self._discard(executor)
+                yield job, None, e
+            except Exception as e:
+                yield job, None, e
+
+    def completed(self, jobs):
+        """
+        Yield (job, result, error) as soon as each job finishes, in any order
+
+        For output that doesn't need ordering (e.g. preview files): a slow
+        job never holds back the ones behind it. In-flight jobs are bounded
+        by queue_size as in results().
+        """
+        if self.workers == 0:
+            yield from self.results(jobs)
+            return
+
+        jobs = iter(jobs)
+        pending = {}
+
+        def submit_next():
+            for job in jobs:
+                executor, future = self._submit(job)
+                pending[future] = job, executor
+                return True
+            return False
+
+        while len(pending) < self.queue_size and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, executor = pending.pop(future)
+                submit_next()
+                try:
+                    yield job, future.result(), None
+                except BrokenProcessPool as e:
+                    self._discard(executor)
+                    yield job, None, e
+                except Exception as e:
+                    yield job, None, e
+
+    def _start(self):
+        # Shared by request threads in the web app, so start the pool only once
+        with self._lock:
+            if self._executor is None:
+                # Spawned (not forked) workers never inherit open USB handles or web server threads
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _submit(self, job):
+        """(executor, future) for a job, on a fresh pool if the current one broke since the last call"""
+        executor = self._start()
+        try:
+            return executor, executor.submit(self.render, *job)
+        except BrokenProcessPool:
+            self._discard(executor)
+            executor = self._start()
+            return executor, executor.submit(self.render, *job)
+
+    def _discard(self, executor):
+        # A dead worker breaks the whole pool for good; drop it so _start() makes a new one.
+        # Another thread may already have replaced it, and that pool is left alone.
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
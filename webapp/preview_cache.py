@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Preview image cache for the web interface
+Keeps rendered preview PNGs in an LRU and lets concurrent identical
+requests share one render
+"""
+
+from collections import OrderedDict
+import hashlib
+import io
+import threading
+from PIL import Image
+
+try:
+    from . import print_utils, raster_utils
+except ImportError:
+    import print_utils
+    import raster_utils
+
+# Rendered previews kept in memory (1-bit PNGs are a few KB each)
+PREVIEW_CACHE_SIZE = 512
+
+
+def preview_key(file_hash, columns, qr, row, mode='RGB', size=None):
+    """Cache key for one preview: file contents, selection, QR flag, row and render settings"""
+    return (file_hash, tuple(columns), bool(qr), row, mode, size)
+
+
+def etag_for(key):
+    """Strong ETag derived from the cache key, so a 304 never needs a render"""
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def encode_png(img, size=None):
+    """
+    Encode a preview as a compact PNG
+
+    Full-size previews are binarized the way the printer would and saved as
+    1-bit. Thumbnails (size = width in pixels) are box-filtered to greyscale
+    instead, since thinned 1-bit strokes become unreadable when shrunk.
+    """
+    if size and size < img.width:
+        height = max(1, round(img.height * size / img.width))
+        img = img.convert('L').resize((size, height), Image.Resampling.BOX)
+    else:
+        img = raster_utils.binarize(img)
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def render_preview(text, qr_enabled=True, mode='RGB', size=None):
+    """Render a label preview straight to PNG bytes (picklable, for worker processes)"""
+    img = print_utils.create_label_image_preview(text, qr_enabled=qr_enabled, mode=mode)
+    return encode_png(img, size)
+
+
+class _Call:
+    """A render in progress that other requests for the same key wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class PreviewCache:
+    """
+    LRU of rendered previews with request coalescing
+
+    get(key, render) returns the cached value or calls render() once per key,
+    even when several threads ask for the same key at the same time.
+    """
+
+    def __init__(self, max_entries=PREVIEW_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, render):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = render()
+        except Exception as e:
+            call.error = e
+            raise
+        else:
+            self.put(key, call.value)
+            return call.value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+
+    def peek(self, key):
+        """Cached value for key or None, without rendering"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            return None
+
+    def put(self, key, value):
+        """Store a value rendered elsewhere (e.g. by a worker process)"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'coalesced': self.coalesced}
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Persistent printer sessions for Brother QL printers
+Keeps the backend device open across labels instead of opening, claiming and
+releasing it for every print job, with one session per printer identifier
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from brother_ql.backends import backend_factory
+from brother_ql.reader import interpret_response
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the printer to report each printed page
+STATUS_TIMEOUT = 10
+
+# After a failed write: invalidate (fills out a half-sent raster line), then ESC i S status request ...
+STATUS_REQUEST = b'\x00' * 200 + b'\x1b\x69\x53'
+# ... and seconds to wait for the reply
+STATUS_REQUEST_TIMEOUT = 2
+
+# Backend used when none is given (override with LABEL_PRINTER_BACKEND or the CLIs' --backend,
+# e.g. 'emulator' for a dry run without a printer)
+DEFAULT_BACKEND = os.environ.get('LABEL_PRINTER_BACKEND', 'pyusb')
+
+# Extra backends selectable by name next to brother_ql's 'pyusb', 'network' and 'linux_kernel'
+_extra_backends = {}
+
+
+def register_backend(name, backend_class, list_available_devices=None):
+    """
+    Make a backend selectable by name, e.g. a fake backend in tests
+
+    backend_class must behave like brother_ql's BrotherQLBackendGeneric:
+    constructed with the printer identifier, with write(), read() and dispose().
+    """
+    _extra_backends[name] = {
+        'backend_class': backend_class,
+        'list_available_devices': list_available_devices or (lambda: []),
+    }
+
+
+def get_backend(name):
+    """Return {'backend_class', 'list_available_devices'} for a backend name"""
+    if name == 'emulator' and name not in _extra_backends:
+        # The emulator registers itself when imported
+        try:
+            from . import emulator
+        except ImportError:
+            import emulator
+    if name in _extra_backends:
+        return _extra_backends[name]
+    return backend_factory(name)
+
+
+def _device_for(printer_identifier, backend):
+    """
+    What to hand the backend class for an identifier
+
+    brother_ql's pyusb backend picks the first device matching vendor and
+    product, so two identical printers can't be told apart by identifier.
+    An identifier with a serial number (usb://0x04f9:0x2042_SERIAL, as
+    listed by discovery) is resolved to that exact device instead.
+    """
+    if not printer_identifier or not printer_identifier.startswith('usb://'):
+        return printer_identifier
+    vendor_product, _, serial = printer_identifier[len('usb://'):].replace('/', '_', 1).partition('_')
+    if not serial:
+        return printer_identifier
+    wanted = f"usb://{vendor_product}_{serial}"
+    for device in backend['list_available_devices']():
+        if device.get('identifier') == wanted and device.get('instance') is not None:
+            return device['instance']
+    # Falling back to vendor:product alone could silently print on a different printer
+    raise ValueError(f"Printer not found: {printer_identifier}")
+
+
+class PrinterSession:
+    """
+    A long-lived connection to one printer
+
+    The device is opened on first use and kept open. If a write fails the
+    device is closed and reopened, and the job is sent again once - but
+    only if none of it reached the printer, or the printer then reports
+    it is idle without errors, so a label that started printing is never
+    printed twice. Any other error closes the device so the next job
+    starts from a fresh connection. Sessions are safe to share between
+    threads - jobs are serialized.
+    """
+
+    def __init__(self, printer_identifier, backend_identifier=DEFAULT_BACKEND, backend_class=None,
+                 status_timeout=STATUS_TIMEOUT):
+        self.printer_identifier = printer_identifier
+        self.backend_identifier = backend_identifier
+        self.backend_class = backend_class
+        self.status_timeout = status_timeout
+        self.lock = threading.RLock()
+        self.jobs_sent = 0
+        self.reconnects = 0
+        self._printer = None
+
+    @property
+    def is_open(self):
+        return self._printer is not None
+
+    def open(self):
+        """Open the device if it is not open yet"""
+        with self.lock:
+            if self._printer is None:
+                backend = get_backend(self.backend_identifier)
+                backend_class = self.backend_class or backend['backend_class']
+                self._printer = backend_class(_device_for(self.printer_identifier, backend))
+                logger.info(f"Opened printer session: {self.printer_identifier}")
+            return self._printer
+
+    def close(self):
+        """Release the device (it is reopened on the next send)"""
+        with self.lock:
+            if self._printer is not None:
+                try:
+                    self._printer.dispose()
+                except Exception as e:
+                    logger.debug(f"Error closing printer {self.printer_identifier}: {e}")
+                self._printer = None
+
+    def send(self, instructions, blocking=True, pages=1, on_page=None):
+        """
+        Send instruction bytes over the open connection
+
+        Args:
+            instructions: Raster instruction bytes
+            blocking: Wait for the printer to report completion
+            pages: Number of pages in the job (blocking waits for each of them)
+            on_page: Called with the number of pages printed so far each time
+                     the printer confirms one (blocking only)
+
+        Returns:
+            Status dict with the same keys as brother_ql.backends.helpers.send
+        """
+        with self.lock:
+            with metrics.timer('send_write'):
+                printer = self._write(instructions)
+
+            self.jobs_sent += 1
+            metrics.count('bytes_sent', len(instructions))
+            try:
+                with metrics.timer('send_wait'):
+                    status = self._wait_for_completion(printer, blocking, pages, on_page)
+            except Exception as e:
+                self.close()
+                metrics.error(e)
+                raise
+            if status['outcome'] == 'error':
+                for error in status['printer_state']['errors']:
+                    metrics.error(error)
+            elif status['did_print']:
+                metrics.count('labels_printed', pages)
+            return status
+
+    def _write(self, instructions):
+        """Write a job, reconnecting and sending it again once if that can't print a label twice"""
+        # The leading invalidate bytes go out first on their own: a stale handle fails on
+        # them, and then nothing the printer could act on has been sent
+        head = len(instructions) - len(instructions.lstrip(b'\x00'))
+        job_data_sent = False
+        printer = self.open()
+        try:
+            if head:
+                printer.write(instructions[:head])
+            job_data_sent = True
+            printer.write(instructions[head:] if head else instructions)
+            return printer
+        except Exception as e:
+            self.close()
+            metrics.error(e)
+            if job_data_sent and not self._printer_idle():
+                logger.error(f"Write to {self.printer_identifier} failed ({e}) after part of the job was sent, "
+                             f"and the printer did not report it is idle: not sending it again, so no label "
+                             f"prints twice")
+                raise
+            reason = "the printer reports it is idle" if job_data_sent else "before any of the job was sent"
+            self.reconnects += 1
+            logger.warning(f"Write to {self.printer_identifier} failed ({e}), {reason}: reconnecting and "
+                           f"sending the job again")
+
+        printer = self.open()
+        try:
+            printer.write(instructions)
+        except Exception as e:
+            self.close()
+            metrics.error(e)
+            raise
+        return printer
+
+    def _printer_idle(self):
+        """
+        After a failed write: True if the printer answers a status request idle and without errors
+
+        A page that started printing (or finished since the last job) shows up as a printing phase or
+        a 'Printing completed' message first. No answer counts as not idle.
+        """
+        if self.backend_identifier == 'network':
+            # The network backend doesn't support read-back
+            return False
+        try:
+            printer = self.open()
+            printer.write(STATUS_REQUEST)
+            start = time.time()
+            while time.time() - start < STATUS_REQUEST_TIMEOUT:
+                data = printer.read()
+                if not data:
+                    time.sleep(0.005)
+                    continue
+                try:
+                    result = interpret_response(data)
+                except ValueError:
+                    continue
+                if (result['errors'] or result['status_type'] == 'Printing completed'
+                        or result['phase_type'] != 'Waiting to receive'):
+                    logger.info(f"{self.printer_identifier} after the failed write: {result['status_type']}, "
+                                f"{result['phase_type']}, errors {result['errors']}")
+                    return False
+                if result['status_type'] == 'Reply to status request':
+                    return True
+        except Exception as e:
+            logger.warning(f"Status request to {self.printer_identifier} failed: {e}")
+            self.close()
+        return False
+
+    def _wait_for_completion(self, printer, blocking, pages, on_page=None):
+        status = {
+            'instructions_sent': True,
+            'outcome': 'sent',
+            'printer_state': None,
+            'did_print': False,
+            'ready_for_next_job': False,
+        }
+        if not blocking or self.backend_identifier == 'network':
+            # The network backend doesn't support read-back
+            return status
+
+        printed = 0
+        start = time.time()
+        while time.time() - start < self.status_timeout * max(1, pages):
+            data = printer.read()
+            if not data:
+                time.sleep(0.005)
+                continue
+            try:
+                result = interpret_response(data)
+            except ValueError:
+                logger.error(f"Couldn't understand printer response: {data!r}")
+                continue
+            status['printer_state'] = result
+            if result['errors']:
+                logger.error(f"Printer errors: {result['errors']}")
+                status['outcome'] = 'error'
+                break
+            if result['status_type'] == 'Printing completed':
+                printed += 1
+                if on_page is not None:
+                    on_page(printed)
+                if printed >= pages:
+                    status['did_print'] = True
+                    status['outcome'] = 'printed'
+            if result['status_type'] == 'Phase change' and result['phase_type'] == 'Waiting to receive':
+                status['ready_for_next_job'] = status['did_print']
+            if status['did_print'] and status['ready_for_next_job']:
+                break
+
+        if not (status['did_print'] and status['ready_for_next_job']):
+            logger.warning(f"Printing potentially not successful on {self.printer_identifier} "
+                           f"({printed}/{pages} pages confirmed)")
+        return status
+
+
+class SessionPool:
+    """Printer sessions keyed by printer identifier"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, printer_identifier, backend_identifier=DEFAULT_BACKEND, backend_class=None):
+        """Return the session for a printer, creating it on first use"""
+        key = (printer_identifier, backend_identifier)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = PrinterSession(printer_identifier, backend_identifier, backend_class)
+                self._sessions[key] = session
+            return session
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def close_all(self):
+        """Release every open device"""
+        for session in self.sessions():
+            session.close()
+
+
+# Process-wide pool shared by the CLIs and the web app's job thread
+pool = SessionPool()
+atexit.register(pool.close_all)
+
+
+def get_session(printer_identifier, backend_identifier=DEFAULT_BACKEND):
+    """Return the shared session for a printer"""
+    return pool.get(printer_identifier, backend_identifier)
+
+
+def send(instructions, printer_identifier=None, backend_identifier=DEFAULT_BACKEND, blocking=True, pages=1,
+         on_page=None):
+    """Drop-in replacement for brother_ql.backends.helpers.send that reuses the open device"""
+    session = get_session(printer_identifier, backend_identifier)
+    return session.send(instructions, blocking=blocking, pages=pages, on_page=on_page)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+QR code rasterizer for Brother QL-700 labels
+Writes the module matrix straight into 1-bit images with integer scaling
+"""
+
+from functools import lru_cache
+import qrcode
+from PIL import Image
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+ERROR_CORRECT_L = qrcode.constants.ERROR_CORRECT_L
+
+# Number of encoded payloads / rendered QR images kept in memory
+QR_CACHE_SIZE = 2048
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_matrix(data, error_correction=ERROR_CORRECT_L, border=1):
+    """Encode data and return the module matrix (including the quiet zone) as tuples of bools"""
+    qr = qrcode.QRCode(version=1, error_correction=error_correction, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_image(data, size=None, box_size=3, border=1, error_correction=ERROR_CORRECT_L):
+    """
+    Render a QR code as a 1-bit image
+
+    Args:
+        data: QR payload
+        size: Target square size in pixels (optional). Modules are scaled by
+              the largest whole factor that fits and the code is centered.
+        box_size: Pixels per module when size is not given
+        border: Quiet zone width in modules
+        error_correction: qrcode error correction constant
+
+    Returns:
+        PIL Image in mode '1' - shared by the cache, so paste it, don't modify it
+    """
+    matrix = qr_matrix(data, error_correction, border)
+    modules = len(matrix)
+
+    module_img = Image.new('1', (modules, modules))
+    module_img.putdata([0 if dark else 255 for row in matrix for dark in row])
+
+    if size is None:
+        scale = box_size
+    else:
+        scale = size // modules
+        if scale < 1:
+            # Target smaller than one pixel per module - nothing better than a plain resize
+            return module_img.resize((size, size), Image.Resampling.NEAREST)
+
+    # Integer scaling keeps module edges sharp, no re-binarizing needed
+    qr_px = modules * scale
+    img = module_img.resize((qr_px, qr_px), Image.Resampling.NEAREST)
+
+    if size is not None and qr_px != size:
+        canvas = Image.new('1', (size, size), 1)
+        offset = (size - qr_px) // 2
+        canvas.paste(img, (offset, offset))
+        img = canvas
+
+    return img
+
+
+@metrics.timed('qr')
+def paste_qr(canvas, data, position, size=None, box_size=3, border=1,
+             error_correction=ERROR_CORRECT_L):
+    """Paste a cached QR code onto canvas at position, returning the QR image"""
+    img = qr_image(data, size, box_size, border, error_correction)
+    canvas.paste(img, position)
+    return img
+
+
+def clear_cache():
+    """Drop all cached QR matrices and images"""
+    qr_matrix.cache_clear()
+    qr_image.cache_clear()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Persistent raster cache for Brother QL instruction bytes
+Content-addressed, size-bounded store on disk, shared by runs and worker
+processes: a repeat run sends cached instruction streams (read through mmap)
+instead of rendering and converting the labels again
+"""
+
+from contextlib import contextmanager
+import functools
+import glob
+import hashlib
+from importlib import metadata
+import inspect
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import PIL
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+logger = logging.getLogger(__name__)
+
+# Cache directory (override with LABEL_RASTER_CACHE or the CLIs' --raster-cache DIR)
+DEFAULT_DIR = os.environ.get('LABEL_RASTER_CACHE',
+                             os.path.join(os.path.expanduser('~'), '.brother_ql', 'raster_cache'))
+
+# Size bound in bytes; least recently used entries are evicted past it ...
+MAX_BYTES = int(os.environ.get('LABEL_RASTER_CACHE_MB', 512)) * 1024 * 1024
+# ... down to this share of it, so eviction doesn't run on every write
+EVICT_TO = 0.9
+
+# Hits refresh an entry's mtime (its LRU position) at most this often (seconds)
+TOUCH_INTERVAL = 60.0
+
+# Temporary files older than this (seconds) are leftovers of crashed writers
+STALE_TMP_AGE = 3600.0
+
+# Bump when the key layout changes
+CACHE_VERSION = 1
+
+ENTRY_SUFFIX = '.ql'
+LOCK_NAME = '.lock'
+
+# Directory of the shared rendering modules, part of every key's code fingerprint
+_WEBAPP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@contextmanager
+def _locked(path):
+    """Exclusive lock on a file, held across processes"""
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class RasterCache:
+    """
+    Instruction bytes on disk, keyed by a hex digest
+
+    Entries are written to a temporary file and renamed into place, so
+    readers see a whole entry or none. Eviction (oldest mtime first) runs
+    under a lock file so concurrent processes don't sweep at once; a
+    reader that loses an entry to eviction gets a miss, or keeps reading
+    the mapping it already has. Safe to share between threads.
+
+    Args:
+        directory: Cache directory (default: DEFAULT_DIR)
+        max_bytes: Size bound (default: MAX_BYTES)
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = os.path.abspath(directory or DEFAULT_DIR)
+        self.max_bytes = max_bytes or MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # Bytes on disk at the last scan, plus what this process wrote since
+        self._written = 0  # Bytes this process wrote since the last scan
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        # Two-character fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """Cached bytes for key as a read-only memoryview over an mmap, or None"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            # Missing, evicted meanwhile, or empty
+            with self._lock:
+                self.misses += 1
+            metrics.count('raster_cache', result='miss')
+            return None
+
+        if time.time() - stat.st_mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        with self._lock:
+            self.hits += 1
+        metrics.count('raster_cache', result='hit')
+        return data
+
+    def put(self, key, data):
+        """Store bytes under key (atomically; a concurrent writer of the same key just wins or loses the rename)"""
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # A full disk or a file held open elsewhere only costs the cache entry
+            logger.debug(f"Could not write raster cache entry {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._written += len(data)
+            # Other processes write too: rescan once this process alone could have used up the eviction margin
+            if self._size is None or self._written > self.max_bytes * (1 - EVICT_TO):
+                self._size = self.size
+                self._written = 0
+            else:
+                self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self, max_bytes=None):
+        """Delete least recently used entries until the cache is under EVICT_TO of its bound"""
+        target = (max_bytes if max_bytes is not None else self.max_bytes) * EVICT_TO
+        with _locked(os.path.join(self.directory, LOCK_NAME)):
+            entries = self._entries()
+            size = sum(entry[1] for entry in entries)
+            removed = 0
+            for mtime, entry_size, path in sorted(entries):
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Already gone, or (on Windows) still mapped by a reader
+                    continue
+                size -= entry_size
+                removed += 1
+        with self._lock:
+            self._size = size
+            self._written = 0
+        if removed:
+            logger.debug(f"Raster cache {self.directory}: evicted {removed} entries, {size} bytes left")
+            metrics.count('raster_cache_evictions', removed)
+
+    def clear(self):
+        """Delete every entry"""
+        self.evict(max_bytes=0)
+
+    @property
+    def size(self):
+        """Bytes currently on disk"""
+        return sum(entry[1] for entry in self._entries())
+
+    @property
+    def lookups(self):
+        return self.hits + self.misses
+
+    def summary(self):
+        """One line for run summaries, e.g. '40 of 48 jobs from the raster cache (83%)'"""
+        rate = self.hits / self.lookups if self.lookups else 0.0
+        return f"{self.hits} of {self.lookups} jobs from the raster cache ({rate:.0%})"
+
+    def _entries(self):
+        """(mtime, size, path) of every entry; stale temporary files are removed on the way"""
+        entries = []
+        now = time.time()
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.endswith(ENTRY_SUFFIX):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                elif entry.name.endswith('.tmp') and now - stat.st_mtime > STALE_TMP_AGE:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+        return entries
+
+
+# Caches by directory, so every render in a process shares one set of counters
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(directory=None, max_bytes=None):
+    """This process's RasterCache for a directory, created on first use"""
+    directory = os.path.abspath(directory or DEFAULT_DIR)
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = _caches[directory] = RasterCache(directory, max_bytes)
+        return cache
+
+
+@functools.lru_cache(maxsize=64)
+def code_fingerprint(*paths):
+    """Digest of the rendering code: the given source files, the shared modules and library versions"""
+    try:
+        brother_ql_version = metadata.version('brother_ql')
+    except metadata.PackageNotFoundError:
+        brother_ql_version = 'unknown'
+    digest = hashlib.sha256(f"{CACHE_VERSION} {PIL.__version__} {brother_ql_version}".encode())
+    for path in sorted(set(paths) | set(glob.glob(os.path.join(_WEBAPP_DIR, '*.py')))):
+        with open(path, 'rb') as f:
+            digest.update(path.encode('utf-8', 'replace') + b'\0' + f.read())
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=256)
+def _file_digest(path, mtime_ns, size):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def file_digest(path):
+    """Content digest of an input file (e.g. a label template), recomputed when it changes"""
+    stat = os.stat(path)
+    return _file_digest(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+class CachedRender:
+    """
+    A render callable (as used with RenderPipeline and FleetScheduler) backed by the raster cache
+
+    The key is a hash of the render function, its bound arguments, the job,
+    the code fingerprint and the contents of any input files. Picklable, so
+    it works in worker processes; they share the cache through the disk.
+
+    Args:
+        render: Top-level function or functools.partial returning instruction bytes
+        directory: Cache directory (default: DEFAULT_DIR)
+        max_bytes: Size bound (default: MAX_BYTES)
+        files: Input files the render reads (template, logos), keyed by content
+        ignore: Keyword arguments that don't affect the bytes (e.g. render_dedup's job token)
+    """
+
+    def __init__(self, render, directory=None, max_bytes=None, files=(), ignore=('dedup',)):
+        self.render = render
+        self.directory = os.path.abspath(directory or DEFAULT_DIR)
+        self.max_bytes = max_bytes
+        self.files = tuple(files)
+        self.ignore = tuple(ignore)
+
+    @property
+    def cache(self):
+        return get_cache(self.directory, self.max_bytes)
+
+    def key(self, *job):
+        func, args, keywords = self.render, (), {}
+        while isinstance(func, functools.partial):
+            args = func.args + args
+            keywords = {**func.keywords, **keywords}
+            func = func.func
+        keywords = {name: value for name, value in keywords.items() if name not in self.ignore}
+        source = inspect.getsourcefile(func)
+        blob = json.dumps([
+            code_fingerprint(os.path.abspath(source)) if source else code_fingerprint(),
+            f"{func.__module__}.{func.__qualname__}",
+            args, keywords, job,
+            [file_digest(path) for path in self.files],
+        ], sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def __call__(self, *job):
+        cache = self.cache
+        key = self.key(*job)
+        data = cache.get(key)
+        if data is None:
+            data = self.render(*job)
+            cache.put(key, data)
+        elif multiprocessing.parent_process() is not None:
+            # Results of worker processes are pickled back, and mappings don't pickle
+            data = data.tobytes()
+        return data
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Raster stage for Brother QL-700 labels
+Turns rendered label images into printer instructions. Images drawn natively
+in mode '1' (or 'L') skip the RGB conversion and re-thresholding done by
+brother_ql.conversion.convert.
+"""
+
+from collections import namedtuple
+from PIL import Image, ImageColor
+from brother_ql import BrotherQLUnsupportedCmd
+from brother_ql.conversion import convert as brother_ql_convert
+from brother_ql.devicedependent import label_type_specs, ENDLESS_LABEL, right_margin_addition, compressionsupport
+from brother_ql.raster import BrotherQLRaster
+import packbits
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+# Canvas modes accepted by the renderers: 'RGB' is the classic path, '1' and
+# 'L' draw straight onto 1-bit / 8-bit canvases
+RENDER_MODES = ('RGB', 'L', '1')
+NATIVE_MODES = ('L', '1')
+
+# Threshold in percent, same meaning as brother_ql's convert(threshold=...)
+THRESHOLD = 70.0
+
+# A page already turned into raster line commands, ready to add to a stream
+EncodedPage = namedtuple('EncodedPage', ['height', 'compressed', 'data'])
+
+# Lookup table inverting every bit of a byte (PIL '1' stores white as 1, the printer prints 1s)
+_INVERT_BITS = bytes(255 - i for i in range(256))
+
+
+def cutoff(threshold=THRESHOLD):
+    """Highest grey level (0-255) that still prints as a black dot"""
+    level = min(255, max(0, int((100.0 - threshold) / 100.0 * 255)))
+    return 255 - level
+
+
+def ink(color, mode, threshold=THRESHOLD):
+    """
+    Fill value for drawing color on a canvas of the given mode
+
+    On 1-bit canvases the color is binarized the same way the printer
+    threshold would, so e.g. 'lightgray' stays white as it does on paper.
+    """
+    if mode == '1':
+        return 0 if ImageColor.getcolor(color, 'L') <= cutoff(threshold) else 255
+    return color
+
+
+def new_canvas(size, mode='RGB'):
+    """Blank white label canvas in the given render mode"""
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Unsupported render mode '{mode}', expected one of {', '.join(RENDER_MODES)}")
+    return Image.new(mode, size, 'white')
+
+
+def binarize(im, threshold=THRESHOLD, dither=False):
+    """Convert an image to mode '1' (black = 0) using the printer threshold"""
+    if im.mode == '1':
+        return im
+    if im.mode != 'L':
+        im = im.convert('L')
+    if dither:
+        return im.convert('1', dither=Image.Dither.FLOYDSTEINBERG)
+    level = cutoff(threshold)
+    return im.point([0 if value <= level else 255 for value in range(256)], '1')
+
+
+def prepare_page(im, label, model='QL-700', rotate=0, threshold=THRESHOLD, dither=False):
+    """
+    Rotate, scale and pad a label image to the printer's pixel width
+
+    Args:
+        im: Rendered label image ('1', 'L' or 'RGB')
+        label: brother_ql label identifier, e.g. '62'
+        model: Printer model
+        rotate: Rotation in degrees or 'auto' (multiples of 90 are lossless transposes)
+        threshold: Binarization threshold in percent
+        dither: Dither grey tones instead of thresholding
+
+    Returns:
+        Mode '1' image, device pixel width wide, black = 0
+    """
+    specs = label_type_specs[label]
+    dots_printable = specs['dots_printable']
+    device_pixel_width = BrotherQLRaster(model).get_pixel_width()
+    right_margin = specs['right_margin_dots'] + right_margin_addition.get(model, 0)
+
+    if rotate == 'auto':
+        # Only die-cut labels given in landscape are turned, as brother_ql does
+        rotate = 90 if specs['kind'] != ENDLESS_LABEL and im.size == tuple(dots_printable[::-1]) else 0
+    if rotate:
+        im = im.rotate(int(rotate), expand=True)
+
+    if specs['kind'] == ENDLESS_LABEL:
+        if im.size[0] != dots_printable[0]:
+            # Scaled before thresholding, with brother_ql's filter (Pillow itself uses NEAREST for mode '1')
+            height = int((dots_printable[0] / im.size[0]) * im.size[1])
+            im = im.resize((dots_printable[0], height), Image.Resampling.LANCZOS)
+    elif im.size != tuple(dots_printable):
+        raise ValueError("Bad image dimensions: %s. Expecting: %s." % (im.size, tuple(dots_printable)))
+
+    im = binarize(im, threshold, dither)
+
+    if im.size[0] < device_pixel_width:
+        page = Image.new('1', (device_pixel_width, im.size[1]), 1)
+        page.paste(im, (device_pixel_width - im.size[0] - right_margin, 0))
+        im = page
+
+    return im
+
+
+def use_compression(model, compress=True):
+    """Whether pages for model get packbits-compressed: only if asked for and the model supports it"""
+    # Same check as BrotherQLRaster.add_compression, which skips the M command for other models
+    return bool(compress) and model in compressionsupport
+
+
+def encode_page(page, compress=False):
+    """
+    Raster line commands for a prepared mode '1' page, as an EncodedPage
+
+    Pass compress=use_compression(model, ...) - compressed rows only print
+    on models that support compression.
+    """
+    # Rows are sent mirrored with 1 = dot, straight from the 1-bit buffer
+    raw = page.transpose(Image.Transpose.FLIP_LEFT_RIGHT).tobytes().translate(_INVERT_BITS)
+    row_len = page.size[0] // 8
+    chunks = []
+    for start in range(0, len(raw) - row_len + 1, row_len):
+        row = raw[start:start + row_len]
+        if compress:
+            row = packbits.encode(row)
+        chunks.append(b'\x67\x00' + bytes([len(row)]) + row)
+    return EncodedPage(page.size[1], compress, b''.join(chunks))
+
+
+def add_page(qlr, page, label, cut=True, hq=True, compress=False, last_page=True):
+    """
+    Append one page to a BrotherQLRaster instruction stream
+
+    page is a prepared mode '1' image or an EncodedPage (whose own
+    compression then applies). compress is ignored on models without
+    compression support.
+    """
+    if not isinstance(page, EncodedPage):
+        page = encode_page(page, use_compression(qlr.model, compress))
+    elif page.compressed and not use_compression(qlr.model):
+        raise ValueError(f"Page was compressed, but the {qlr.model} does not support compression")
+    specs = label_type_specs[label]
+    tape_size = specs['tape_size']
+
+    qlr.add_status_information()
+    if specs['kind'] == ENDLESS_LABEL:
+        qlr.mtype = 0x0A
+        qlr.mwidth = tape_size[0]
+        qlr.mlength = 0
+    else:
+        qlr.mtype = 0x0B
+        qlr.mwidth = tape_size[0]
+        qlr.mlength = tape_size[1]
+    qlr.pquality = int(hq)
+    qlr.add_media_and_quality(page.height)
+    try:
+        if cut:
+            qlr.add_autocut(True)
+            qlr.add_cut_every(1)
+        elif qlr.page_number > 0:
+            # Later pages of a batch must switch off a cut requested earlier in the stream
+            qlr.add_autocut(False)
+    except BrotherQLUnsupportedCmd:
+        pass
+    try:
+        qlr.dpi_600 = False
+        qlr.cut_at_end = cut
+        qlr.two_color_printing = False
+        qlr.add_expanded_mode()
+    except BrotherQLUnsupportedCmd:
+        pass
+    qlr.add_margins(specs['feed_margin'])
+    try:
+        if page.compressed:
+            qlr.add_compression(True)
+    except BrotherQLUnsupportedCmd:
+        pass
+
+    qlr.data += page.data
+    qlr.add_print(last_page)
+    qlr.page_number += 1
+
+
+@metrics.timed('convert')
+def convert(qlr, images, label, **kwargs):
+    """
+    Drop-in replacement for brother_ql.conversion.convert
+
+    Images that were rendered natively in mode '1' or 'L' go through the
+    1-bit raster path; anything else (or red / 600 dpi printing) is handed
+    to brother_ql unchanged.
+
+    cut may also be a list with one flag per image. All images then go out
+    as one multi-page job with the cut set page by page, so a whole batch
+    needs a single send().
+
+    Images may also be EncodedPages from an earlier prepare_page() and
+    encode_page(); they are added as they are.
+    """
+    cut = kwargs.get('cut', True)
+    per_page_cut = isinstance(cut, (list, tuple))
+    if per_page_cut and len(cut) != len(images):
+        raise ValueError(f"Got {len(cut)} cut flags for {len(images)} images")
+
+    native = all(isinstance(im, EncodedPage) or getattr(im, 'mode', None) in NATIVE_MODES for im in images)
+    if kwargs.get('red') or kwargs.get('dpi_600'):
+        if per_page_cut:
+            raise ValueError("Per-page cuts are not supported for red or 600 dpi printing")
+        return brother_ql_convert(qlr, images, label, **kwargs)
+    if not native and not per_page_cut:
+        return brother_ql_convert(qlr, images, label, **kwargs)
+
+    rotate = kwargs.get('rotate', 'auto')
+    cuts = cut if per_page_cut else [cut] * len(images)
+
+    try:
+        qlr.add_switch_mode()
+    except BrotherQLUnsupportedCmd:
+        pass
+    qlr.add_invalidate()
+    qlr.add_initialize()
+    try:
+        qlr.add_switch_mode()
+    except BrotherQLUnsupportedCmd:
+        pass
+
+    for i, im in enumerate(images):
+        page = im if isinstance(im, EncodedPage) else prepare_page(
+            im, label, qlr.model, rotate, kwargs.get('threshold', THRESHOLD), kwargs.get('dither', False))
+        # Single-image jobs keep brother_ql's framing; batches mark all but the last page as form feeds
+        last_page = not per_page_cut or i == len(images) - 1
+        add_page(qlr, page, label, cut=cuts[i], hq=kwargs.get('hq', True),
+                 compress=kwargs.get('compress', False), last_page=last_page)
+
+    return qlr.data
+
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Per-job render deduplication for Brother QL labels
+Rendered labels are keyed on a hash of (template, field values, options), so
+a label that repeats within a job (the same SKU in several sizes, reprint
+lists with duplicates) is rendered and rasterized once and its bytes reused
+"""
+
+from collections import OrderedDict
+import hashlib
+import itertools
+import json
+import os
+import threading
+
+try:
+    from . import metrics, raster_utils
+except ImportError:
+    import metrics
+    import raster_utils
+
+# Rasterized labels kept per job (a 62 mm page is roughly 20-200 KB)
+DEDUP_CACHE_SIZE = 256
+# Caches of jobs started elsewhere (render workers) a process keeps at once (oldest dropped first)
+JOBS_KEPT = 8
+
+
+def content_key(template, values, options):
+    """
+    Hash of what a label's bytes depend on
+
+    Args:
+        template: Template dict, file path or any JSON-serializable description of the layout
+        values: Field values the template reads (string, dict or list of them)
+        options: Render and raster settings (mode, rotation, threshold, ...)
+    """
+    blob = json.dumps([template, values, options], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class RenderDedup:
+    """
+    Bounded LRU of rendered label bytes for one job
+
+    Holds EncodedPages for labels that go out in multi-page streams and
+    whole instruction streams for single labels. Safe to share between
+    threads; a render that races with another for the same key just does
+    the work twice.
+
+    Args:
+        capacity: Entries to keep (least recently used dropped first)
+    """
+
+    def __init__(self, capacity=DEDUP_CACHE_SIZE):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """The cached value for key, or build() stored under it"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if value is not None:
+            metrics.count('render_dedup', result='hit')
+            return value
+
+        value = build()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        metrics.count('render_dedup', result='miss')
+        return value
+
+    @property
+    def lookups(self):
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def summary(self):
+        """One line for job summaries, e.g. '12 of 40 labels reused (30%)'"""
+        return f"{self.hits} of {self.lookups} labels reused ({self.hit_rate:.0%})"
+
+    def convert(self, qlr, values, render, label, template, mode='RGB', **kwargs):
+        """
+        raster_utils.convert for labels rendered from field values, each distinct label rendered once
+
+        Args:
+            qlr: BrotherQLRaster to add the pages to
+            values: Field values, one entry per label
+            render: Callable turning one entry of values into a label image
+            label: brother_ql label identifier
+            template: Description of the layout for the content key
+            mode: Canvas mode render() draws in
+            **kwargs: As for raster_utils.convert
+
+        Returns:
+            Instruction bytes, identical to rendering every label and calling raster_utils.convert
+        """
+        cut = kwargs.get('cut', True)
+        per_page_cut = isinstance(cut, (list, tuple))
+        if kwargs.get('red') or kwargs.get('dpi_600') or (mode not in raster_utils.NATIVE_MODES and not per_page_cut):
+            # brother_ql converts these itself, so a single label's whole stream is what gets reused
+            if len(values) != 1:
+                return raster_utils.convert(qlr, [render(value) for value in values], label, **kwargs)
+            options = dict(kwargs, label=label, model=qlr.model, mode=mode)
+            data = self.get(content_key(template, values[0], options),
+                            lambda: bytes(raster_utils.convert(type(qlr)(qlr.model), [render(values[0])], label,
+                                                               **kwargs)))
+            qlr.data += data
+            return qlr.data
+
+        rotate = kwargs.get('rotate', 'auto')
+        threshold = kwargs.get('threshold', raster_utils.THRESHOLD)
+        dither = kwargs.get('dither', False)
+        compress = kwargs.get('compress', False)
+        options = {'label': label, 'model': qlr.model, 'mode': mode, 'rotate': rotate, 'threshold': threshold,
+                   'dither': dither, 'compress': compress}
+
+        def encode(value):
+            page = raster_utils.prepare_page(render(value), label, qlr.model, rotate, threshold, dither)
+            return raster_utils.encode_page(page, raster_utils.use_compression(qlr.model, compress))
+
+        pages = [self.get(content_key(template, value, options), lambda value=value: encode(value))
+                 for value in values]
+        return raster_utils.convert(qlr, pages, label, **kwargs)
+
+
+# Caches by job token, most recently used last. Render callables running in
+# worker processes get a token rather than the cache itself, and each
+# process keeps its own cache for the job.
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_tokens = itertools.count(1)
+# Tokens this process handed out that haven't been released: their caches are never evicted
+_open = set()
+
+
+def new_job():
+    """Token naming a fresh per-job cache (picklable, unique across processes); release() it when the job ends"""
+    token = f"{os.getpid()}-{next(_tokens)}"
+    with _jobs_lock:
+        _open.add(token)
+    return token
+
+
+def for_job(token):
+    """This process's cache for a job token, created on first use"""
+    with _jobs_lock:
+        dedup = _jobs.get(token)
+        if dedup is None:
+            dedup = _jobs[token] = RenderDedup()
+            # Only jobs from other processes can go: a worker is never told they ended. A worker
+            # process serves one pipeline, so the jobs it drops are ones it no longer renders for.
+            stale = [other for other in _jobs if other not in _open]
+            for other in stale[:max(0, len(stale) - JOBS_KEPT)]:
+                del _jobs[other]
+        else:
+            _jobs.move_to_end(token)
+        return dedup
+
+
+def release(token):
+    """Drop a job's cache and return it (for its hit counts), or None if this process never used it"""
+    with _jobs_lock:
+        _open.discard(token)
+        return _jobs.pop(token, None)
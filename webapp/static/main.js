@@ -1 +1,465 @@
-// Enhanced JavaScript for Brother QL-700 Label Printer Web Interface\n\nclass LabelPrinter {\n    constructor() {\n        this.currentCSV = null;\n        this.availableColumns = [];\n        this.selectedColumns = [];\n        this.isJobRunning = false;\n        this.statusInterval = null;\n        \n        this.initializeEventListeners();\n        this.updateUI();\n    }\n\n    initializeEventListeners() {\n        // File upload\n        document.getElementById('upload').addEventListener('click', () => this.uploadCSV());\n        document.getElementById('sample').addEventListener('click', () => this.useSampleData());\n        \n        // Settings\n        document.getElementById('genPreview').addEventListener('click', () => this.generatePreview());\n        \n        // Printer\n        document.getElementById('detect').addEventListener('click', () => this.detectPrinters());\n        document.getElementById('startPrint').addEventListener('click', () => this.startPrinting());\n        \n        // Logs\n        document.getElementById('clearLogs').addEventListener('click', () => this.clearLogs());\n        \n        // Auto-detect printers on load\n        setTimeout(() => this.detectPrinters(), 1000);\n    }\n\n    showToast(message, type = 'info') {\n        const toast = document.getElementById('toast');\n        const colors = {\n            success: '#48bb78',\n            error: '#f56565',\n            warning: '#ed8936',\n            info: '#4299e1'\n        };\n        \n        toast.style.background = colors[type] || colors.info;\n        toast.textContent = message;\n        toast.style.transform = 'translateX(0)';\n        \n        setTimeout(() => {\n            toast.style.transform = 'translateX(400px)';\n        }, 3000);\n    }\n\n    log(message, type = 'info') {\n        const logs = document.getElementById('logs');\n        const timestamp = new Date().toLocaleTimeString();\n        const indicator = {\n            success: '✅',\n            error: '❌',\n            warning: '⚠️',\n            info: 'ℹ️'\n        }[type] || 'ℹ️';\n        \n        logs.textContent += `[${timestamp}] ${indicator} ${message}\\n`;\n        logs.scrollTop = logs.scrollHeight;\n    }\n\n    clearLogs() {\n        document.getElementById('logs').textContent = 'Logs cleared...\\n';\n    }\n\n    updateUI() {\n        const hasCSV = this.currentCSV !== null;\n        const hasColumns = this.selectedColumns.length > 0;\n        \n        document.getElementById('genPreview').disabled = !hasCSV || !hasColumns;\n        document.getElementById('startPrint').disabled = !hasCSV || !hasColumns || this.isJobRunning;\n        \n        // Update button text based on job status\n        const printBtn = document.getElementById('startPrint');\n        if (this.isJobRunning) {\n            printBtn.textContent = '⏸️ Printing...';\n            printBtn.classList.add('loading');\n        } else {\n            printBtn.textContent = '🚀 Start Printing';\n            printBtn.classList.remove('loading');\n        }\n    }\n\n    async uploadCSV() {\n        const fileInput = document.getElementById('csvfile');\n        const file = fileInput.files[0];\n        \n        if (!file) {\n            this.showToast('Please select a CSV file first', 'warning');\n            return;\n        }\n        \n        if (!file.name.toLowerCase().endsWith('.csv')) {\n            this.showToast('Please select a valid CSV file', 'error');\n            return;\n        }\n        \n        const formData = new FormData();\n        formData.append('file', file);\n        \n        try {\n            this.log(`Uploading ${file.name}...`);\n            const response = await fetch('/upload-csv', {\n                method: 'POST',\n                body: formData\n            });\n            \n            const data = await response.json();\n            \n            if (!response.ok) {\n                throw new Error(data.error || 'Upload failed');\n            }\n            \n            this.currentCSV = data.path;\n            this.availableColumns = data.columns;\n            this.renderColumnSelection();\n            this.log(`Successfully uploaded ${file.name} with ${data.columns.length} columns`, 'success');\n            this.showToast('CSV uploaded successfully!', 'success');\n            \n        } catch (error) {\n            this.log(`Upload error: ${error.message}`, 'error');\n            this.showToast(`Upload failed: ${error.message}`, 'error');\n        }\n        \n        this.updateUI();\n    }\n\n    async useSampleData() {\n        try {\n            this.log('Loading sample data...');\n            const response = await fetch('/use-sample');\n            const data = await response.json();\n            \n            if (!response.ok) {\n                throw new Error(data.error || 'Failed to load sample');\n            }\n            \n            this.currentCSV = data.path;\n            this.availableColumns = data.columns;\n            this.renderColumnSelection();\n            this.log(`Loaded sample data with ${data.columns.length} columns`, 'success');\n            this.showToast('Sample data loaded!', 'success');\n            \n        } catch (error) {\n            this.log(`Sample data error: ${error.message}`, 'error');\n            this.showToast(`Failed to load sample: ${error.message}`, 'error');\n        }\n        \n        this.updateUI();\n    }\n\n    renderColumnSelection() {\n        const container = document.getElementById('columns');\n        container.innerHTML = '';\n        \n        if (this.availableColumns.length === 0) {\n            container.innerHTML = '<p style=\"color: #718096; font-style: italic;\">No columns available</p>';\n            return;\n        }\n        \n        this.availableColumns.forEach(column => {\n            const div = document.createElement('div');\n            div.className = 'column-item';\n            \n            const checkbox = document.createElement('input');\n            checkbox.type = 'checkbox';\n            checkbox.id = `col-${column}`;\n            checkbox.value = column;\n            checkbox.checked = this.selectedColumns.includes(column);\n            \n            checkbox.addEventListener('change', (e) => {\n                if (e.target.checked) {\n                    if (!this.selectedColumns.includes(column)) {\n                        this.selectedColumns.push(column);\n                    }\n                } else {\n                    this.selectedColumns = this.selectedColumns.filter(c => c !== column);\n                }\n                this.updateUI();\n            });\n            \n            const label = document.createElement('label');\n            label.htmlFor = `col-${column}`;\n            label.textContent = column;\n            label.style.cursor = 'pointer';\n            \n            div.appendChild(checkbox);\n            div.appendChild(label);\n            container.appendChild(div);\n        });\n        \n        // Auto-select first column if none selected\n        if (this.selectedColumns.length === 0 && this.availableColumns.length > 0) {\n            this.selectedColumns = [this.availableColumns[0]];\n            document.getElementById(`col-${this.availableColumns[0]}`).checked = true;\n        }\n    }\n\n    async generatePreview() {\n        if (!this.currentCSV || this.selectedColumns.length === 0) {\n            this.showToast('Please upload CSV and select columns first', 'warning');\n            return;\n        }\n        \n        try {\n            this.log('Generating preview...');\n            const response = await fetch('/preview', {\n                method: 'POST',\n                headers: { 'Content-Type': 'application/json' },\n                body: JSON.stringify({\n                    path: this.currentCSV,\n                    columns: this.selectedColumns,\n                    qr: document.getElementById('qr').checked\n                })\n            });\n            \n            const data = await response.json();\n            \n            if (!response.ok) {\n                throw new Error(data.error || 'Preview generation failed');\n            }\n            \n            const previewImg = document.getElementById('previewImg');\n            previewImg.innerHTML = `<img src=\"data:image/png;base64,${data.image_base64}\" alt=\"Label preview\" style=\"max-width: 100%; border-radius: 8px; box-shadow: 0 4px 12px rgba(0,0,0,0.1);\">`;\n            \n            this.log('Preview generated successfully', 'success');\n            this.showToast('Preview ready!', 'success');\n            \n        } catch (error) {\n            this.log(`Preview error: ${error.message}`, 'error');\n            this.showToast(`Preview failed: ${error.message}`, 'error');\n        }\n    }\n\n    async detectPrinters() {\n        try {\n            this.log('Detecting printers...');\n            const response = await fetch('/printers');\n            const data = await response.json();\n            \n            const printersElement = document.getElementById('printers');\n            const printerIdInput = document.getElementById('printerId');\n            \n            if (data.printers && data.printers.length > 0) {\n                const printerList = data.printers.map(p => \n                    `📱 ${p.identifier || 'Unknown'} (${p.instance || 'USB Device'})`\n                ).join('\\n');\n                \n                printersElement.textContent = printerList;\n                \n                // Auto-fill first printer\n                if (data.printers[0].identifier) {\n                    printerIdInput.value = data.printers[0].identifier;\n                }\n                \n                this.log(`Found ${data.printers.length} printer(s)`, 'success');\n                this.showToast(`Found ${data.printers.length} printer(s)`, 'success');\n            } else {\n                printersElement.textContent = '❌ No Brother QL printers detected\\n\\nTroubleshooting:\\n• Check USB connection\\n• Ensure printer is powered on\\n• Try different USB port';\n                this.log('No printers detected', 'warning');\n                this.showToast('No printers found', 'warning');\n            }\n            \n        } catch (error) {\n            document.getElementById('printers').textContent = `❌ Error detecting printers: ${error.message}`;\n            this.log(`Printer detection error: ${error.message}`, 'error');\n            this.showToast('Printer detection failed', 'error');\n        }\n    }\n\n    async startPrinting() {\n        if (!this.currentCSV || this.selectedColumns.length === 0) {\n            this.showToast('Please upload CSV and select columns first', 'warning');\n            return;\n        }\n        \n        const printerId = document.getElementById('printerId').value;\n        const start = parseInt(document.getElementById('start').value) || 1;\n        const end = document.getElementById('end').value ? parseInt(document.getElementById('end').value) : null;\n        const batchSize = parseInt(document.getElementById('batch').value) || 1;\n        const includeQR = document.getElementById('qr').checked;\n        \n        try {\n            this.log(`Starting print job (rows ${start}${end ? `-${end}` : '+'}...)`);\n            this.isJobRunning = true;\n            this.updateUI();\n            \n            const response = await fetch('/print', {\n                method: 'POST',\n                headers: { 'Content-Type': 'application/json' },\n                body: JSON.stringify({\n                    path: this.currentCSV,\n                    columns: this.selectedColumns,\n                    qr: includeQR,\n                    start: start,\n                    end: end,\n                    batch_size: batchSize,\n                    printer: printerId\n                })\n            });\n            \n            const data = await response.json();\n            \n            if (!response.ok) {\n                throw new Error(data.error || 'Print job failed to start');\n            }\n            \n            this.log(`Print job started: ${data.total} labels queued`, 'success');\n            this.showToast(`Printing ${data.total} labels...`, 'success');\n            \n            // Show progress area\n            document.getElementById('progressArea').style.display = 'block';\n            \n            // Start status polling\n            this.startStatusPolling();\n            \n        } catch (error) {\n            this.isJobRunning = false;\n            this.updateUI();\n            this.log(`Print job error: ${error.message}`, 'error');\n            this.showToast(`Print failed: ${error.message}`, 'error');\n        }\n    }\n\n    startStatusPolling() {\n        this.statusInterval = setInterval(async () => {\n            try {\n                const response = await fetch('/status');\n                const data = await response.json();\n                \n                if (data.job) {\n                    const { running, progress, total } = data.job;\n                    \n                    if (total > 0) {\n                        const percentage = Math.round((progress / total) * 100);\n                        document.getElementById('progressFill').style.width = `${percentage}%`;\n                        document.getElementById('progressText').textContent = \n                            `Progress: ${progress}/${total} labels (${percentage}%)`;\n                    }\n                    \n                    if (!running && this.isJobRunning) {\n                        // Job completed\n                        this.isJobRunning = false;\n                        this.updateUI();\n                        clearInterval(this.statusInterval);\n                        \n                        this.log('Print job completed!', 'success');\n                        this.showToast('Printing completed!', 'success');\n                        \n                        setTimeout(() => {\n                            document.getElementById('progressArea').style.display = 'none';\n                        }, 3000);\n                    }\n                }\n                \n                // Update logs with new entries\n                if (data.logs && data.logs.length > 0) {\n                    const logsElement = document.getElementById('logs');\n                    const currentLogs = logsElement.textContent;\n                    const newLogs = data.logs.join('\\n');\n                    \n                    if (newLogs !== currentLogs) {\n                        logsElement.textContent = newLogs;\n                        logsElement.scrollTop = logsElement.scrollHeight;\n                    }\n                }\n                \n            } catch (error) {\n                console.error('Status polling error:', error);\n            }\n        }, 1000);\n    }\n}\n\n// Initialize the application when DOM is loaded\ndocument.addEventListener('DOMContentLoaded', () => {\n    new LabelPrinter();\n});
\ No newline at end of file
+// Enhanced JavaScript for Brother QL-700 Label Printer Web Interface
+
+class LabelPrinter {
+    constructor() {
+        this.currentCSV = null;
+        this.availableColumns = [];
+        this.selectedColumns = [];
+        this.isJobRunning = false;
+        this.statusInterval = null;
+        this.previewURL = null;
+        this.currentJobId = null;
+        this.eventSource = null;
+        this.lastSeq = 0;
+        
+        this.initializeEventListeners();
+        this.updateUI();
+    }
+
+    initializeEventListeners() {
+        // File upload
+        document.getElementById('upload').addEventListener('click', () => this.uploadCSV());
+        document.getElementById('sample').addEventListener('click', () => this.useSampleData());
+        
+        // Settings
+        document.getElementById('genPreview').addEventListener('click', () => this.generatePreview());
+        
+        // Printer
+        document.getElementById('detect').addEventListener('click', () => this.detectPrinters());
+        document.getElementById('startPrint').addEventListener('click', () => this.startPrinting());
+        document.getElementById('cancelPrint').addEventListener('click', () => this.cancelPrinting());
+        
+        // Logs
+        document.getElementById('clearLogs').addEventListener('click', () => this.clearLogs());
+        
+        // Auto-detect printers on load
+        setTimeout(() => this.detectPrinters(), 1000);
+    }
+
+    showToast(message, type = 'info') {
+        const toast = document.getElementById('toast');
+        const colors = {
+            success: '#48bb78',
+            error: '#f56565',
+            warning: '#ed8936',
+            info: '#4299e1'
+        };
+        
+        toast.style.background = colors[type] || colors.info;
+        toast.textContent = message;
+        toast.style.transform = 'translateX(0)';
+        
+        setTimeout(() => {
+            toast.style.transform = 'translateX(400px)';
+        }, 3000);
+    }
+
+    log(message, type = 'info') {
+        const logs = document.getElementById('logs');
+        const timestamp = new Date().toLocaleTimeString();
+        const indicator = {
+            success: '✅',
+            error: '❌',
+            warning: '⚠️',
+            info: 'ℹ️'
+        }[type] || 'ℹ️';
+        
+        logs.textContent += `[${timestamp}] ${indicator} ${message}\n`;
+        logs.scrollTop = logs.scrollHeight;
+    }
+
+    clearLogs() {
+        document.getElementById('logs').textContent = 'Logs cleared...\n';
+    }
+
+    updateUI() {
+        const hasCSV = this.currentCSV !== null;
+        const hasColumns = this.selectedColumns.length > 0;
+        
+        document.getElementById('genPreview').disabled = !hasCSV || !hasColumns;
+        document.getElementById('startPrint').disabled = !hasCSV || !hasColumns || this.isJobRunning;
+        
+        // Update button text based on job status
+        const printBtn = document.getElementById('startPrint');
+        if (this.isJobRunning) {
+            printBtn.textContent = '⏸️ Printing...';
+            printBtn.classList.add('loading');
+        } else {
+            printBtn.textContent = '🚀 Start Printing';
+            printBtn.classList.remove('loading');
+        }
+    }
+
+    async uploadCSV() {
+        const fileInput = document.getElementById('csvfile');
+        const file = fileInput.files[0];
+        
+        if (!file) {
+            this.showToast('Please select a CSV file first', 'warning');
+            return;
+        }
+        
+        if (!file.name.toLowerCase().endsWith('.csv')) {
+            this.showToast('Please select a valid CSV file', 'error');
+            return;
+        }
+        
+        const formData = new FormData();
+        formData.append('file', file);
+        
+        try {
+            this.log(`Uploading ${file.name}...`);
+            const response = await fetch('/upload-csv', {
+                method: 'POST',
+                body: formData
+            });
+            
+            const data = await response.json();
+            
+            if (!response.ok) {
+                throw new Error(data.error || 'Upload failed');
+            }
+            
+            this.currentCSV = data.path;
+            this.availableColumns = data.columns;
+            this.renderColumnSelection();
+            this.log(`Successfully uploaded ${file.name} with ${data.columns.length} columns`, 'success');
+            this.showToast('CSV uploaded successfully!', 'success');
+            
+        } catch (error) {
+            this.log(`Upload error: ${error.message}`, 'error');
+            this.showToast(`Upload failed: ${error.message}`, 'error');
+        }
+        
+        this.updateUI();
+    }
+
+    async useSampleData() {
+        try {
+            this.log('Loading sample data...');
+            const response = await fetch('/use-sample');
+            const data = await response.json();
+            
+            if (!response.ok) {
+                throw new Error(data.error || 'Failed to load sample');
+            }
+            
+            this.currentCSV = data.path;
+            this.availableColumns = data.columns;
+            this.renderColumnSelection();
+            this.log(`Loaded sample data with ${data.columns.length} columns`, 'success');
+            this.showToast('Sample data loaded!', 'success');
+            
+        } catch (error) {
+            this.log(`Sample data error: ${error.message}`, 'error');
+            this.showToast(`Failed to load sample: ${error.message}`, 'error');
+        }
+        
+        this.updateUI();
+    }
+
+    renderColumnSelection() {
+        const container = document.getElementById('columns');
+        container.innerHTML = '';
+        
+        if (this.availableColumns.length === 0) {
+            container.innerHTML = '<p style="color: #718096; font-style: italic;">No columns available</p>';
+            return;
+        }
+        
+        this.availableColumns.forEach(column => {
+            const div = document.createElement('div');
+            div.className = 'column-item';
+            
+            const checkbox = document.createElement('input');
+            checkbox.type = 'checkbox';
+            checkbox.id = `col-${column}`;
+            checkbox.value = column;
+            checkbox.checked = this.selectedColumns.includes(column);
+            
+            checkbox.addEventListener('change', (e) => {
+                if (e.target.checked) {
+                    if (!this.selectedColumns.includes(column)) {
+                        this.selectedColumns.push(column);
+                    }
+                } else {
+                    this.selectedColumns = this.selectedColumns.filter(c => c !== column);
+                }
+                this.updateUI();
+            });
+            
+            const label = document.createElement('label');
+            label.htmlFor = `col-${column}`;
+            label.textContent = column;
+            label.style.cursor = 'pointer';
+            
+            div.appendChild(checkbox);
+            div.appendChild(label);
+            container.appendChild(div);
+        });
+        
+        // Auto-select first column if none selected
+        if (this.selectedColumns.length === 0 && this.availableColumns.length > 0) {
+            this.selectedColumns = [this.availableColumns[0]];
+            document.getElementById(`col-${this.availableColumns[0]}`).checked = true;
+        }
+    }
+
+    async generatePreview() {
+        if (!this.currentCSV || this.selectedColumns.length === 0) {
+            this.showToast('Please upload CSV and select columns first', 'warning');
+            return;
+        }
+        
+        try {
+            this.log('Generating preview...');
+            // GET so the browser cache revalidates repeated previews with the ETag
+            const params = new URLSearchParams({
+                path: this.currentCSV,
+                qr: document.getElementById('qr').checked ? '1' : '0'
+            });
+            this.selectedColumns.forEach(column => params.append('columns', column));
+            const response = await fetch(`/preview?${params}`);
+            
+            if (!response.ok) {
+                const data = await response.json();
+                throw new Error(data.error || 'Preview generation failed');
+            }
+            
+            const blob = await response.blob();
+            if (this.previewURL) {
+                URL.revokeObjectURL(this.previewURL);
+            }
+            this.previewURL = URL.createObjectURL(blob);
+            
+            const previewImg = document.getElementById('previewImg');
+            previewImg.innerHTML = `<img src="${this.previewURL}" alt="Label preview" style="max-width: 100%; border-radius: 8px; box-shadow: 0 4px 12px rgba(0,0,0,0.1);">`;
+            
+            this.log('Preview generated successfully', 'success');
+            this.showToast('Preview ready!', 'success');
+            
+        } catch (error) {
+            this.log(`Preview error: ${error.message}`, 'error');
+            this.showToast(`Preview failed: ${error.message}`, 'error');
+        }
+    }
+
+    async detectPrinters() {
+        try {
+            this.log('Detecting printers...');
+            const response = await fetch('/printers');
+            const data = await response.json();
+            
+            const printersElement = document.getElementById('printers');
+            const printerIdInput = document.getElementById('printerId');
+            
+            if (data.printers && data.printers.length > 0) {
+                const printerList = data.printers.map(p => 
+                    `📱 ${p.identifier || 'Unknown'} (${p.instance || 'USB Device'})`
+                ).join('\n');
+                
+                printersElement.textContent = printerList;
+                
+                // Auto-fill first printer
+                if (data.printers[0].identifier) {
+                    printerIdInput.value = data.printers[0].identifier;
+                }
+                
+                this.log(`Found ${data.printers.length} printer(s)`, 'success');
+                this.showToast(`Found ${data.printers.length} printer(s)`, 'success');
+            } else {
+                printersElement.textContent = '❌ No Brother QL printers detected\n\nTroubleshooting:\n• Check USB connection\n• Ensure printer is powered on\n• Try different USB port';
+                this.log('No printers detected', 'warning');
+                this.showToast('No printers found', 'warning');
+            }
+            
+        } catch (error) {
+            document.getElementById('printers').textContent = `❌ Error detecting printers: ${error.message}`;
+            this.log(`Printer detection error: ${error.message}`, 'error');
+            this.showToast('Printer detection failed', 'error');
+        }
+    }
+
+    async startPrinting() {
+        if (!this.currentCSV || this.selectedColumns.length === 0) {
+            this.showToast('Please upload CSV and select columns first', 'warning');
+            return;
+        }
+        
+        const printerId = document.getElementById('printerId').value;
+        const start = parseInt(document.getElementById('start').value) || 1;
+        const end = document.getElementById('end').value ? parseInt(document.getElementById('end').value) : null;
+        const batchSize = parseInt(document.getElementById('batch').value) || 1;
+        const includeQR = document.getElementById('qr').checked;
+        const priority = document.getElementById('priority').value;
+        
+        try {
+            this.log(`Starting print job (rows ${start}${end ? `-${end}` : '+'}...)`);
+            this.isJobRunning = true;
+            this.updateUI();
+            
+            const response = await fetch('/print', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    path: this.currentCSV,
+                    columns: this.selectedColumns,
+                    qr: includeQR,
+                    start: start,
+                    end: end,
+                    batch_size: batchSize,
+                    printer: printerId,
+                    priority: priority
+                })
+            });
+            
+            const data = await response.json();
+            
+            if (!response.ok) {
+                throw new Error(data.error || 'Print job failed to start');
+            }
+            
+            this.currentJobId = data.id;
+            this.lastSeq = data.seq;
+            this.log(`Print job ${data.id} started: ${data.total} labels queued`, 'success');
+            this.showToast(`Printing ${data.total} labels...`, 'success');
+            
+            // Show progress area
+            document.getElementById('progressArea').style.display = 'block';
+            
+            // Start status polling
+            this.startStatusPolling();
+            
+        } catch (error) {
+            this.isJobRunning = false;
+            this.updateUI();
+            this.log(`Print job error: ${error.message}`, 'error');
+            this.showToast(`Print failed: ${error.message}`, 'error');
+        }
+    }
+
+    async cancelPrinting() {
+        if (this.currentJobId === null) {
+            return;
+        }
+        
+        try {
+            const response = await fetch(`/jobs/${this.currentJobId}/cancel`, { method: 'POST' });
+            const data = await response.json();
+            
+            if (!response.ok) {
+                throw new Error(data.error || 'Cancel failed');
+            }
+            
+            this.log(`Cancelling print job ${data.id}...`, 'warning');
+            
+        } catch (error) {
+            this.log(`Cancel error: ${error.message}`, 'error');
+            this.showToast(`Cancel failed: ${error.message}`, 'error');
+        }
+    }
+
+    handleJobUpdate(job) {
+        if (!job || job.id !== this.currentJobId) {
+            return;
+        }
+        
+        const { state, progress, total } = job;
+        const finished = ['completed', 'failed', 'cancelled'].includes(state);
+        
+        if (total > 0) {
+            const percentage = Math.round((progress / total) * 100);
+            document.getElementById('progressFill').style.width = `${percentage}%`;
+            document.getElementById('progressText').textContent = 
+                `Progress: ${progress}/${total} labels (${percentage}%)`;
+        }
+        
+        if (state === 'queued') {
+            document.getElementById('progressText').textContent =
+                `Queued${job.position ? ` (position ${job.position})` : ''}...`;
+        }
+        
+        if (finished && this.isJobRunning) {
+            // Job completed, failed or was cancelled
+            this.isJobRunning = false;
+            this.currentJobId = null;
+            this.updateUI();
+            this.stopStatusUpdates();
+            
+            if (state === 'completed') {
+                this.log('Print job completed!', 'success');
+                this.showToast('Printing completed!', 'success');
+            } else if (state === 'cancelled') {
+                this.log(`Print job cancelled after ${progress}/${total} labels`, 'warning');
+                this.showToast('Printing cancelled', 'warning');
+            } else {
+                this.log(`Print job failed: ${job.error}`, 'error');
+                this.showToast('Printing failed', 'error');
+            }
+            
+            setTimeout(() => {
+                document.getElementById('progressArea').style.display = 'none';
+            }, 3000);
+        }
+    }
+
+    appendServerLogs(lines, replace = false) {
+        const logsElement = document.getElementById('logs');
+        const text = lines.map(line => `${line}\n`).join('');
+        logsElement.textContent = replace ? text : logsElement.textContent + text;
+        logsElement.scrollTop = logsElement.scrollHeight;
+    }
+
+    async resyncStatus() {
+        // Missed events dropped out of the server history - take a full snapshot
+        const response = await fetch(`/status?job=${this.currentJobId}`);
+        const data = await response.json();
+        this.lastSeq = data.seq;
+        this.appendServerLogs(data.logs, true);
+        this.handleJobUpdate(data.job);
+    }
+
+    startStatusPolling() {
+        // Prefer the pushed event stream; EventSource resumes with Last-Event-ID by itself
+        if (window.EventSource) {
+            this.eventSource = new EventSource(`/events?since=${this.lastSeq}`);
+            this.eventSource.addEventListener('job', (e) => this.handleJobUpdate(JSON.parse(e.data)));
+            this.eventSource.addEventListener('log', (e) => this.appendServerLogs([JSON.parse(e.data).line]));
+            this.eventSource.addEventListener('reset', () => this.resyncStatus());
+            return;
+        }
+        
+        // Fallback: poll for what changed since the last response
+        this.statusInterval = setInterval(async () => {
+            try {
+                const response = await fetch(`/status?job=${this.currentJobId}&since=${this.lastSeq}`);
+                const data = await response.json();
+                this.lastSeq = data.seq;
+                
+                if (data.logs && data.logs.length > 0) {
+                    this.appendServerLogs(data.logs, Boolean(data.reset));
+                }
+                this.handleJobUpdate(data.job);
+                
+            } catch (error) {
+                console.error('Status polling error:', error);
+            }
+        }, 1000);
+    }
+
+    stopStatusUpdates() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+        if (this.statusInterval) {
+            clearInterval(this.statusInterval);
+            this.statusInterval = null;
+        }
+    }
+}
+
+// Initialize the application when DOM is loaded
+document.addEventListener('DOMContentLoaded', () => {
+    new LabelPrinter();
+});
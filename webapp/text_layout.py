@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Text-fit layout engine for Brother QL-700 labels
+Wraps text and picks the largest fitting font size without rasterizing anything,
+and draws laid-out lines from cached per-word glyph masks
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+import logging
+import math
+import PIL
+from PIL import ImageFont
+
+try:
+    from . import font_utils, metrics
+except ImportError:
+    import font_utils
+    import metrics
+
+# Cache sizes: individual word advances, and finished layouts per (text, box, font)
+WORD_CACHE_SIZE = 65536
+LAYOUT_CACHE_SIZE = 4096
+# Rasterized words kept for draw_line (a 14px word mask is well under 1 KB)
+MASK_CACHE_SIZE = 16384
+
+# draw_line blits through Pillow internals (ImageDraw._getink, ImageDraw.draw.draw_bitmap,
+# getmask2(start=...)), checked pixel for pixel against ImageDraw.text on Pillow 9.5 - 12.x.
+# Cleared on the first Pillow that lacks them, and draw_line then uses ImageDraw.text.
+_blit_words = True
+
+logger = logging.getLogger(__name__)
+
+TextLayout = namedtuple('TextLayout', ['font', 'size', 'lines', 'line_height', 'fits'])
+
+
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def text_width(font, text):
+    """Advance width of a word or line in pixels, cached per font face"""
+    return font.getlength(text)
+
+
+@lru_cache(maxsize=256)
+def line_height(font, leading=0, metric='size'):
+    """
+    Height of one line of text
+
+    Args:
+        font: Font face
+        leading: Extra pixels added between lines
+        metric: 'size' uses the nominal font size, 'ink' the inked height of "Ay"
+
+    Returns:
+        Line height in pixels
+    """
+    if metric == 'ink':
+        bbox = font.getbbox("Ay")
+        return (bbox[3] - bbox[1]) + leading
+    return getattr(font, 'size', 24) + leading
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _wrap(text, font, max_width):
+    space = text_width(font, ' ')
+    lines = []
+    current_line = []
+    current_width = 0
+
+    for word in text.split():
+        word_width = text_width(font, word)
+        if not current_line:
+            # First word on a line is placed even if it is too long
+            current_line = [word]
+            current_width = word_width
+        elif current_width + space + word_width <= max_width:
+            current_line.append(word)
+            current_width += space + word_width
+        else:
+            lines.append(' '.join(current_line))
+            current_line = [word]
+            current_width = word_width
+
+    if current_line:
+        lines.append(' '.join(current_line))
+
+    return tuple(lines)
+
+
+def wrap_text(text, font, max_width):
+    """Wrap text to fit within max_width, returning a list of lines"""
+    return list(_wrap(text, font, max_width))
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _fit(text, max_width, sizes, max_lines, max_height, leading, metric, bold):
+    def attempt(size):
+        font = font_utils.get_font(size, bold=bold)
+        lines = _wrap(text, font, max_width)
+        height = line_height(font, leading, metric)
+        fits = ((max_lines is None or len(lines) <= max_lines) and
+                (max_height is None or len(lines) * height <= max_height))
+        return TextLayout(font, size, lines, height, fits)
+
+    # Sizes are largest first and a smaller size never needs more lines,
+    # so binary search for the first (largest) size that fits
+    best = None
+    low, high = 0, len(sizes) - 1
+    while low <= high:
+        mid = (low + high) // 2
+        layout = attempt(sizes[mid])
+        if layout.fits:
+            best = layout
+            high = mid - 1
+        else:
+            low = mid + 1
+
+    if best is None:
+        # Nothing fits - fall back to the smallest size
+        best = attempt(sizes[-1])
+    return best
+
+
+@metrics.timed('text_fit')
+def fit_text(text, max_width, sizes, max_lines=None, max_height=None, leading=0, metric='size', bold=True):
+    """
+    Find the largest font size at which text wraps into the given box
+
+    Args:
+        text: Text to lay out
+        max_width: Maximum line width in pixels
+        sizes: Candidate font sizes
+        max_lines: Maximum number of lines (optional)
+        max_height: Maximum total text height in pixels (optional)
+        leading: Extra pixels between lines
+        metric: Line height metric, 'size' or 'ink' (see line_height)
+        bold: Use the bold font
+
+    Returns:
+        TextLayout(font, size, lines, line_height, fits) - if no size fits,
+        the smallest size is returned with fits=False
+    """
+    sizes = tuple(sorted(set(sizes), reverse=True))
+    return _fit(text, max_width, sizes, max_lines, max_height, leading, metric, bold)
+
+
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def _advance(font, word, fontmode):
+    # Hinting differs between antialiased and 1-bit rendering, so advances are per fontmode
+    return font.getlength(word, fontmode)
+
+
+@lru_cache(maxsize=MASK_CACHE_SIZE)
+def _word_mask(font, word, fontmode, start):
+    return font.getmask2(word, fontmode, start=(start, 0.0))
+
+
+def draw_line(draw, xy, line, font, fill='black'):
+    """
+    Draw one line of text like ImageDraw.text, from cached word masks
+
+    FreeType re-renders every glyph on each ImageDraw.text call; here each
+    word is rasterized once per font, mode and subpixel offset and then
+    blitted, which gives the same pixels as long as the font is laid out
+    without complex shaping (Pillow's basic layout). Falls back to
+    ImageDraw.text on Pillow versions without the internals it uses.
+    """
+    global _blit_words
+    if (not _blit_words or not isinstance(font, ImageFont.FreeTypeFont)
+            or font.layout_engine != ImageFont.Layout.BASIC):
+        draw.text(xy, line, fill=fill, font=font)
+        return
+
+    words = []
+    drawn = 0
+    try:
+        ink = draw._getink(fill)[0]
+        draw_bitmap = draw.draw.draw_bitmap
+        fontmode = draw.fontmode
+        space = _advance(font, ' ', fontmode)
+        x, y = xy
+        y_int = int(y)
+        # Every mask first, so a failure falls back before anything is drawn
+        for word in line.split(' '):
+            if word:
+                mask, offset = _word_mask(font, word, fontmode, math.modf(x)[0])
+                words.append(((int(x) + offset[0], y_int + offset[1]), mask))
+                x += _advance(font, word, fontmode)
+            x += space
+        for position, mask in words:
+            draw_bitmap(position, mask, ink)
+            drawn += 1
+    except (AttributeError, TypeError) as e:
+        if drawn:
+            raise
+        logger.warning(f"Cached word drawing unavailable with Pillow {PIL.__version__} ({e}); using ImageDraw.text")
+        _blit_words = False
+        draw.text(xy, line, fill=fill, font=font)
+
+
+def clear_cache():
+    """Drop all cached widths, layouts and word masks"""
+    text_width.cache_clear()
+    line_height.cache_clear()
+    _wrap.cache_clear()
+    _fit.cache_clear()
+    _advance.cache_clear()
+    _word_mask.cache_clear()